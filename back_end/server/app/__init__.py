@@ -1,29 +1,77 @@
+import os
+import sys
 from flask import Flask
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from flask_socketio import SocketIO
+from sqlalchemy import event
 from .models import db
 
+# Modules shared with the sniffer (e.g. the vendor resolver) live in the sniffer directory
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sniffer"))
+
 bcrypt = Bcrypt()
 jwt = JWTManager()
 socketio = SocketIO(cors_allowed_origins="*")
 
-def populate_device_vendors():
-    from .models import DeviceVendor
-    if DeviceVendor.query.count() < 1000:
-        print("Uploading Vendor list")
-        with open("mac_vendor_list.txt", "r") as file:
-            for line in file:
-                parts = line.strip().split(" - ")
-                if len(parts) == 3:
-                    _, mac_prefix, vendor = parts
-                    if not DeviceVendor.query.get(mac_prefix):
-                        db.session.add(DeviceVendor(mac_address_prefix=mac_prefix, vendor_name=vendor))
-        db.session.commit()
-        print("Vendor list uploaded!")
-
-    print("Vendor list is already uploaded")
+VENDOR_LIST_HASH_KEY = "vendor_list_sha256"
+
+def populate_device_vendors(path: str = None):
+    """
+        Bulk loads mac_vendor_list.txt into the device_vendor table.
+        The file is parsed in one pass. The old rows are deleted and the file is written with a
+        single INSERT OR IGNORE executemany in the same transaction, so renamed and dropped
+        vendors of a new list do not linger. A hash of the file is stored afterwards, so later
+        start ups with the same file skip the work entirely.
+
+        :param path: vendor list to load, mac_vendor_list.txt by default.
+    """
+    from .models import DeviceVendor, AppMetadata
+    from vendors import parse_vendor_file, vendor_file_hash, VENDOR_LIST_PATH
+
+    path = path or VENDOR_LIST_PATH
+    file_hash = vendor_file_hash(path)
+    stored_hash = db.session.get(AppMetadata, VENDOR_LIST_HASH_KEY)
+    if stored_hash is not None and stored_hash.value == file_hash:
+        print("Vendor list is already uploaded")
+        return
+
+    print("Uploading Vendor list")
+    rows = [{"mac_address_prefix": mac_prefix, "vendor_name": vendor} for mac_prefix, vendor in parse_vendor_file(path)]
+    db.session.execute(DeviceVendor.__table__.delete())
+    db.session.execute(DeviceVendor.__table__.insert().prefix_with("OR IGNORE"), rows)
+    db.session.merge(AppMetadata(key=VENDOR_LIST_HASH_KEY, value=file_hash))
+    db.session.commit()
+    print(f"Vendor list uploaded! ({len(rows)} prefixes)")
+
+def create_missing_columns():
+    """
+        create_all does not change existing tables either, columns added to a model after its
+        table was created are added here. Such columns need a server default for the existing rows.
+    """
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                definition = f"{column.name} {column.type.compile(db.engine.dialect)}"
+                if column.server_default is not None:
+                    definition += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    definition += " NOT NULL"
+                connection.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+
+def create_missing_indexes():
+    """
+        create_all only creates indexes together with new tables, databases created before
+        an index was added to a model get it here.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
 
 def create_app():
     app = Flask(__name__)
@@ -35,15 +83,22 @@ def create_app():
     jwt.init_app(app)
 
     with app.app_context():
-        from .models import User, Device, Logs, DeviceVendor  # Ensure all models are imported
+        # Same WAL mode and tuning as the sniffer's connection pool, before the first connection is made
+        from dbpool import configure_connection
+        event.listen(db.engine, "connect", lambda dbapi_connection, _: configure_connection(dbapi_connection))
+
+        from .models import User, Device, Logs, DeviceVendor, ScanCounter, AppMetadata, Sighting, SightingRollup, NotificationThrottle, PresenceEstimate, IngestBatch, ScanSession, ChangeCounter  # Ensure all models are imported
 
         db.create_all()
+        create_missing_columns()
+        create_missing_indexes()
         populate_device_vendors()
 
     from .routes import main_bp, websocket_handle_connect, websocket_start_scan, websocket_stop_scan, websocket_handle_disconnect
     app.register_blueprint(main_bp)
 
-    socketio.init_app(app)
+    from .message_queue import socketio_queue_options
+    socketio.init_app(app, **socketio_queue_options(app.config.get("SOCKETIO_MESSAGE_QUEUE")))
     socketio.on_event("websocket_handle_connect", websocket_handle_connect)
     socketio.on_event("websocket_start_scan", websocket_start_scan)
     socketio.on_event("websocket_stop_scan", websocket_stop_scan)
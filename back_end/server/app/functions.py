@@ -30,5 +30,5 @@ def set_websocket_connected(path: str, value: bool):
 
 def query_mac_vendors_api(mac_address: str) -> str:
     url = f"https://api.macvendors.com/{mac_address}"
-    response = requests.get(url)
+    response = requests.get(url, timeout=5)
     return response.text if response.status_code == 200 else "Unknown"
\ No newline at end of file
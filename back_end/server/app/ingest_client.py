@@ -0,0 +1,68 @@
+import os
+import time
+import threading
+import subprocess
+
+from config import Config
+from ingest import send_ingest_command
+
+# Seconds to wait for an ingest service started by the server to answer
+SERVICE_START_TIMEOUT = 10.0
+
+# Ingest service started by the server, one start at a time when several batches arrive together
+service_process = None
+service_lock = threading.Lock()
+
+
+def ingest_service_running() -> bool:
+    return send_ingest_command(Config.INGEST_SOCKET, {"command": "ping"}, timeout=0.5) is not None
+
+
+def start_ingest_service(timeout: float = SERVICE_START_TIMEOUT) -> bool:
+    """
+        Starts sniffer/ingest.py with INGEST_WORKERS shards, unless it is running already.
+        A service whose shard or writer died stops itself and is started again here.
+
+        :return running: True once the service answers.
+    """
+    global service_process
+    with service_lock:
+        if ingest_service_running():
+            return True
+
+        if service_process is None or service_process.poll() is not None:
+            # Runs in the server's working directory, like the sniffer, so it writes the same database
+            service_process = subprocess.Popen(["python3", "-u", os.path.join(Config.basedir, "sniffer", "ingest.py"),
+                                                "--socket", Config.INGEST_SOCKET, "--workers", str(Config.INGEST_WORKERS)])
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if ingest_service_running():
+                return True
+            if service_process.poll() is not None:
+                break
+            time.sleep(0.1)
+    return False
+
+
+def submit_ingest_batch(agent_id: str, sequence: int, sightings: list):
+    """
+        Writes a validated batch through the ingest service, see ingest_batch in db.py for the
+        synchronous path it replaces.
+
+        :param sightings: list of dicts with mac_address, timestamp and rssi.
+        :return scan_number: the scan number of the epoch the batch was written in, None when
+            the batch was ingested before.
+        :raises RuntimeError: when the service is not running or did not write the batch.
+    """
+    command = {"command": "ingest", "agent_id": agent_id, "sequence": sequence,
+               "sightings": [[sighting["mac_address"], sighting["timestamp"], sighting["rssi"]] for sighting in sightings]}
+    reply = send_ingest_command(Config.INGEST_SOCKET, command)
+    if reply is None:
+        if not start_ingest_service():
+            raise RuntimeError("Ingest service did not start")
+        reply = send_ingest_command(Config.INGEST_SOCKET, command)
+
+    if reply is None or "error" in reply:
+        raise RuntimeError(reply["error"] if reply else "Ingest service did not answer")
+    return reply["scan_number"]
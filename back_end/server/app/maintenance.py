@@ -0,0 +1,30 @@
+import time
+from config import Config
+from db import rollup_sightings, prune_sightings
+
+
+def run_sighting_maintenance():
+    """
+        Keeps the sighting history small and fast to query.
+        Folds new raw sightings into the minute/hour/day rollups, then applies the
+        retention policy, once every SIGHTINGS_ROLLUP_INTERVAL seconds. run.py runs it in a
+        process of its own, the rollups are blocking SQLite work over up to 100k rows that
+        would stall every socket of a server worker.
+    """
+    while True:
+        try:
+            rolled_up = 0
+            while True:
+                batch = rollup_sightings()
+                rolled_up += batch
+                if batch == 0:
+                    break
+
+            deleted = prune_sightings(Config.SIGHTINGS_RETENTION_DAYS, Config.MINUTE_ROLLUP_RETENTION_DAYS,
+                                      Config.INGEST_BATCH_RETENTION_DAYS)
+            if rolled_up or deleted:
+                print(f"Sightings rolled up: {rolled_up}, raw sightings pruned: {deleted}")
+        except Exception as e:
+            print(f"Error in sighting maintenance: {e}")
+
+        time.sleep(Config.SIGHTINGS_ROLLUP_INTERVAL)
@@ -0,0 +1,190 @@
+"""
+    Socket.IO message queue for the server workers of run.py.
+
+    With several workers every Socket.IO server only knows its own clients. Through a message
+    queue an emit on one worker reaches clients connected to any of them, e.g. the scan updates
+    a worker relays for a client whose stop request went to another worker. SOCKETIO_MESSAGE_QUEUE
+    takes the URLs Flask-SocketIO supports (redis://, kafka://, amqp:// with their client packages
+    installed), or unix://<path> for the local broker below, which needs no extra service and is
+    what run.py uses by default when it starts more than one worker.
+
+    The broker is a UNIX socket that repeats every line a worker publishes to all subscribed
+    workers. Like a Redis channel it keeps nothing: a worker that is reconnecting misses what was
+    published in the meantime.
+"""
+
+import os
+import json
+import uuid
+import time
+import socket
+import threading
+from socketio import PubSubManager
+from service_socket import lock_service_socket, bind_service_socket
+
+# Seconds a subscriber waits before reconnecting to the broker
+RECONNECT_DELAY = 1.0
+# Seconds the broker waits on a subscriber that does not read before it drops it
+SEND_TIMEOUT = 5.0
+SUBSCRIBE = b"subscribe\n"
+
+
+class UnixSocketManager(PubSubManager):
+    """
+        Socket.IO client manager publishing through the local broker.
+
+        :param url: unix:// followed by the broker's socket path.
+    """
+    name = "unix"
+
+    def __init__(self, url: str, channel: str = "flask-socketio", write_only: bool = False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.socket_path: str = url[len("unix://"):]
+        self.publisher = None
+        self.publish_lock = threading.Lock()
+
+    def open_connection(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.socket_path)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+    def _publish(self, data):
+        line = (json.dumps({"channel": self.channel, "data": data}) + "\n").encode("utf-8")
+        with self.publish_lock:
+            # Once more on a fresh connection, the broker may have restarted since the last message
+            for attempt in range(2):
+                try:
+                    if self.publisher is None:
+                        self.publisher = self.open_connection()
+                    self.publisher.sendall(line)
+                    return
+                except OSError as e:
+                    if self.publisher is not None:
+                        self.publisher.close()
+                        self.publisher = None
+                    if attempt:
+                        print(f"Socket.IO message not published: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                connection = self.open_connection()
+            except OSError as e:
+                print(f"Socket.IO message broker unreachable: {e}")
+                time.sleep(RECONNECT_DELAY)
+                continue
+
+            with connection:
+                try:
+                    connection.sendall(SUBSCRIBE)
+                    for line in connection.makefile("rb"):
+                        try:
+                            message = json.loads(line)
+                        except ValueError:
+                            continue
+                        if message.get("channel") == self.channel:
+                            yield message["data"]
+                except OSError:
+                    pass
+            time.sleep(RECONNECT_DELAY)
+
+
+def socketio_queue_options(url: str) -> dict:
+    """
+        init_app options for SOCKETIO_MESSAGE_QUEUE, none when it is not set.
+    """
+    if not url:
+        return {}
+    if url.startswith("unix://"):
+        return {"client_manager": UnixSocketManager(url)}
+    return {"message_queue": url}
+
+
+def renew_host_id(socketio):
+    """
+        Gives a worker forked from the app of run.py an id of its own. The managers skip
+        messages that carry their own id, workers sharing one would drop each other's emits.
+    """
+    manager = socketio.server.manager
+    if isinstance(manager, PubSubManager):
+        manager.host_id = uuid.uuid4().hex
+
+
+class MessageBroker():
+    """
+        The local broker, run by run.py in a process of its own.
+    """
+    def __init__(self, socket_path: str):
+        self.socket_path: str = socket_path
+        self.subscribers: list = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    def serve_forever(self):
+        """
+            :raises RuntimeError: when another broker serves the socket.
+        """
+        lock_file = lock_service_socket(self.socket_path)
+        self.server = bind_service_socket(self.socket_path)
+        print(f"Socket.IO message broker listening on {self.socket_path}")
+
+        try:
+            while True:
+                connection, _ = self.server.accept()
+                threading.Thread(target=self.handle_client, args=(connection,), daemon=True).start()
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            lock_file.close()
+
+    def handle_client(self, connection):
+        """
+            A subscriber sends SUBSCRIBE first and then only reads, anything else is a publisher.
+        """
+        with connection:
+            lines = connection.makefile("rb")
+            try:
+                first = lines.readline()
+                if first == SUBSCRIBE:
+                    connection.settimeout(SEND_TIMEOUT)
+                    with self.lock:
+                        self.subscribers.append(connection)
+                    # The timeout bounds sends, reading only waits for the subscriber to go away
+                    while True:
+                        try:
+                            if not connection.recv(1):
+                                break
+                        except socket.timeout:
+                            continue
+                else:
+                    self.publish(first)
+                    for line in lines:
+                        self.publish(line)
+            except OSError:
+                pass
+            finally:
+                with self.lock:
+                    if connection in self.subscribers:
+                        self.subscribers.remove(connection)
+
+    def publish(self, line: bytes):
+        # Sent under the lock, so every subscriber gets the messages in the same order
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.sendall(line)
+                except OSError:
+                    self.subscribers.remove(subscriber)
+                    subscriber.close()
+
+
+def run_message_broker(socket_path: str):
+    try:
+        MessageBroker(socket_path).serve_forever()
+    except RuntimeError as e:
+        print(e)
@@ -12,6 +12,10 @@ class User(db.Model):
 
 class Device(db.Model):
     __tablename__ = 'device'
+    __table_args__ = (
+        db.Index('ix_device_email', 'email'),
+        db.Index('ix_device_vendor', 'device_vendor', 'mac_address'),
+    )
     mac_address = db.Column(db.String, primary_key=True)
     device_vendor = db.Column(db.String, nullable=False, default='Unknown')
     device_name = db.Column(db.String, nullable=False)
@@ -20,6 +24,14 @@ class Device(db.Model):
 
 class Logs(db.Model):
     __tablename__ = 'logs'
+    # Keyset pagination walks (last_seen, mac_address), optionally within a vendor or target filter
+    __table_args__ = (
+        db.Index('ix_logs_last_seen', 'last_seen', 'mac_address'),
+        db.Index('ix_logs_vendor_last_seen', 'device_vendor', 'last_seen', 'mac_address'),
+        db.Index('ix_logs_target_last_seen', 'target_device', 'last_seen', 'mac_address'),
+        # Delta syncs fetch the rows changed since a change sequence
+        db.Index('ix_logs_change_seq', 'change_seq'),
+    )
     mac_address = db.Column(db.String, primary_key=True)
     device_vendor = db.Column(db.String, nullable=False, default='Unknown')
     target_device = db.Column(db.Boolean, default=False, server_default='0')
@@ -27,8 +39,86 @@ class Logs(db.Model):
     last_seen = db.Column(db.Integer, nullable=False)
     count = db.Column(db.Integer, nullable=False)
     scan_number = db.Column(db.Integer, nullable=False)
+    # Value of change_counter when the row was last written
+    change_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class Sighting(db.Model):
+    __tablename__ = 'sighting'
+    # AUTOINCREMENT keeps ids growing after old rows are pruned, the rollup watermark relies on it
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    mac_address = db.Column(db.String, nullable=False)
+    scan_number = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.Integer, nullable=False, index=True)
+    rssi = db.Column(db.Integer)
+
+class SightingRollup(db.Model):
+    __tablename__ = 'sighting_rollup'
+    __table_args__ = (db.Index('ix_sighting_rollup_mac', 'bucket', 'mac_address', 'bucket_start'),)
+    bucket = db.Column(db.String, primary_key=True)
+    bucket_start = db.Column(db.Integer, primary_key=True)
+    mac_address = db.Column(db.String, primary_key=True)
+    sightings = db.Column(db.Integer, nullable=False)
+    rssi_count = db.Column(db.Integer, nullable=False)
+    rssi_sum = db.Column(db.Integer, nullable=False)
+    rssi_min = db.Column(db.Integer)
+    rssi_max = db.Column(db.Integer)
+    first_seen = db.Column(db.Integer, nullable=False)
+    last_seen = db.Column(db.Integer, nullable=False)
+
+class ScanCounter(db.Model):
+    __tablename__ = 'scan_counter'
+    id = db.Column(db.Integer, primary_key=True)
+    scan_number = db.Column(db.Integer, nullable=False)
+
+class ChangeCounter(db.Model):
+    __tablename__ = 'change_counter'
+    id = db.Column(db.Integer, primary_key=True)
+    change_seq = db.Column(db.Integer, nullable=False)
+
+class NotificationThrottle(db.Model):
+    __tablename__ = 'notification_throttle'
+    email = db.Column(db.String, primary_key=True)
+    mac_address = db.Column(db.String, primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+class PresenceEstimate(db.Model):
+    __tablename__ = 'presence_estimate'
+    mac_address = db.Column(db.String, primary_key=True)
+    rssi = db.Column(db.Float, nullable=False)
+    distance = db.Column(db.Float, nullable=False)
+    presence = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+class IngestBatch(db.Model):
+    __tablename__ = 'ingest_batch'
+    # Batches already written, a resent batch is acknowledged without writing it again
+    agent_id = db.Column(db.String, primary_key=True)
+    sequence = db.Column(db.Integer, primary_key=True)
+    scan_number = db.Column(db.Integer, nullable=False)
+    sightings = db.Column(db.Integer, nullable=False)
+    received_at = db.Column(db.Integer, nullable=False)
+
+class ScanSession(db.Model):
+    __tablename__ = 'scan_session'
+    # Scan each user runs and the server worker relaying it, shared by the workers of run.py
+    user_email = db.Column(db.String, primary_key=True)
+    scan_key = db.Column(db.String, nullable=False)
+    worker_pid = db.Column(db.Integer, nullable=False)
+    pid = db.Column(db.Integer)
+    sid = db.Column(db.String)
+    started_at = db.Column(db.Integer, nullable=False)
+    # Process start times, a pid reused by another process does not match them
+    worker_start_time = db.Column(db.Integer)
+    pid_start_time = db.Column(db.Integer)
 
 class DeviceVendor(db.Model):
     __tablename__ = 'device_vendor'
     mac_address_prefix = db.Column(db.String, primary_key=True)
-    vendor_name = db.Column(db.String, nullable=False)
\ No newline at end of file
+    vendor_name = db.Column(db.String, nullable=False)
+
+class AppMetadata(db.Model):
+    __tablename__ = 'app_metadata'
+    key = db.Column(db.String, primary_key=True)
+    value = db.Column(db.String, nullable=False)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import os
+import select
+import time
+import weakref
+from metrics import REGISTRY
+
+try:
+    from eventlet.patcher import original
+    # The green os.read waits on the hub before every read, the relay already knows when to wait
+    read_fd = original("os").read
+except ImportError:
+    read_fd = os.read
+
+# A batch is sent once the output is drained, once it holds this many lines or bytes,
+# or once its oldest line is this old while the output keeps coming
+MAX_BATCH_LINES = 64
+MAX_BATCH_BYTES = 16 * 1024
+FLUSH_INTERVAL = 0.05
+# Longer lines are split, a scan that never prints a newline cannot grow the buffer without limit.
+# Large enough for any event line, e.g. the digest of matched devices at the end of a scan
+MAX_LINE_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+# How often a relay with no output checks whether it was asked to stop
+IDLE_TIMEOUT = 0.5
+
+# Relays that are running, for the queue depth gauge
+active_relays = weakref.WeakSet()
+
+EMIT_QUEUE_DEPTH = REGISTRY.gauge("dashboard_websocket_emit_queue_depth", "Scan output lines read but not yet emitted to websocket clients",
+                                  function=lambda: sum(len(relay.batch) for relay in list(active_relays)))
+EMIT_BATCH_LINES = REGISTRY.histogram("dashboard_websocket_emit_batch_lines", "Lines per scan_update frame",
+                                      buckets=(1, 2, 4, 8, 16, 32, 64))
+EMIT_DURATION = REGISTRY.histogram("dashboard_websocket_emit_seconds", "Time to hand one scan_update batch to Socket.IO")
+
+
+class OutputRelay():
+    """
+        Relays the output of a scan to its websocket client in batches.
+        Reads whatever output is ready without blocking and otherwise waits on select() until
+        there is more, instead of polling and sleeping. Under eventlet select() is green, so
+        every idle relay is just a parked greenlet. Complete lines are collected and passed
+        to emit as one list per batch, output that piles up while the relay waits for its
+        turn goes out as one frame instead of one per line.
+
+        :param stream: object with fileno(), a subprocess stdout or a DaemonScan output.
+        :param emit: called with a list of lines for every batch.
+        :param stop_event: set to stop relaying before the output ends.
+    """
+    def __init__(self, stream, emit, stop_event=None, flush_interval: float = FLUSH_INTERVAL,
+                 max_batch_lines: int = MAX_BATCH_LINES, max_batch_bytes: int = MAX_BATCH_BYTES):
+        self.fd: int = stream.fileno()
+        os.set_blocking(self.fd, False)
+        self.emit = emit
+        self.stop_event = stop_event
+        self.flush_interval: float = flush_interval
+        self.max_batch_lines: int = max_batch_lines
+        self.max_batch_bytes: int = max_batch_bytes
+
+        self.partial: bytes = b""
+        self.batch: list = []
+        self.batch_bytes: int = 0
+        self.batch_started = None
+        active_relays.add(self)
+
+    def run(self) -> bool:
+        """
+            Relays until the output ends or the stop event is set.
+
+            :return finished: True when the output ended, False when the relay was stopped.
+        """
+        try:
+            while self.stop_event is None or not self.stop_event.is_set():
+                try:
+                    data = read_fd(self.fd, READ_SIZE)
+                except BlockingIOError:
+                    data = None
+
+                if data:
+                    self.feed(data)
+                    if self.batch_started is not None and time.monotonic() - self.batch_started >= self.flush_interval:
+                        self.flush()
+                        # Output that never drains would otherwise keep the other greenlets waiting
+                        time.sleep(0)
+                elif data is not None:
+                    return True
+                else:
+                    # Everything that was ready has been read, send it before waiting for more
+                    self.flush()
+                    select.select([self.fd], [], [], IDLE_TIMEOUT)
+            return False
+        finally:
+            if self.partial:
+                self.add_line(self.partial)
+                self.partial = b""
+            self.flush()
+            active_relays.discard(self)
+
+    def feed(self, data: bytes):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.add_line(line)
+
+        while len(self.partial) > MAX_LINE_BYTES:
+            self.add_line(self.partial[:MAX_LINE_BYTES])
+            self.partial = self.partial[MAX_LINE_BYTES:]
+
+    def add_line(self, line: bytes):
+        if len(line) > MAX_LINE_BYTES:
+            for start in range(0, len(line), MAX_LINE_BYTES):
+                self.add_line(line[start:start + MAX_LINE_BYTES])
+            return
+
+        line = line.decode("utf-8", errors="replace").strip()
+        if not line:
+            return
+
+        if self.batch_started is None:
+            self.batch_started = time.monotonic()
+        self.batch.append(line)
+        self.batch_bytes += len(line)
+        if len(self.batch) >= self.max_batch_lines or self.batch_bytes >= self.max_batch_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            batch, self.batch = self.batch, []
+            started = time.perf_counter()
+            self.emit(batch)
+            EMIT_DURATION.observe(time.perf_counter() - started)
+            EMIT_BATCH_LINES.observe(len(batch))
+        self.batch_bytes = 0
+        self.batch_started = None
@@ -1,15 +1,28 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, current_app
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity, verify_jwt_in_request, decode_token
 from flask_bcrypt import Bcrypt
-from flask_socketio import emit, disconnect
+from flask_socketio import emit, disconnect, join_room
 import threading
 import subprocess
+import base64
+import json
+import hmac
+import zlib
+import math
 from datetime import datetime
 
 from config import Config
-from .models import Device, User, Logs, DeviceVendor, db
+from .models import Device, User, Logs, DeviceVendor, SightingRollup, ScanCounter, ChangeCounter, PresenceEstimate, db
 from . import socketio
 from .functions import set_websocket_connected, query_mac_vendors_api
+from vendors import get_resolver, normalize_mac
+from db import fetch_logs_changed_since, ingest_batch
+from events import decode_event, describe_event, LOGS_UPDATED, METRICS
+from metrics import REGISTRY
+from .scanner_client import DaemonScan, scanner_daemon_running, start_scanner_daemon, send_scanner_command
+from .ingest_client import submit_ingest_batch
+from .scan_registry import register_scan, forget_scan, find_remote_scan
+from .relay import OutputRelay
 import time
 
 main_bp = Blueprint('main', __name__)
@@ -19,6 +32,13 @@ PASSWORD_SALT = Config.PASSWORD_SALT
 processes = {}
 process_threads = {}
 
+ACTIVE_SCANS = REGISTRY.gauge("dashboard_active_scans", "Scans currently relayed to websocket clients",
+                              function=lambda: len(processes))
+INGEST_BATCHES = REGISTRY.counter("dashboard_ingest_batches_total", "Sighting batches written from sensor agents")
+INGEST_DUPLICATES = REGISTRY.counter("dashboard_ingest_duplicates_total", "Batches an agent sent again, acknowledged without writing them")
+INGEST_SIGHTINGS = REGISTRY.counter("dashboard_ingest_sightings_total", "Sightings written from sensor agents")
+INGEST_DURATION = REGISTRY.histogram("dashboard_ingest_seconds", "Time to decode and write one ingest batch")
+
 scan_thread = threading.Event()
 stop_scan_event = threading.Event()
 
@@ -34,6 +54,73 @@ def is_token_expired(decoded_token):
 
 
 
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or not values:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def int_arg(name: str, default=None):
+    """
+        Reads an integer from the query string. A value that is not an integer is an error,
+        not the same as leaving the parameter out.
+    """
+    value = request.args.get(name, "")
+    if value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+def parse_page_args(cursor_types: tuple):
+    """
+        Reads limit and cursor for keyset pagination from the query string.
+
+        :param cursor_types: type of every value of the route's sort key, a cursor that does
+            not match them is invalid instead of reaching the query.
+        :return limit, cursor: page size and the decoded cursor values (None on the first page).
+    """
+    limit = int_arg("limit", DEFAULT_PAGE_SIZE)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    cursor = request.args.get("cursor")
+    if not cursor:
+        return limit, None
+    values = decode_cursor(cursor)
+    # bool is an int to isinstance, but never a sort key
+    if len(values) != len(cursor_types) or any(isinstance(value, bool) or not isinstance(value, value_type)
+                                               for value, value_type in zip(values, cursor_types)):
+        raise ValueError("Invalid cursor")
+    return limit, values
+
+
+def split_page(rows: list, limit: int, cursor_values):
+    """
+        Rows are fetched with limit + 1 to find out whether another page exists without a count.
+
+        :param cursor_values: function returning the sort key of a row.
+        :return page, next_cursor: the rows of this page and the cursor of the next one, or None.
+    """
+    page = rows[:limit]
+    next_cursor = encode_cursor(cursor_values(page[-1])) if len(rows) > limit else None
+    return page, next_cursor
+
+
 @main_bp.route("/register", methods=["POST"])
 def register():
     try:
@@ -123,10 +210,29 @@ def delete_user(user_id):
 @main_bp.route('/devices', methods=['GET'])
 @jwt_required()
 def get_all_devices():
+    """
+        Returns one page of registered devices ordered by MAC Address.
+        Query parameters: limit, cursor (next_cursor of the previous page), vendor, email.
+    """
+    try:
+        limit, cursor = parse_page_args((str,))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     try:
-        devices = Device.query.all()
-        device_list = [{"mac_address": d.mac_address, "device_vendor": d.device_vendor, "device_name": d.device_name, "date_added": d.date_added, "email": d.email} for d in devices]
-        return jsonify(device_list), 200
+        query = Device.query
+        if request.args.get("vendor"):
+            query = query.filter(Device.device_vendor == request.args["vendor"])
+        if request.args.get("email"):
+            query = query.filter(Device.email == request.args["email"])
+        if cursor:
+            query = query.filter(Device.mac_address > cursor[0])
+
+        devices = query.order_by(Device.mac_address).limit(limit + 1).all()
+        page, next_cursor = split_page(devices, limit, lambda d: [d.mac_address])
+
+        device_list = [{"mac_address": d.mac_address, "device_vendor": d.device_vendor, "device_name": d.device_name, "date_added": d.date_added, "email": d.email} for d in page]
+        return jsonify({"items": device_list, "next_cursor": next_cursor}), 200
     except Exception as e:
         print(f"Error in get_all_devices: {e}")
         return jsonify({"message": "An error occurred, please try again later"}), 500
@@ -141,11 +247,47 @@ def delete_device(mac_address):
 
         db.session.delete(device)
         db.session.commit()
+        send_scanner_command({"command": "reload"})
         return jsonify({"message": "Device deleted successfully"}), 200
     except Exception as e:
         print(f"Error in delete_device: {e}")
         return jsonify({"message": "An error occurred, please try again later"}), 500
     
+# Seconds a prefix api.macvendors.com has no vendor for is not asked about again
+VENDOR_MISS_TTL = 24 * 60 * 60
+vendor_api_misses = {}
+vendor_api_lock = threading.Lock()
+
+
+def resolve_device_vendor(app, mac_address: str):
+    """
+        Asks api.macvendors.com for the vendor of a device the vendor list does not know and
+        stores it on the device. Runs after add_device answered, the request does not wait on
+        the external lookup.
+
+        :param app: the Flask app, the lookup runs outside of the request.
+    """
+    prefix = mac_address.lower()[:8]
+    with vendor_api_lock:
+        missed_at = vendor_api_misses.get(prefix)
+        if missed_at is not None and time.time() - missed_at < VENDOR_MISS_TTL:
+            return
+
+    try:
+        device_vendor = query_mac_vendors_api(prefix)
+    except Exception as e:
+        print(f"Error querying the vendor of {mac_address}: {e}")
+        return
+    if device_vendor == "Unknown":
+        with vendor_api_lock:
+            vendor_api_misses[prefix] = time.time()
+        return
+
+    with app.app_context():
+        Device.query.filter_by(mac_address=mac_address, device_vendor="Unknown").update({"device_vendor": device_vendor})
+        db.session.commit()
+
+
 @main_bp.route("/add_device", methods=["POST"])
 @jwt_required()
 def add_device():
@@ -163,19 +305,7 @@ def add_device():
         if not all([mac_address, device_name, device_vendor, date_added, email]):
             return jsonify({"message": "Missing required fields"}), 400
 
-        # Check DeviceVendor table row count
-        vendor_count = DeviceVendor.query.count()
-        print(f"vendor_count: {vendor_count}")
-        if vendor_count > 10000:
-            mac_prefix = mac_address.lower()[:8]
-            print(f"mac_prefix: {mac_prefix}")
-            vendor = DeviceVendor.query.filter_by(mac_address_prefix=mac_prefix).first()
-            if vendor:
-                device_vendor = vendor.vendor_name
-                print(f"device_name: {device_name}")
-            else:
-                device_vendor = query_mac_vendors_api(mac_prefix)
-                print(f"Response: {device_vendor}")
+        device_vendor = get_resolver().lookup(mac_address)
 
         new_device = Device(
             mac_address=mac_address,
@@ -189,6 +319,9 @@ def add_device():
 
         db.session.add(new_device)
         db.session.commit()
+        send_scanner_command({"command": "reload"})
+        if device_vendor == "Unknown":
+            threading.Thread(target=resolve_device_vendor, args=(current_app._get_current_object(), mac_address), daemon=True).start()
 
         return jsonify({"message": "Device added successfully"}), 201
     except Exception as e:
@@ -196,11 +329,67 @@ def add_device():
         return jsonify({"message": "An error occurred, please try again later"}), 500
 
 
+def get_logs_high_water_mark() -> dict:
+    change_counter = db.session.get(ChangeCounter, 1)
+    scan_counter = db.session.get(ScanCounter, 1)
+    last_seen = db.session.query(db.func.max(Logs.last_seen)).scalar()
+    return {"change_seq": change_counter.change_seq if change_counter else 0,
+            "scan_number": scan_counter.scan_number if scan_counter else 0, "last_seen": last_seen or 0}
+
+
 @main_bp.route("/logs", methods=["GET"])
 @jwt_required()
 def get_all_logs():
+    """
+        Returns one page of logs, most recently seen first.
+        Query parameters: limit, cursor (next_cursor of the previous page), vendor,
+        target (true/false), search (start of the MAC Address or vendor), since and until
+        (last_seen range in unix seconds) and since_change (only rows changed after that
+        change sequence).
+
+        Every response carries the high_water_mark at the time of the read. Clients pass its
+        change_seq back as since_change to fetch only what changed since, whichever scan
+        changed it.
+    """
+    try:
+        limit, cursor = parse_page_args((int, str))
+        since = int_arg("since")
+        until = int_arg("until")
+        since_change = int_arg("since_change")
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     try:
-        logs = Logs.query.all()
+        # Read before the page, rows written in between come back on the next delta instead of being missed
+        high_water_mark = get_logs_high_water_mark()
+
+        # Rows of devices without an RSSI reading have no estimate, distance and presence are null
+        query = db.session.query(Logs, PresenceEstimate).outerjoin(PresenceEstimate, PresenceEstimate.mac_address == Logs.mac_address)
+        if since_change is not None:
+            query = query.filter(Logs.change_seq > since_change)
+        if request.args.get("vendor"):
+            query = query.filter(Logs.device_vendor == request.args["vendor"])
+        if request.args.get("target") is not None:
+            query = query.filter(Logs.target_device == (request.args["target"].lower() in ("1", "true")))
+        if request.args.get("search"):
+            # Prefix match, LIKE is case insensitive in SQLite, any case of the MAC Address matches
+            search = request.args["search"].strip()
+            query = query.filter(db.or_(Logs.mac_address.startswith(search, autoescape=True),
+                                        Logs.device_vendor.startswith(search, autoescape=True)))
+        if since is not None:
+            query = query.filter(Logs.last_seen >= since)
+        if until is not None:
+            query = query.filter(Logs.last_seen <= until)
+        if cursor:
+            last_seen, mac_address = cursor
+            query = query.filter(db.or_(
+                Logs.last_seen < last_seen,
+                db.and_(Logs.last_seen == last_seen, Logs.mac_address < mac_address),
+            ))
+
+        logs = query.order_by(Logs.last_seen.desc(), Logs.mac_address.desc()).limit(limit + 1).all()
+        page, next_cursor = split_page(logs, limit, lambda row: [row[0].last_seen, row[0].mac_address])
+
         logs_list = [
             {
                 "mac_address": log.mac_address,
@@ -210,15 +399,243 @@ def get_all_logs():
                 "last_seen": log.last_seen,
                 "count": log.count,
                 "scan_number": log.scan_number,
+                "distance": estimate.distance if estimate else None,
+                "presence": estimate.presence if estimate else None,
             }
-            for log in logs
+            for log, estimate in page
         ]
-        return jsonify(logs_list), 200
+        return jsonify({"items": logs_list, "next_cursor": next_cursor, "high_water_mark": high_water_mark}), 200
     except Exception as e:
         print(f"Error in get_all_logs: {e}")
         return jsonify({"message": "An error occurred, please try again later"}), 500
 
 
+HISTORY_BUCKETS = ("minute", "hour", "day")
+DEFAULT_HISTORY_SECONDS = 7 * 24 * 3600
+
+
+def parse_history_range():
+    """
+        Reads bucket, start and end (unix seconds) from the query string.
+        Defaults to hourly buckets over the last seven days.
+    """
+    bucket = request.args.get("bucket", "hour")
+    if bucket not in HISTORY_BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(HISTORY_BUCKETS)}")
+
+    end = int_arg("end", int(time.time()))
+    start = int_arg("start", end - DEFAULT_HISTORY_SECONDS)
+    return bucket, start, end
+
+
+@main_bp.route("/logs/history", methods=["GET"])
+@jwt_required()
+def get_logs_history():
+    try:
+        bucket, start, end = parse_history_range()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        rows = db.session.query(
+            SightingRollup.bucket_start,
+            db.func.count(SightingRollup.mac_address),
+            db.func.sum(SightingRollup.sightings),
+        ).filter(
+            SightingRollup.bucket == bucket,
+            SightingRollup.bucket_start.between(start, end),
+        ).group_by(SightingRollup.bucket_start).order_by(SightingRollup.bucket_start).all()
+
+        points = [{"bucket_start": bucket_start, "devices": devices, "sightings": sightings}
+                  for bucket_start, devices, sightings in rows]
+        return jsonify({"bucket": bucket, "start": start, "end": end, "points": points}), 200
+    except Exception as e:
+        print(f"Error in get_logs_history: {e}")
+        return jsonify({"message": "An error occurred, please try again later"}), 500
+
+
+@main_bp.route("/logs/history/<string:mac_address>", methods=["GET"])
+@jwt_required()
+def get_device_history(mac_address):
+    try:
+        bucket, start, end = parse_history_range()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        rollups = SightingRollup.query.filter(
+            SightingRollup.bucket == bucket,
+            SightingRollup.mac_address == mac_address.lower(),
+            SightingRollup.bucket_start.between(start, end),
+        ).order_by(SightingRollup.bucket_start).all()
+
+        points = [
+            {
+                "bucket_start": r.bucket_start,
+                "sightings": r.sightings,
+                "rssi_avg": r.rssi_sum / r.rssi_count if r.rssi_count else None,
+                "rssi_min": r.rssi_min,
+                "rssi_max": r.rssi_max,
+                "first_seen": r.first_seen,
+                "last_seen": r.last_seen,
+            }
+            for r in rollups
+        ]
+        return jsonify({"mac_address": mac_address.lower(), "bucket": bucket, "start": start, "end": end, "points": points}), 200
+    except Exception as e:
+        print(f"Error in get_device_history: {e}")
+        return jsonify({"message": "An error occurred, please try again later"}), 500
+
+
+def ingest_agent():
+    """
+        Agent id of the request's bearer token, None when it is not one of INGEST_TOKENS.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme != "Bearer" or not token:
+        return None
+    for agent_id, agent_token in Config.INGEST_TOKENS.items():
+        if hmac.compare_digest(token.encode("utf-8"), agent_token.encode("utf-8")):
+            return agent_id
+    return None
+
+
+def read_ingest_batch():
+    """
+        Decodes the JSON batch of an ingest request, gzip compressed when Content-Encoding says so.
+        Decompression stops at MAX_INGEST_BYTES, a small body cannot inflate without bound.
+
+        :return agent_id, sequence, sightings: the agent the batch names (None when it names none),
+            its sequence number and its sightings.
+        :raises ValueError: when the body is not a valid batch.
+    """
+    body = request.get_data(cache=False)
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, Config.MAX_INGEST_BYTES)
+        except zlib.error:
+            raise ValueError("Invalid gzip body")
+        if decompressor.unconsumed_tail:
+            raise ValueError("Batch is too large")
+
+    batch = json.loads(body)
+    if not isinstance(batch, dict):
+        raise ValueError("Batch must be a JSON object")
+    sequence, sightings = batch.get("sequence"), batch.get("sightings")
+    if type(sequence) is not int or sequence < 0 or not isinstance(sightings, list):
+        raise ValueError("Batch needs a sequence number and a list of sightings")
+
+    rows = []
+    # last_seen keeps the latest timestamp, one from a clock running ahead would pin it in the future
+    latest_timestamp = time.time() + Config.INGEST_MAX_CLOCK_SKEW
+    for sighting in sightings:
+        if not isinstance(sighting, dict) or not isinstance(sighting.get("mac_address"), str):
+            raise ValueError("Every sighting needs a mac_address")
+        try:
+            timestamp = float(sighting["timestamp"]) if sighting.get("timestamp") is not None else None
+            rssi = int(sighting["rssi"]) if sighting.get("rssi") is not None else None
+        except (TypeError, ValueError):
+            raise ValueError("timestamp and rssi must be numbers")
+        if timestamp is not None:
+            if not math.isfinite(timestamp):
+                raise ValueError("timestamp and rssi must be numbers")
+            timestamp = min(timestamp, latest_timestamp)
+        # Same aa:bb:cc:dd:ee:ff form as the sniffer writes locally
+        rows.append({"mac_address": normalize_mac(sighting["mac_address"]),
+                     "timestamp": timestamp, "rssi": rssi})
+    return batch.get("agent_id"), sequence, rows
+
+
+# Batches of concurrent agents queue here for the write lock. Waiting in SQLite's busy handler
+# instead, with its growing sleeps, left some batches waiting seconds behind later ones.
+ingest_lock = threading.Lock()
+# Seconds ingested batches are collected before dashboards get one logs delta for all of them
+INGEST_BROADCAST_DELAY = 1.0
+ingest_broadcast_state = {"pending": False}
+ingest_broadcast_lock = threading.Lock()
+
+
+def schedule_logs_delta():
+    """
+        Pushes a logs delta shortly after a batch was ingested. Agents post several batches a
+        second between them, a push per batch would re-read the same scans over and over.
+    """
+    with ingest_broadcast_lock:
+        if ingest_broadcast_state["pending"]:
+            return
+        ingest_broadcast_state["pending"] = True
+
+    def broadcast():
+        with ingest_broadcast_lock:
+            ingest_broadcast_state["pending"] = False
+        broadcast_logs_delta()
+
+    timer = threading.Timer(INGEST_BROADCAST_DELAY, broadcast)
+    timer.daemon = True
+    timer.start()
+
+
+@main_bp.route("/ingest", methods=["POST"])
+def ingest():
+    """
+        Takes a batch of sightings from a sensor agent (sniffer/agent.py). Agents authenticate
+        with their own bearer token from INGEST_TOKENS instead of a user login and post
+        {"agent_id", "sequence", "sightings": [{"mac_address", "timestamp", "rssi"}, ...]},
+        usually gzip compressed. A batch that was written before is answered with 200 and
+        duplicate true, so an agent resends a batch until it gets an answer and never twice.
+        With INGEST_WORKERS set, batches are written by the sharded ingest service (sniffer/ingest.py).
+    """
+    agent_id = ingest_agent()
+    if agent_id is None:
+        return jsonify({"message": "Invalid ingest token"}), 401
+    if request.content_length is None or request.content_length > Config.MAX_INGEST_BYTES:
+        return jsonify({"message": "Batch is too large or has no length"}), 413
+
+    started = time.perf_counter()
+    try:
+        batch_agent_id, sequence, sightings = read_ingest_batch()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if batch_agent_id is not None and batch_agent_id != agent_id:
+        return jsonify({"message": "Token does not belong to this agent"}), 403
+
+    try:
+        if Config.INGEST_WORKERS:
+            scan_number = submit_ingest_batch(agent_id, sequence, sightings)
+        else:
+            with ingest_lock:
+                scan_number = ingest_batch(agent_id, sequence, sightings)
+    except Exception as e:
+        print(f"Error in ingest: {e}")
+        return jsonify({"message": "An error occurred, please try again later"}), 500
+
+    if scan_number is None:
+        INGEST_DUPLICATES.inc()
+    else:
+        INGEST_BATCHES.inc()
+        INGEST_SIGHTINGS.inc(len(sightings))
+        schedule_logs_delta()
+    INGEST_DURATION.observe(time.perf_counter() - started)
+    return jsonify({"message": "Batch already ingested" if scan_number is None else "Batch ingested",
+                    "agent_id": agent_id, "sequence": sequence, "duplicate": scan_number is None,
+                    "scan_number": scan_number, "sightings": len(sightings)}), 200
+
+
+@main_bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+        Counters, gauges and histograms of the dashboard and of the scans it relayed, in the
+        Prometheus text format. Unauthenticated like any scrape target, keep it off public
+        networks. Holds no user or device data.
+    """
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# Room of the WebSocket clients that presented a valid token
+DASHBOARD_ROOM = "dashboards"
+
+
 @socketio.on("websocket_handle_connect")
 def websocket_handle_connect():
     token = request.args.get("token")  # Extract token from query params
@@ -239,51 +656,77 @@ def websocket_handle_connect():
         if not user_email:
             raise ValueError("Invalid token payload")
 
+        # Only signed in dashboards get the pushed logs deltas
+        join_room(DASHBOARD_ROOM)
         print(f"User {user_email} connected via WebSocket")
     except Exception as e:
         print(f"WebSocket connection error: {e}")
         disconnect()
 
 
-def process_monitor(user_email, process, stop_event, sid):
-    """Background thread function to monitor process output"""
+# Change sequence up to which logs deltas have been pushed, None until the first push
+logs_delta_state = {"change_seq": None}
+
+
+def broadcast_logs_delta():
+    """
+        Pushes the log rows changed since the last push to every signed in dashboard.
+        The first push after start up sends the latest change only. Every push carries the
+        change_seq it starts after as since, a dashboard whose high water mark is older
+        fetches what it missed from /logs instead of taking the push as complete.
+    """
     try:
-        # Buffer for incomplete lines
-        buffer = ""
-        
-        while process.poll() is None and not stop_event.is_set():
-            # Read from stdout without blocking
-            output = process.stdout.read(4096)
-            if output:
-                # Decode and handle the output
-                text = output.decode('utf-8', errors='replace')
-                buffer += text
-                lines = buffer.split('\n')
-                buffer = lines.pop()  # Keep the last (potentially incomplete) line
-                
-                for line in lines:
-                    if line:  # Only emit non-empty lines
-                        socketio.emit("scan_update", {"message": line.strip()}, room=sid)
+        since = logs_delta_state["change_seq"]
+        high_water_mark, rows = fetch_logs_changed_since(since)
+        if since is None:
+            since = max(high_water_mark["change_seq"] - 1, 0)
+        # Pushes of several monitors may overlap, the older one must not move the mark back
+        logs_delta_state["change_seq"] = max(high_water_mark["change_seq"], logs_delta_state["change_seq"] or 0)
+        if rows:
+            socketio.emit("logs_delta", {"items": rows, "high_water_mark": high_water_mark, "since": since},
+                          to=DASHBOARD_ROOM)
+    except Exception as e:
+        print(f"Error broadcasting logs delta: {e}")
+
+
+def process_monitor(user_email, process, stop_event, sid, scan_key=None):
+    """Background thread function to relay process output to the client in batches"""
+    return_code = None
+
+    def emit_lines(lines):
+        # Decoded once here, the client gets the typed events next to their display text
+        events = []
+        for event in map(decode_event, lines):
+            if event["event"] == METRICS:
+                # Sniffer measurements go to /metrics, not to the scanner page
+                try:
+                    REGISTRY.merge(event["metrics"])
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"Error merging sniffer metrics: {e}")
             else:
-                # Small sleep to prevent CPU hogging when no output
-                socketio.sleep(0.1)
-        
-        # Process any remaining data in the buffer
-        if buffer:
-            socketio.emit("scan_update", {"message": buffer.strip()}, room=sid)
-            
-        # Get return code
-        return_code = process.poll()
-        if return_code is not None:
+                events.append(event)
+        if not events:
+            return
+        socketio.emit("scan_update", {"messages": [describe_event(event) for event in events], "events": events}, room=sid)
+        if any(event["event"] == LOGS_UPDATED for event in events):
+            broadcast_logs_delta()
+
+    try:
+        finished = OutputRelay(process.stdout, emit_lines, stop_event).run()
+
+        if finished:
+            # The output only ends when the scan does
+            return_code = process.wait(timeout=5)
             socketio.emit("scan_update", {"message": f"Process completed Successfully with no Errors."}, room=sid)
         else:
-            # If we got here and the process is still running, terminate it
+            # Stopped before the scan ended, terminate it
             process.terminate()
             try:
                 process.wait(timeout=5)
             except subprocess.TimeoutExpired:
                 process.kill()
                 process.wait()
+            return_code = process.poll()
             socketio.emit("scan_update", {"message": "Process was terminated"}, room=sid)
             
     except Exception as e:
@@ -291,10 +734,13 @@ def process_monitor(user_email, process, stop_event, sid):
     finally:
         # Clean up
         socketio.emit("scan_stop", {"message": f"Process completed with return code {return_code}"}, room=sid)
+        broadcast_logs_delta()
         if user_email in processes:
             # Only delete if it's still the same process
             if processes[user_email] == process:
                 del processes[user_email]
+        if scan_key is not None:
+            forget_scan(user_email, scan_key)
                 
         if user_email in process_threads:
             # Only delete if it's still the same thread
@@ -328,10 +774,10 @@ def websocket_start_scan(data):
 
         print(f"Received settings from {user_email}: packets={packets}, scanTime={scan_time}, theme={theme}")
 
-        # Stop any existing process
-        if user_email in processes and processes[user_email].poll() is None:
+        # Stop any existing process, also one that another server worker relays
+        old_process = processes.get(user_email) or find_remote_scan(user_email)
+        if old_process is not None and old_process.poll() is None:
             try:
-                old_process = processes[user_email]
                 old_process.terminate()
                 old_process.wait(timeout=3)
                 print(f"Terminated existing process for {user_email}")
@@ -340,16 +786,21 @@ def websocket_start_scan(data):
 
         stop_event = threading.Event()
 
-        # You can pass these as env vars or args if needed by your script
-        process = subprocess.Popen(
-            ["python3", "-u", "sniffer/main.py", user_email, packets, scan_time],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=False,
-            bufsize=0
-        )
+        if scanner_daemon_running() or start_scanner_daemon():
+            # The resident scanner owns the adapter, the scan joins its discovery with its own limits
+            process = DaemonScan(packets, scan_time)
+        else:
+            # You can pass these as env vars or args if needed by your script
+            process = subprocess.Popen(
+                ["python3", "-u", "sniffer/main.py", user_email, packets, scan_time],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=False,
+                bufsize=0
+            )
 
         processes[user_email] = process
+        scan_key = register_scan(user_email, process, sid)
         emit("scan_update", {"message": f"Started scanning process (PID: {process.pid})"})
         print(f"Started scanning process (PID: {process.pid}) for {user_email}")
 
@@ -358,7 +809,8 @@ def websocket_start_scan(data):
             user_email=user_email,
             process=process,
             stop_event=stop_event,
-            sid=sid
+            sid=sid,
+            scan_key=scan_key
         )
 
         process_threads[user_email] = (monitor_thread, stop_event)
@@ -389,8 +841,9 @@ def websocket_stop_scan():
             stop_event.set()
             emit("scan_update", {"message": "Stopping scan process..."})
 
-        if user_email in processes:
-            process = processes[user_email]
+        # A scan relayed by another server worker is stopped from here, that worker reports its end
+        process = processes.get(user_email) or find_remote_scan(user_email)
+        if process is not None:
             if process.poll() is None:
                 process.terminate()
                 try:
@@ -430,8 +883,8 @@ def websocket_handle_disconnect(reason_for_disconnect=None):
             stop_event.set()
             del process_threads[user_email]
         
-        if user_email in processes:
-            process = processes[user_email]
+        process = processes.get(user_email) or find_remote_scan(user_email)
+        if process is not None:
             if process.poll() is None:  # Check if process is still running
                 process.terminate()
                 try:
@@ -440,7 +893,7 @@ def websocket_handle_disconnect(reason_for_disconnect=None):
                     process.kill()
                     process.wait()
                 print(f"Stopped process {process.pid}")
-            del processes[user_email]
+            processes.pop(user_email, None)
             
         
     except Exception as e:
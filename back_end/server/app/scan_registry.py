@@ -0,0 +1,132 @@
+"""
+    Scans shared between the server workers of run.py.
+
+    A scan is relayed by the worker the client started it on, its sniffer process (or
+    DaemonScan) only exists in that worker's processes dict. Every worker also records the
+    scans it relays in the scan_session table, so a stop or a disconnect that lands on another
+    worker finds the scan there and ends it through a RemoteScan. The relaying worker then
+    sees the scan end as usual and reports it to the client through the Socket.IO message
+    queue. The workers run on one host and share outputs/devices.db, pids are valid in all of them.
+    A pid is only trusted together with the start time of its process recorded next to it: a
+    row left behind by a worker that died may name pids the system has handed out again since.
+"""
+
+import os
+import time
+import uuid
+import signal
+import subprocess
+
+from db import register_scan_session, fetch_scan_session, delete_scan_session
+from .scanner_client import send_scanner_command
+
+# Seconds between checks whether a remote scan has ended
+POLL_INTERVAL = 0.1
+
+
+def process_start_time(pid: int):
+    """
+        :return start_time: clock ticks after boot the process started at, from /proc, None
+            where there is no /proc or the process is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # The command name in parentheses may hold spaces, starttime is the 22nd field
+            return int(stat.read().rpartition(")")[2].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_alive(pid: int, start_time: int = None) -> bool:
+    """
+        :param start_time: process_start_time at registration, a process started at another
+            time only has the same pid.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return start_time is None or process_start_time(pid) == start_time
+
+
+def register_scan(user_email: str, process, sid: str = None) -> str:
+    """
+        Records a scan this worker started.
+
+        :param process: the sniffer Popen or DaemonScan.
+        :return scan_key: key to pass to forget_scan once the scan ended.
+    """
+    scan_id = getattr(process, "scan_id", None)
+    scan_key = scan_id or uuid.uuid4().hex
+    pid = None if scan_id else process.pid
+    register_scan_session(user_email, scan_key, os.getpid(), pid=pid, sid=sid, worker_start_time=process_start_time(os.getpid()),
+                          pid_start_time=None if pid is None else process_start_time(pid))
+    return scan_key
+
+
+def forget_scan(user_email: str, scan_key: str):
+    delete_scan_session(user_email, scan_key)
+
+
+def find_remote_scan(user_email: str):
+    """
+        The scan of a user that another worker relays. Entries of workers that are gone, or
+        whose pid belongs to another process by now, are dropped on the way.
+
+        :return scan: a RemoteScan, None when no other worker relays a scan of the user.
+    """
+    session = fetch_scan_session(user_email)
+    if session is None or session["worker_pid"] == os.getpid():
+        return None
+    if not process_alive(session["worker_pid"], session["worker_start_time"]):
+        delete_scan_session(user_email, session["scan_key"])
+        return None
+    return RemoteScan(session)
+
+
+class RemoteScan():
+    """
+        A scan relayed by another worker. Mirrors the parts of subprocess.Popen the websocket
+        handlers use, like DaemonScan. It has ended once its worker dropped the scan_session row.
+    """
+    def __init__(self, session: dict):
+        self.session: dict = session
+        self.pid = session["pid"] if session["pid"] is not None else "scanner daemon"
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            current = fetch_scan_session(self.session["user_email"])
+            if current is None or current["scan_key"] != self.session["scan_key"] or \
+                    not process_alive(self.session["worker_pid"], self.session["worker_start_time"]):
+                self.returncode = 0
+        return self.returncode
+
+    def send_signal(self, signum: int):
+        if self.session["pid"] is None:
+            # Scans in the scanner daemon are stopped by their id, whichever worker asks
+            send_scanner_command({"command": "stop", "scan": self.session["scan_key"]})
+            return
+        # The sniffer ended and its pid went to another process, which must not get the signal
+        if not process_alive(self.session["pid"], self.session["pid_start_time"]):
+            return
+        try:
+            os.kill(self.session["pid"], signum)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"scan of {self.session['user_email']}", timeout)
+            time.sleep(POLL_INTERVAL)
+        return self.returncode
@@ -0,0 +1,125 @@
+import json
+import time
+import uuid
+import socket
+import subprocess
+
+from config import Config
+
+# Seconds to wait for a scanner daemon started by the server to answer
+DAEMON_START_TIMEOUT = 5.0
+
+# Scanner daemon started by the server, and whether starting one failed before
+daemon_process = None
+daemon_start_failed = False
+
+
+def send_scanner_command(command: dict, timeout: float = 2.0):
+    """
+        Sends a single command to the resident scanner daemon and returns its reply.
+
+        :param command: command object, e.g. {"command": "reload"}.
+        :return reply: the decoded reply, or None when the daemon is not running.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(Config.SCANNER_SOCKET)
+            connection.sendall((json.dumps(command) + "\n").encode("utf-8"))
+            reply = connection.makefile("r").readline()
+            return json.loads(reply) if reply else None
+    except (OSError, ValueError):
+        return None
+
+
+def scanner_daemon_running() -> bool:
+    return send_scanner_command({"command": "ping"}, timeout=0.5) is not None
+
+
+def start_scanner_daemon(timeout: float = DAEMON_START_TIMEOUT) -> bool:
+    """
+        Starts sniffer/daemon.py, so scans of all users share one discovery on the adapter
+        instead of starting a bluetoothctl each. Not retried once it failed, e.g. in tshark
+        mode, which the daemon does not run.
+
+        :return running: True once the daemon answers.
+    """
+    global daemon_process, daemon_start_failed
+    if daemon_start_failed:
+        return False
+
+    if daemon_process is None or daemon_process.poll() is not None:
+        daemon_process = subprocess.Popen(["python3", "-u", "sniffer/daemon.py", "--socket", Config.SCANNER_SOCKET])
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if scanner_daemon_running():
+            return True
+        if daemon_process.poll() is not None:
+            break
+        time.sleep(0.1)
+
+    print("Scanner daemon did not start, scans run as separate processes")
+    daemon_start_failed = True
+    return False
+
+
+class DaemonScanOutput():
+    """
+        Non blocking reader over the daemon connection, returns b"" when no output is waiting.
+    """
+    def __init__(self, scan):
+        self.scan = scan
+
+    def fileno(self) -> int:
+        return self.scan.connection.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            data = self.scan.connection.recv(size if size > 0 else 4096)
+        except (BlockingIOError, socket.timeout):
+            return b""
+        except OSError:
+            data = b""
+
+        if not data:
+            # The daemon closes the connection once the scan has finished
+            self.scan.returncode = 0
+        return data
+
+
+class DaemonScan():
+    """
+        A scan running inside the resident scanner daemon.
+        Mirrors the parts of subprocess.Popen the websocket handlers use, so a daemon scan
+        can be stored in processes and monitored exactly like a sniffer/main.py child.
+    """
+    def __init__(self, packets, scan_time):
+        self.pid = "scanner daemon"
+        self.returncode = None
+        # Scans of other users run in the same daemon, stop() names this one
+        self.scan_id = uuid.uuid4().hex
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(2.0)
+        self.connection.connect(Config.SCANNER_SOCKET)
+        command = {"command": "start", "scan": self.scan_id, "packets": int(packets), "scan_time": int(scan_time)}
+        self.connection.sendall((json.dumps(command) + "\n").encode("utf-8"))
+        self.connection.setblocking(False)
+        self.stdout = DaemonScanOutput(self)
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        send_scanner_command({"command": "stop", "scan": self.scan_id})
+
+    def kill(self):
+        self.connection.close()
+        self.returncode = -1
+
+    def wait(self, timeout=None):
+        # The daemon finishes the scan and writes its logs on its own after a stop
+        self.connection.close()
+        if self.returncode is None:
+            self.returncode = 0
+        return self.returncode
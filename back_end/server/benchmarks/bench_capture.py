@@ -0,0 +1,67 @@
+"""
+    Benchmark for ingesting nRF Sniffer captures exported from Wireshark as JSON.
+    Compares loading the whole export with json.load and keeping every RSSI per address
+    (the old extract_addresses_and_rssi) with the streaming ingest in sniffer/capture.py.
+
+    Usage (from back_end/server):
+        python benchmarks/bench_capture.py [packets]
+"""
+
+import os
+import sys
+import json
+import tempfile
+import time
+import tracemalloc
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(SERVER_DIR, "sniffer"))
+
+from capture import collect_address_stats, readings_from_json_export
+from feeds import write_tshark_export
+
+PACKETS = 200000
+ADDRESSES = 500
+
+
+def whole_file(path: str) -> int:
+    with open(path) as file:
+        data = json.load(file)
+    rssi_lists = {}
+    for packet in data:
+        layers = packet["_source"]["layers"]
+        address = layers.get("btle", {}).get("btle.advertising_address")
+        rssi = layers.get("nordic_ble", {}).get("nordic_ble.rssi")
+        if address and rssi:
+            rssi_lists.setdefault(address, []).append(int(rssi))
+    return len({address: sum(values) / len(values) for address, values in rssi_lists.items()})
+
+
+def streaming(path: str) -> int:
+    return len(collect_address_stats(readings_from_json_export(path)))
+
+
+def measure(function, path: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    packets = int(sys.argv[1]) if len(sys.argv) > 1 else PACKETS
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.json")
+        write_tshark_export(path, ADDRESSES, packets)
+        print(f"{packets} packets, {os.path.getsize(path) / 1e6:.1f} MB export")
+        print(f"{'ingest':>10} {'seconds':>8} {'peak MB':>8}")
+        for name, function in (("json.load", whole_file), ("streaming", streaming)):
+            addresses, elapsed, peak = measure(function, path)
+            print(f"{name:>10} {elapsed:>8.2f} {peak / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+    Benchmark for presence estimation throughput.
+    Compares a per advert Python Kalman filter with path-loss distance (what a scalar
+    calculate_distance in the scan loop would cost) with the vectorised PresenceEstimator in
+    sniffer/distance.py, fed in the batch size run_tshark uses and in one batch per second.
+    The target is 100k adverts per second on one core.
+
+    Usage (from back_end/server):
+        python benchmarks/bench_distance.py [adverts]
+"""
+
+import os
+import sys
+import math
+import random
+import time
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(SERVER_DIR, "sniffer"))
+
+from distance import PresenceEstimator, MEASUREMENT_NOISE, PROCESS_NOISE, DEFAULT_TX_POWER, PATH_LOSS_EXPONENT
+from sniffer import ESTIMATE_BATCH_SIZE
+
+ADVERTS = 100000
+DEVICES = 500
+
+
+def make_adverts(adverts: int):
+    addresses = [":".join(f"{random.randint(0, 255):02x}" for _ in range(6)) for _ in range(DEVICES)]
+    macs = [random.choice(addresses) for _ in range(adverts)]
+    rssi = [random.randint(-95, -30) for _ in range(adverts)]
+    # One second of traffic
+    timestamps = [i / adverts for i in range(adverts)]
+    return macs, rssi, timestamps
+
+
+def scalar(macs: list, rssi: list, timestamps: list) -> int:
+    state = {}
+    for mac, reading, timestamp in zip(macs, rssi, timestamps):
+        previous = state.get(mac)
+        if previous is None:
+            smoothed, variance = reading, MEASUREMENT_NOISE
+        else:
+            smoothed, variance, last_seen = previous
+            variance += PROCESS_NOISE * (timestamp - last_seen)
+            gain = variance / (variance + MEASUREMENT_NOISE)
+            smoothed += gain * (reading - smoothed)
+            variance *= 1 - gain
+        state[mac] = (smoothed, variance, timestamp)
+        math.pow(10, (DEFAULT_TX_POWER - smoothed) / (10 * PATH_LOSS_EXPONENT))
+    return len(state)
+
+
+def batched(batch_size: int):
+    def run(macs: list, rssi: list, timestamps: list) -> int:
+        estimator = PresenceEstimator()
+        for start in range(0, len(macs), batch_size):
+            end = start + batch_size
+            estimator.update(macs[start:end], rssi[start:end], timestamps[start:end])
+        estimator.estimate()
+        return len(estimator)
+    return run
+
+
+def main():
+    adverts = int(sys.argv[1]) if len(sys.argv) > 1 else ADVERTS
+    macs, rssi, timestamps = make_adverts(adverts)
+    print(f"{adverts} adverts from {DEVICES} devices")
+    print(f"{'estimator':>16} {'seconds':>8} {'adverts/s':>10}")
+    for name, function in (("scalar", scalar), (f"batch {ESTIMATE_BATCH_SIZE}", batched(ESTIMATE_BATCH_SIZE)),
+                           (f"batch {adverts}", batched(adverts))):
+        start = time.perf_counter()
+        function(macs, rssi, timestamps)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>16} {elapsed:>8.3f} {adverts / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+    Microbenchmark for matching scanned MAC Addresses against registered devices.
+    Sweeps the number of scanned and registered devices and compares the old nested loop
+    (a .lower() comparison against every registered device) with the Sniffer device index.
+
+    Usage (from back_end/server):
+        python benchmarks/bench_matcher.py
+"""
+
+import os
+import sys
+import random
+import time
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(SERVER_DIR, "sniffer"))
+
+from sniffer import build_device_index
+
+SCANNED_SIZES = [100, 1000, 10000]
+REGISTERED_SIZES = [10, 100, 1000, 10000]
+# Nested loop runs above this many comparisons take too long to be worth waiting for
+MAX_NESTED_COMPARISONS = 10_000_000
+
+
+def random_mac() -> str:
+    return ":".join(f"{random.randint(0, 255):02X}" for _ in range(6))
+
+
+def nested_loop_match(scanned: list, device_data: list) -> int:
+    matched = 0
+    for mac in scanned:
+        for device in device_data:
+            if device['mac_address'].lower() == mac:
+                matched += 1
+    return matched
+
+
+def index_match(scanned: list, device_index: dict) -> int:
+    matched = 0
+    for mac in scanned:
+        matched += len(device_index.get(mac, []))
+    return matched
+
+
+def main():
+    print(f"{'scanned':>8} {'registered':>11} {'nested ms':>10} {'index ms':>9} {'index build ms':>15}")
+    for registered_size in REGISTERED_SIZES:
+        device_data = [{"mac_address": random_mac(), "device_name": f"Tag {i}", "email": "bench@example.com"}
+                       for i in range(registered_size)]
+
+        start = time.perf_counter()
+        device_index = build_device_index(device_data)
+        build_time = time.perf_counter() - start
+
+        for scanned_size in SCANNED_SIZES:
+            # One in ten scanned devices is a registered one
+            scanned = [random_mac().lower() for _ in range(scanned_size)]
+            for i in range(0, scanned_size, 10):
+                scanned[i] = random.choice(device_data)['mac_address'].lower()
+
+            start = time.perf_counter()
+            indexed = index_match(scanned, device_index)
+            index_time = time.perf_counter() - start
+
+            if scanned_size * registered_size <= MAX_NESTED_COMPARISONS:
+                start = time.perf_counter()
+                nested = nested_loop_match(scanned, device_data)
+                nested_column = f"{(time.perf_counter() - start) * 1000:>10.2f}"
+                assert nested == indexed
+            else:
+                nested_column = f"{'skipped':>10}"
+
+            print(f"{scanned_size:>8} {registered_size:>11} {nested_column} {index_time * 1000:>9.3f} {build_time * 1000:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+    Load test for relaying scan output to websocket clients.
+    Runs 100 simultaneous scan streams under eventlet, each a child process printing
+    timestamped lines, and compares the old poll / read / sleep monitor that emits one frame
+    per line with the select() based OutputRelay that emits batches.
+
+    Usage (from back_end/server):
+        python benchmarks/bench_relay.py [streams] [lines per stream]
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(SERVER_DIR)
+
+from app.relay import OutputRelay
+
+STREAMS = 100
+LINES_PER_STREAM = 200
+# Seconds between lines of one stream, roughly a busy bluetoothctl scan
+LINE_INTERVAL = 0.005
+
+CHILD = """import sys, time
+for i in range(int(sys.argv[1])):
+    print(f"{time.time()} AA:BB:CC:DD:EE:{i % 256:02X}", flush=True)
+    time.sleep(float(sys.argv[2]))
+"""
+
+
+def start_stream(lines: int):
+    return subprocess.Popen([sys.executable, "-u", "-c", CHILD, str(lines), str(LINE_INTERVAL)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+
+
+class Collector():
+    """
+        Stands in for socketio.emit, every frame is encoded like a Socket.IO packet would be.
+    """
+    def __init__(self):
+        self.sent_bytes = 0
+        self.frames = 0
+        self.lines = 0
+        self.latencies = []
+
+    def emit(self, lines: list):
+        self.sent_bytes += len(("42" + json.dumps(["scan_update", {"messages": lines}])).encode("utf-8"))
+        now = time.time()
+        self.frames += 1
+        self.lines += len(lines)
+        for line in lines:
+            self.latencies.append(now - float(line.split(" ", 1)[0]))
+
+
+def legacy_monitor(process, collector: Collector):
+    """
+        The monitor loop process_monitor used before the relay, one frame per line.
+    """
+    buffer = ""
+    while process.poll() is None:
+        output = process.stdout.read(4096)
+        if output:
+            buffer += output.decode("utf-8", errors="replace")
+            lines = buffer.split("\n")
+            buffer = lines.pop()
+            for line in lines:
+                if line:
+                    collector.emit([line.strip()])
+        else:
+            eventlet.sleep(0.1)
+    for line in (buffer + process.stdout.read().decode("utf-8", errors="replace")).split("\n"):
+        if line.strip():
+            collector.emit([line.strip()])
+
+
+def relay_monitor(process, collector: Collector):
+    OutputRelay(process.stdout, collector.emit).run()
+    process.wait()
+
+
+def run(monitor, streams: int, lines: int):
+    collector = Collector()
+    pool = eventlet.GreenPool(streams)
+    start = time.perf_counter()
+    for _ in range(streams):
+        pool.spawn(monitor, start_stream(lines), collector)
+    pool.waitall()
+    elapsed = time.perf_counter() - start
+
+    assert collector.lines == streams * lines, f"lost lines: {collector.lines} of {streams * lines}"
+    latencies = sorted(collector.latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return elapsed, collector.frames, collector.lines, p50, p99
+
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else STREAMS
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else LINES_PER_STREAM
+
+    print(f"{streams} streams x {lines} lines")
+    print(f"{'monitor':>8} {'seconds':>8} {'frames':>8} {'lines':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, monitor in (("legacy", legacy_monitor), ("relay", relay_monitor)):
+        elapsed, frames, total, p50, p99 = run(monitor, streams, lines)
+        print(f"{name:>8} {elapsed:>8.2f} {frames:>8} {total:>8} {p50:>8.1f} {p99:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+    Measures how long update_logs takes per scan as the number of scanned devices grows.
+    Runs against a throwaway database in a temporary directory, the real outputs/devices.db
+    is never touched.
+
+    Usage (from back_end/server):
+        python benchmarks/bench_update_logs.py [scans_per_size]
+"""
+
+import os
+import sys
+import random
+import tempfile
+import time
+import contextlib
+import io
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(SERVER_DIR, "sniffer"))
+
+from db import connect_db, create_tables, update_logs
+from outputs import extract_mac_vendors
+
+SCAN_SIZES = [10, 100, 1000, 10000]
+REGISTERED_DEVICES = 1000
+
+
+def random_mac(prefixes: list) -> str:
+    prefix = random.choice(prefixes).lower()
+    return prefix + ":" + ":".join(f"{random.randint(0, 255):02x}" for _ in range(3))
+
+
+def seed_database(prefixes: list, vendors: list) -> list:
+    """
+        Creates the tables and fills device_vendor, user and device the way a running
+        dashboard would have them.
+
+        :return registered: MAC Addresses stored in the device table.
+    """
+    create_tables()
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR IGNORE INTO device_vendor (mac_address_prefix, vendor_name) VALUES (?, ?)", vendors)
+    cursor.execute("INSERT INTO user (username, password, email) VALUES (?, ?, ?)", ("bench", "bench", "bench@example.com"))
+
+    registered = [random_mac(prefixes) for _ in range(REGISTERED_DEVICES)]
+    cursor.executemany("INSERT OR IGNORE INTO device (mac_address, device_vendor, device_name, date_added, email) VALUES (?, ?, ?, ?, ?)",
+                       [(mac, "Unknown", f"Tag {i}", int(time.time()), "bench@example.com") for i, mac in enumerate(registered)])
+    conn.commit()
+    conn.close()
+    return registered
+
+
+def build_scan(size: int, prefixes: list, registered: list) -> list:
+    # Roughly 1 in 20 adverts belongs to a registered device
+    macs = set(random.sample(registered, min(len(registered), max(1, size // 20))))
+    while len(macs) < size:
+        macs.add(random_mac(prefixes))
+    return [{"mac_address": mac, "device_name": mac, "timestamp": time.time()} for mac in macs]
+
+
+def main():
+    scans_per_size = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with open(os.path.join(SERVER_DIR, "mac_vendor_list.txt")) as file:
+        vendors = extract_mac_vendors(file.read())
+    prefixes = [prefix for prefix, _ in vendors]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        registered = seed_database(prefixes, vendors)
+
+        print(f"{'devices':>8} {'first scan ms':>14} {'repeat scan ms':>15} {'us/device':>10}")
+        for size in SCAN_SIZES:
+            scan = build_scan(size, prefixes, registered)
+            timings = []
+            for _ in range(scans_per_size):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    update_logs(device_list=scan)
+                timings.append(time.perf_counter() - start)
+
+            # The first scan inserts every row, the following ones take the update branch
+            repeat = sorted(timings[1:])[len(timings[1:]) // 2] if len(timings) > 1 else timings[0]
+            print(f"{size:>8} {timings[0] * 1000:>14.2f} {repeat * 1000:>15.2f} {repeat / size * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
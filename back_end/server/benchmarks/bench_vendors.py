@@ -0,0 +1,40 @@
+"""
+    Measures the shared vendor resolver: loading mac_vendor_list.txt and resolving
+    a million MAC Addresses, one at a time and as a batch.
+
+    Usage (from back_end/server):
+        python benchmarks/bench_vendors.py [number_of_macs]
+"""
+
+import os
+import sys
+import random
+import time
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(SERVER_DIR, "sniffer"))
+
+from vendors import VendorResolver
+
+
+def main():
+    number_of_macs = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    start = time.perf_counter()
+    resolver = VendorResolver.from_file()
+    print(f"Loaded {len(resolver)} prefixes in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    macs = [":".join(f"{random.randint(0, 255):02x}" for _ in range(6)) for _ in range(number_of_macs)]
+
+    start = time.perf_counter()
+    for mac in macs:
+        resolver.lookup(mac)
+    print(f"lookup:      {number_of_macs} MACs in {time.perf_counter() - start:.3f} s")
+
+    start = time.perf_counter()
+    resolver.lookup_many(macs)
+    print(f"lookup_many: {number_of_macs} MACs in {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+    Synthetic scan feeds for the benchmarks, so scans can be measured without radio hardware.
+
+    - a fake bluetoothctl that answers the commands BluetoothctlSession sends and, once
+      "scan on" arrives, reports N devices at M adverts per second: "[NEW] Device" for the first
+      advert of a device, "[CHG] Device ... RSSI:" for every further one
+    - a fake sniffer that prints NDJSON device_seen events at M per second, the output
+      process_monitor relays
+    - Wireshark JSON exports of nRF Sniffer traffic, written packet by packet
+    - a sensor agent that spools batches of N sightings, then ships them to /ingest when told to
+
+    The first advert of every device carries its send time as the device name ("Bench <time>")
+    and every NDJSON event its timestamp, so consumers can compute delivery latency.
+"""
+
+import os
+import sys
+import json
+import random
+
+FAKE_BLUETOOTHCTL = """import sys, time, random, threading
+devices, rate = int(sys.argv[1]), float(sys.argv[2])
+macs = [f"BE:{i >> 16 & 255:02X}:{i >> 8 & 255:02X}:{i & 255:02X}:00:01" for i in range(devices)]
+scanning = threading.Event()
+
+def advertise():
+    seen = set()
+    start, sent = time.time(), 0
+    while scanning.is_set():
+        mac = macs[sent % devices]
+        if mac in seen:
+            line = f"[CHG] Device {mac} RSSI: {random.randint(-95, -30)}"
+        else:
+            seen.add(mac)
+            line = f"[NEW] Device {mac} Bench {time.time():.6f}"
+        sys.stdout.write(line + "\\n")
+        sent += 1
+        # Flush and sleep only when ahead of the schedule, high rates are sent in bursts
+        ahead = start + sent / rate - time.time()
+        if ahead > 0:
+            sys.stdout.flush()
+            time.sleep(ahead)
+    sys.stdout.flush()
+
+for line in sys.stdin:
+    command = line.strip()
+    if command == "scan on" and not scanning.is_set():
+        scanning.set()
+        threading.Thread(target=advertise, daemon=True).start()
+    elif command == "scan off":
+        scanning.clear()
+    elif command == "exit":
+        break
+"""
+
+FAKE_SNIFFER = """import sys, time, json
+devices, rate, duration = int(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3])
+start, sent = time.time(), 0
+while time.time() - start < duration:
+    i = sent % devices
+    mac = f"be:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}:00:01"
+    sys.stdout.write(json.dumps({"event": "device_seen", "mac_address": mac, "device_name": "", "timestamp": time.time()}) + "\\n")
+    sent += 1
+    ahead = start + sent / rate - time.time()
+    if ahead > 0:
+        sys.stdout.flush()
+        time.sleep(ahead)
+sys.stdout.write(json.dumps({"event": "scan_end", "devices": min(sent, devices), "matches": 0}) + "\\n")
+"""
+
+FAKE_AGENT = """import sys, json, time
+sys.path.append(sys.argv[1])
+from agent import SightingSpool, IngestShipper
+spool_path, url, token, agent_id = sys.argv[2:6]
+devices, batches = int(sys.argv[6]), int(sys.argv[7])
+spool = SightingSpool(agent_id, path=spool_path)
+for _ in range(batches):
+    now = time.time()
+    spool.add([{"mac_address": f"be:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}:00:01", "device_name": None,
+                "timestamp": now, "rssi": -60} for i in range(devices)])
+    spool.seal(batch_size=devices)
+shipper = IngestShipper(spool, url, token)
+print("ready", flush=True)
+sys.stdin.readline()
+latencies = []
+while True:
+    batch = spool.next_batch()
+    if batch is None:
+        break
+    start = time.perf_counter()
+    if not shipper.ship(*batch):
+        sys.exit(1)
+    latencies.append(time.perf_counter() - start)
+print(json.dumps(latencies), flush=True)
+"""
+
+
+def bench_mac(index: int) -> str:
+    """
+        MAC Address of synthetic device index, the form the fake bluetoothctl reports after normalize_mac.
+    """
+    return f"be:{index >> 16 & 255:02x}:{index >> 8 & 255:02x}:{index & 255:02x}:00:01"
+
+
+def write_script(directory: str, name: str, source: str) -> str:
+    """
+        Writes a feed script. Replaced in one step, processes started from an earlier write of
+        the same script may still be reading it.
+    """
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "w") as file:
+        file.write(source)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def fake_bluetoothctl_command(directory: str, devices: int, rate: float) -> list:
+    """
+        :return command: for BluetoothctlSession(command=...) or the daemon's --bluetoothctl.
+    """
+    return [sys.executable, "-u", write_script(directory, "fake_bluetoothctl.py", FAKE_BLUETOOTHCTL), str(devices), str(rate)]
+
+
+def fake_sniffer_command(directory: str, devices: int, rate: float, duration: float) -> list:
+    """
+        :return command: a process whose stdout looks like sniffer/main.py during a scan.
+    """
+    return [sys.executable, "-u", write_script(directory, "fake_sniffer.py", FAKE_SNIFFER), str(devices), str(rate), str(duration)]
+
+
+def fake_agent_command(directory: str, index: int, url: str, token: str, devices: int, batches: int) -> list:
+    """
+        :return command: a sensor agent with batches of devices sightings in its spool. It prints
+            "ready", ships them once a line arrives on stdin and prints the latency of every batch.
+    """
+    sniffer_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sniffer")
+    return [sys.executable, "-u", write_script(directory, "fake_agent.py", FAKE_AGENT), sniffer_dir,
+            os.path.join(directory, f"agent_{index}.db"), url, token, f"bench-{index}", str(devices), str(batches)]
+
+
+def tshark_packets(devices: int, adverts: int):
+    """
+        Yields adverts packets in the shape of a Wireshark "Export Packet Dissections as JSON",
+        round robin over devices.
+    """
+    for i in range(adverts):
+        yield {"_index": "packets", "_source": {"layers": {
+            "frame": {"frame.number": str(i), "frame.len": "40"},
+            "nordic_ble": {"nordic_ble.rssi": str(random.randint(-95, -30)), "nordic_ble.channel": "37"},
+            "btle": {"btle.advertising_address": bench_mac(i % devices), "btle.length": "30"},
+        }}}
+
+
+def write_tshark_export(path: str, devices: int, adverts: int, indent: int = 2):
+    with open(path, "w") as file:
+        file.write("[\n")
+        for i, packet in enumerate(tshark_packets(devices, adverts)):
+            file.write(("," if i else "") + json.dumps(packet, indent=indent) + "\n")
+        file.write("]\n")
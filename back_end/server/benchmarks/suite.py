@@ -0,0 +1,466 @@
+"""
+    End to end benchmark suite, driven by the synthetic feeds in benchmarks/feeds.py so it runs
+    without radio hardware. Every scenario runs in a process of its own against a throwaway
+    database, the real outputs/devices.db is never touched.
+
+        bluetoothctl     Sniffer.run_bluetoothctl reading the fake bluetoothctl
+        tshark_replay    Sniffer.run_tshark replaying a generated Wireshark JSON export
+        update_logs      update_logs writing scans of N devices
+        logs_vendor      get_logs_with_vendor reading N log rows
+        logs_route       GET /logs paging through N log rows
+        process_monitor  process_monitor relaying the fake sniffer's NDJSON output
+        ingest           AGENTS sensor agent processes shipping batches of N sightings to POST /ingest
+        ingest_sharded   the same through the sharded ingest service, one shard per core
+
+    Each scenario reports throughput, p50 / p99 latency and the peak RSS of its process. The
+    feed driven scenarios (bluetoothctl, process_monitor) report throughput per CPU second of
+    the consuming process, the feeds send at --rate, so wall clock throughput would measure the
+    feed. Every scenario runs --repeat times and the median of each metric is kept.
+    The results are compared with benchmarks/baseline.json, the suite exits with status 1 when
+    a metric got worse by more than the tolerance. Baselines are machine specific, record one
+    on the machine that runs the comparison with --update-baseline.
+
+    Usage (from back_end/server):
+        python benchmarks/suite.py [--devices N] [--rate M] [--duration S] [--repeat R] [--only name,...]
+                                   [--tolerance 0.25] [--update-baseline]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+import statistics
+import io
+
+BENCHMARKS_DIR = os.path.abspath(os.path.dirname(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.append(SERVER_DIR)
+sys.path.append(os.path.join(SERVER_DIR, "sniffer"))
+
+from feeds import bench_mac, fake_agent_command, fake_bluetoothctl_command, fake_sniffer_command, write_tshark_export
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+DEVICES = 200
+# Adverts per second of the synthetic feeds
+RATE = 2000
+# Seconds the feed driven scenarios run, and the time budget of the repeated ones
+DURATION = 3.0
+# Allowed relative change before a metric counts as a regression
+TOLERANCE = 0.25
+# Latencies below this many milliseconds are noise, not regressions
+LATENCY_FLOOR_MS = 2.0
+# Runs per scenario, the median of every metric is compared so a single noisy run does not
+# trip the gate
+REPEAT = 3
+# One in this many synthetic devices is registered, so scans also match and notify
+REGISTERED_EVERY = 20
+# Sensor agent processes of the ingest scenario, and the batches each of them ships
+AGENTS = 24
+AGENT_BATCHES = 10
+
+
+class NullNotifier():
+    """
+        Stands in for the NotificationDispatcher, benchmarks do not send mail.
+    """
+    def notify(self, devices, email=None):
+        pass
+
+    def close(self, timeout: float = None):
+        pass
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(operations: int, seconds: float, unit: str, latencies: list = None) -> dict:
+    """
+        :param latencies: seconds per operation or per delivered item.
+    """
+    latencies = latencies or []
+    p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+    return {
+        "operations": operations,
+        "seconds": round(seconds, 3),
+        "throughput": round(operations / seconds, 1) if seconds else None,
+        "unit": unit,
+        "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+    }
+
+
+def seed_database(devices: int):
+    """
+        Creates the tables in outputs/devices.db of the current directory and registers
+        every REGISTERED_EVERY-th synthetic device.
+    """
+    from db import connect_db, create_tables
+
+    create_tables()
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO user (username, password, email) VALUES ('bench', 'bench', 'bench@example.com')")
+        cursor.executemany("INSERT INTO device (mac_address, device_vendor, device_name, date_added, email) VALUES (?, 'Unknown', ?, 0, 'bench@example.com')",
+                           [(bench_mac(i), f"Tag {i}") for i in range(0, devices, REGISTERED_EVERY)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def fill_logs(devices: int):
+    from db import update_logs
+
+    update_logs(device_list=[{"mac_address": bench_mac(i), "timestamp": time.time()} for i in range(devices)], output=lambda message: None)
+
+
+def repeat(function, duration: float, minimum: int = 5) -> list:
+    """
+        Calls function until duration seconds have passed, at least minimum times.
+
+        :return latencies: seconds of every call.
+    """
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while len(latencies) < minimum or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+###### Scenarios ######
+
+def bench_bluetoothctl(args, directory: str) -> dict:
+    from sniffer import Sniffer
+    from db import fetch_all_devices
+    from bluetoothctl import BluetoothctlSession
+    from events import DEVICE_SEEN
+
+    seed_database(args.devices)
+    adverts = []
+    latencies = []
+
+    def output(event):
+        if event["event"] == DEVICE_SEEN:
+            adverts.append(event)
+            # The first advert of a device carries its send time as the name
+            if event["device_name"] and event["device_name"].startswith("Bench "):
+                latencies.append(time.time() - float(event["device_name"].split()[-1]))
+
+    session = BluetoothctlSession(command=fake_bluetoothctl_command(directory, args.devices, args.rate))
+    # More packets than devices, the scan runs for the whole duration
+    sniffer = Sniffer(number_of_packets=args.devices + 1, scan_time=args.duration, user_data=[], device_data=fetch_all_devices(),
+                      sniffer_mode="bluetoothctl", session=session, output=output, notifier=NullNotifier())
+    # CPU time of this process, the session readers included, the feed process is not counted
+    start = time.process_time()
+    sniffer.run_bluetoothctl()
+    cpu_seconds = time.process_time() - start
+    session.close()
+    return summarize(len(adverts), cpu_seconds, "adverts/cpu-s", latencies)
+
+
+def bench_tshark_replay(args, directory: str) -> dict:
+    from sniffer import Sniffer
+    from db import fetch_all_devices
+    from capture import readings_from_json_export
+
+    seed_database(args.devices)
+    adverts = int(args.rate * args.duration)
+    path = os.path.join(directory, "capture.json")
+    write_tshark_export(path, args.devices, adverts)
+
+    sniffer = Sniffer(number_of_packets=args.devices + 1, scan_time=args.duration, user_data=[], device_data=fetch_all_devices(),
+                      output=lambda event: None, notifier=NullNotifier())
+    start = time.perf_counter()
+    sniffer.run_tshark(readings=readings_from_json_export(path))
+    return summarize(adverts, time.perf_counter() - start, "adverts/s")
+
+
+def bench_update_logs(args, directory: str) -> dict:
+    from db import update_logs
+
+    seed_database(args.devices)
+    scan = [{"mac_address": bench_mac(i), "timestamp": time.time(), "rssi": -60} for i in range(args.devices)]
+    latencies = repeat(lambda: update_logs(device_list=scan, output=lambda message: None), args.duration)
+    return summarize(len(latencies) * args.devices, sum(latencies), "rows/s", latencies)
+
+
+def bench_logs_vendor(args, directory: str) -> dict:
+    from db import get_logs_with_vendor
+
+    seed_database(args.devices)
+    fill_logs(args.devices)
+    latencies = repeat(get_logs_with_vendor, args.duration)
+    return summarize(len(latencies) * args.devices, sum(latencies), "rows/s", latencies)
+
+
+def bench_logs_route(args, directory: str) -> dict:
+    from config import Config
+    # create_app reads the URI when it is called, point it at the throwaway database
+    Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'outputs', 'devices.db')}"
+    from app import create_app
+    from flask_jwt_extended import create_access_token
+
+    seed_database(args.devices)
+    fill_logs(args.devices)
+    app, _ = create_app()
+    with app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(identity='bench@example.com')}"}
+
+    client = app.test_client()
+    requests = []
+
+    def read_all_pages():
+        cursor = None
+        while True:
+            start = time.perf_counter()
+            response = client.get("/logs", query_string={"limit": 100, **({"cursor": cursor} if cursor else {})}, headers=headers)
+            requests.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.get_json()
+            cursor = response.get_json()["next_cursor"]
+            if not cursor:
+                return
+
+    repeat(read_all_pages, args.duration)
+    return summarize(len(requests), sum(requests), "requests/s", requests)
+
+
+def bench_process_monitor(args, directory: str) -> dict:
+    from app import routes
+
+    latencies = []
+    frames = []
+
+    class Collector():
+        """
+            Stands in for socketio, records when each event reaches the client side.
+        """
+        def emit(self, name, data, room=None):
+            now = time.time()
+            frames.append(name)
+            for event in data.get("events", []) if isinstance(data, dict) else []:
+                if "timestamp" in event:
+                    latencies.append(now - event["timestamp"])
+
+    routes.socketio = Collector()
+    process = subprocess.Popen(fake_sniffer_command(directory, args.devices, args.rate, args.duration),
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+    start = time.process_time()
+    routes.process_monitor("bench@example.com", process, threading.Event(), sid=None)
+    cpu_seconds = time.process_time() - start
+    result = summarize(len(latencies), cpu_seconds, "events/cpu-s", latencies)
+    result["frames"] = len(frames)
+    return result
+
+
+def bench_ingest(args, directory: str, workers: int = 0) -> dict:
+    from config import Config
+    Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'outputs', 'devices.db')}"
+    Config.INGEST_TOKENS = {f"bench-{i}": f"token-{i}" for i in range(AGENTS)}
+    Config.INGEST_WORKERS = workers
+    Config.INGEST_SOCKET = os.path.join(directory, "ingest.sock")
+    from app import create_app
+    from app import ingest_client
+    from werkzeug.serving import make_server
+
+    seed_database(args.devices)
+    app, _ = create_app()
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    agents = [subprocess.Popen(fake_agent_command(directory, i, url, f"token-{i}", args.devices, AGENT_BATCHES),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True) for i in range(AGENTS)]
+    # Spooled before the clock starts, only shipping and ingest are measured
+    for agent in agents:
+        assert agent.stdout.readline().strip() == "ready"
+    start = time.perf_counter()
+    for agent in agents:
+        agent.stdin.write("go\n")
+        agent.stdin.flush()
+    latencies = []
+    for agent in agents:
+        latencies += json.loads(agent.stdout.readline())
+        assert agent.wait() == 0
+    elapsed = time.perf_counter() - start
+    if ingest_client.service_process is not None:
+        ingest_client.service_process.terminate()
+        ingest_client.service_process.wait()
+    return summarize(AGENTS * AGENT_BATCHES * args.devices, elapsed, "sightings/s", latencies)
+
+
+def bench_ingest_sharded(args, directory: str) -> dict:
+    return bench_ingest(args, directory, workers=os.cpu_count() or 1)
+
+
+SCENARIOS = {
+    "bluetoothctl": bench_bluetoothctl,
+    "tshark_replay": bench_tshark_replay,
+    "update_logs": bench_update_logs,
+    "logs_vendor": bench_logs_vendor,
+    "logs_route": bench_logs_route,
+    "process_monitor": bench_process_monitor,
+    "ingest": bench_ingest,
+    "ingest_sharded": bench_ingest_sharded,
+}
+
+###### Scenarios ######
+
+
+def run_scenario(args) -> dict:
+    """
+        Runs one scenario in this process, which is a fresh one started by run_suite,
+        so the peak RSS belongs to the scenario alone.
+    """
+    # The app refuses to import without them
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    os.environ.setdefault("PASSWORD_SALT", "benchmark")
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        # The code under test prints progress, only the result goes to stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = SCENARIOS[args.scenario](args, directory)
+        os.chdir(SERVER_DIR)
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def median_result(runs: list) -> dict:
+    """
+        :param runs: metrics of the repeated runs of one scenario.
+        :return result: the median of every numeric metric, the other fields of the first run.
+    """
+    result = dict(runs[0])
+    for metric, value in runs[0].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            values = [run[metric] for run in runs if run.get(metric) is not None]
+            result[metric] = round(statistics.median(values), 3) if values else None
+    result["runs"] = len(runs)
+    return result
+
+
+def run_suite(args) -> dict:
+    results = {}
+    for name in args.only:
+        command = [sys.executable, os.path.abspath(__file__), "--scenario", name,
+                   "--devices", str(args.devices), "--rate", str(args.rate), "--duration", str(args.duration)]
+        runs = []
+        for _ in range(args.repeat):
+            completed = subprocess.run(command, capture_output=True, text=True, cwd=SERVER_DIR)
+            if completed.returncode != 0:
+                results[name] = {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit {completed.returncode}"}
+                break
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        else:
+            results[name] = median_result(runs)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """
+        :param results: scenario -> metrics of this run.
+        :param baseline: scenario -> metrics of the stored baseline.
+        :return regressions: one line per metric that got worse by more than tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if "error" in result:
+            regressions.append(f"{name}: failed, {result['error']}")
+            continue
+
+        if result.get("throughput") is not None and expected.get("throughput"):
+            if result["throughput"] < expected["throughput"] * (1 - tolerance):
+                regressions.append(f"{name}: throughput {result['throughput']} {result['unit']}, baseline {expected['throughput']}")
+
+        for metric in ("p50_ms", "p99_ms"):
+            if result.get(metric) is not None and expected.get(metric) is not None:
+                if result[metric] > max(expected[metric] * (1 + tolerance), expected[metric] + LATENCY_FLOOR_MS):
+                    regressions.append(f"{name}: {metric} {result[metric]}, baseline {expected[metric]}")
+
+        if result.get("peak_rss_mb") and expected.get("peak_rss_mb"):
+            if result["peak_rss_mb"] > expected["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(f"{name}: peak_rss_mb {result['peak_rss_mb']}, baseline {expected['peak_rss_mb']}")
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    lines = [f"{'scenario':>16} {'throughput':>12} {'unit':>13} {'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8}"]
+    for name, result in results.items():
+        if "error" in result:
+            lines.append(f"{name:>16} failed: {result['error']}")
+            continue
+
+        def cell(value):
+            return "-" if value is None else value
+        lines.append(f"{name:>16} {cell(result['throughput']):>12} {result['unit']:>13} {cell(result['p50_ms']):>8} "
+                     f"{cell(result['p99_ms']):>8} {cell(result['peak_rss_mb']):>8}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end benchmarks on synthetic scan feeds")
+    parser.add_argument("--devices", type=int, default=DEVICES, help="synthetic devices per feed, scan and log table")
+    parser.add_argument("--rate", type=float, default=RATE, help="adverts per second of the feeds")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per scenario")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per scenario, their median is compared")
+    parser.add_argument("--only", type=lambda value: value.split(","), default=list(SCENARIOS), help="comma separated scenarios to run")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative change against the baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args)))
+        return
+
+    unknown = [name for name in args.only if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    settings = {"devices": args.devices, "rate": args.rate, "duration": args.duration, "repeat": args.repeat}
+    print(f"{args.devices} devices, {args.rate:g} adverts/s, {args.duration:g} s per scenario, median of {args.repeat} runs")
+    results = run_suite(args)
+    print(format_results(results))
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({"settings": settings, "results": results}, file, indent=4)
+            file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, record one with --update-baseline")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline.get("settings") != settings:
+        print(f"Baseline was recorded with {baseline.get('settings')}, comparing anyway")
+
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,31 @@ class Config:
 
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Wait for the sniffer's write lock instead of failing with "database is locked"
+    SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"timeout": 5}}
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+    # UNIX socket of the resident scanner daemon (sniffer/daemon.py)
+    SCANNER_SOCKET = os.path.join(db_dir, "scanner.sock")
+    # Sighting history: raw rows are rolled up every interval and dropped after the retention period
+    SIGHTINGS_ROLLUP_INTERVAL = int(os.getenv("SIGHTINGS_ROLLUP_INTERVAL", 60))
+    SIGHTINGS_RETENTION_DAYS = int(os.getenv("SIGHTINGS_RETENTION_DAYS", 30))
+    MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv("MINUTE_ROLLUP_RETENTION_DAYS", 90))
+    # Sensor agents allowed to POST /ingest (sniffer/agent.py), "agent_id:token" pairs separated by commas
+    INGEST_TOKENS = dict(pair.strip().split(":", 1) for pair in os.getenv("INGEST_TOKENS", "").split(",") if ":" in pair)
+    # Largest ingest batch in bytes, compressed and after decompression
+    MAX_INGEST_BYTES = int(os.getenv("MAX_INGEST_BYTES", 16 * 1024 * 1024))
+    # Shard processes of the ingest service (sniffer/ingest.py), 0 writes batches in the request instead
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 0))
+    INGEST_SOCKET = os.path.join(db_dir, "ingest.sock")
+    # Seconds an agent's clock may run ahead, later sighting timestamps are brought back to now plus this
+    INGEST_MAX_CLOCK_SKEW = int(os.getenv("INGEST_MAX_CLOCK_SKEW", 300))
+    # Days the keys of ingested batches are kept to recognise resends, far longer than an agent retries a batch
+    INGEST_BATCH_RETENTION_DAYS = int(os.getenv("INGEST_BATCH_RETENTION_DAYS", 7))
+    # Ports run.py starts a server worker on, comma separated
+    SERVER_PORTS = [int(port) for port in os.getenv("SERVER_PORTS", "5000,5001").split(",") if port.strip()]
+    # Socket.IO message queue shared by the workers, e.g. redis://localhost:6379/0, see app/message_queue.py.
+    # run.py starts the local broker at SOCKETIO_BROKER_SOCKET when it runs several workers without one.
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+    SOCKETIO_BROKER_SOCKET = os.path.join(db_dir, "socketio.sock")
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=30)
     PASSWORD_SALT = os.getenv("PASSWORD_SALT")
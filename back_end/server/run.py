@@ -1,17 +1,36 @@
 import eventlet
 eventlet.monkey_patch()
 
+import os
+
+from config import Config
+# Several workers only share scan updates through a message queue, the local broker unless one is configured
+start_broker = len(Config.SERVER_PORTS) > 1 and not Config.SOCKETIO_MESSAGE_QUEUE
+if start_broker:
+    Config.SOCKETIO_MESSAGE_QUEUE = f"unix://{Config.SOCKETIO_BROKER_SOCKET}"
+
 from app import create_app
+from app.maintenance import run_sighting_maintenance
+from app.message_queue import run_message_broker, renew_host_id
 app, socketio = create_app()
 
 def run_server(port):
-    socketio.run(app, host="127.0.0.1", port=port, debug=True)
+    renew_host_id(socketio)
+    # The reloader would run this file's main again in every worker, starting all of them anew
+    socketio.run(app, host="127.0.0.1", port=port, debug=True, use_reloader=len(Config.SERVER_PORTS) == 1)
 
-if __name__ == '__main__':
+if __name__ == '__main__' and os.environ.get("WERKZEUG_RUN_MAIN"):
+    # The reloader runs this file again for the server it restarts, everything else already runs
+    run_server(Config.SERVER_PORTS[0])
+elif __name__ == '__main__':
     from multiprocessing import Process
-    p1 = Process(target=run_server, args=(5000,))
-    p2 = Process(target=run_server, args=(5001,))
-    p1.start()
-    p2.start()
-    p1.join()
-    p2.join()
+    processes = []
+    if start_broker:
+        processes.append(Process(target=run_message_broker, args=(Config.SOCKETIO_BROKER_SOCKET,)))
+    # The background jobs run once, apart from the servers
+    processes.append(Process(target=run_sighting_maintenance))
+    processes += [Process(target=run_server, args=(port,)) for port in Config.SERVER_PORTS]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,248 @@
+"""
+    Scanning with several adapters at once, the "multi" sniffer mode.
+
+    Every adapter in the "adapters" list of config.json gets its own session and its own reader
+    thread: BlueZ adapters over D-Bus, controllers driven through bluetoothctl and nRF Sniffer
+    interfaces captured with tshark. MultiAdapterSession merges their streams into one sighting
+    feed for Sniffer.scan_events:
+
+        "adapters": [{"type": "bluez", "adapter": "hci0"},
+                     {"type": "bluetoothctl", "controller": "00:1A:7D:DA:71:13"},
+                     {"type": "nrf", "interface": "COM5-4.4"}]
+
+    Every forwarded update carries the best RSSI of the device per adapter as adapter_rssi.
+    Reports of a device that only repeat an RSSI no better than the best its adapter already
+    heard are dropped for DEDUP_WINDOW after the device was last forwarded. So a device heard
+    by several adapters shows up once per window, while a new best RSSI, a name or manufacturer
+    data always passes and the last update of a device holds its final adapter_rssi.
+"""
+
+import time
+import threading
+import subprocess
+from bluetoothctl import BluetoothctlSession
+from bluez import BluezSession
+from capture import readings_from_fields, tshark_capture_command, NRF_INTERFACE
+from updates import UpdateQueue
+from settings import load_config
+from vendors import normalize_mac
+
+# Seconds in which repeated reports of a device are dropped, see above
+DEDUP_WINDOW = 1.0
+# Seconds a reader waits for its session before checking whether discovery is still on
+READ_TIMEOUT = 0.5
+# Seconds stop_discovery waits for a reader to finish
+JOIN_TIMEOUT = 5
+# Update fields that make a report worth forwarding even inside the window
+INFORMATIVE_FIELDS = ("device_name", "tx_power", "manufacturer_id", "manufacturer_data")
+
+
+class CaptureSession():
+    """
+        An nRF Sniffer interface as a session, a live tshark capture runs while discovery is on
+        and every packet becomes an RSSI update.
+
+        :param command: command to run instead of tshark, for tests.
+    """
+    def __init__(self, interface: str = NRF_INTERFACE, command: list = None):
+        self.interface: str = interface
+        self.command: list = command
+        self.process = None
+        self.thread = None
+        self.updates = UpdateQueue()
+
+    def open(self):
+        # tshark only runs while discovery is on
+        pass
+
+    def is_alive(self) -> bool:
+        return True
+
+    def start_discovery(self):
+        self.stop_discovery()
+        self.updates.clear()
+        self.process = subprocess.Popen(self.command or tshark_capture_command(self.interface),
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.thread = threading.Thread(target=self.capture, args=(self.process,), daemon=True)
+        self.thread.start()
+
+    def capture(self, process):
+        for address, rssi, timestamp in readings_from_fields(process.stdout):
+            update = {"action": "chg", "mac_address": address, "rssi": rssi}
+            if timestamp is not None:
+                update["timestamp"] = timestamp
+            self.updates.put([update])
+        self.updates.end()
+
+    def read_updates(self, timeout: float = None):
+        return self.updates.read(timeout=timeout)
+
+    def wake(self):
+        self.updates.wake()
+
+    def stop_discovery(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+        self.thread.join(timeout=JOIN_TIMEOUT)
+        self.process.stdout.close()
+        self.process = None
+        self.thread = None
+
+    def close(self):
+        self.stop_discovery()
+
+
+class MultiAdapterSession():
+    """
+        :param sessions: adapter name -> session, e.g. from load_adapter_sessions.
+    """
+    def __init__(self, sessions: dict, dedup_window: float = DEDUP_WINDOW):
+        self.sessions: dict = sessions
+        self.dedup_window: float = dedup_window
+        self.updates = UpdateQueue()
+        self.readers: list = []
+        # Readers still running, the feed ends with the last one
+        self.running_readers: int = 0
+        self.discovering = threading.Event()
+        self.lock = threading.Lock()
+        # MAC Address -> adapter name -> strongest RSSI of the current discovery
+        self.best_rssi: dict = {}
+        # MAC Address -> time.monotonic() the last update of the device was forwarded
+        self.forwarded: dict = {}
+
+    def open(self):
+        """
+            Opens every adapter. An adapter that fails is left out of the scan, as long as one works.
+        """
+        opened = {}
+        for name, session in self.sessions.items():
+            try:
+                session.open()
+                opened[name] = session
+            except Exception as e:
+                print(f"Adapter {name} left out: {e}")
+        if not opened:
+            raise RuntimeError("None of the configured adapters could be opened")
+        self.sessions = opened
+
+    def is_alive(self) -> bool:
+        return any(session.is_alive() for session in self.sessions.values())
+
+    def start_discovery(self):
+        self.stop_discovery()
+        self.updates.clear()
+        self.best_rssi.clear()
+        self.forwarded.clear()
+        self.discovering.set()
+        for name, session in self.sessions.items():
+            session.start_discovery()
+        self.readers = [threading.Thread(target=self.read, args=(name, session), daemon=True)
+                        for name, session in self.sessions.items()]
+        self.running_readers = len(self.readers)
+        for reader in self.readers:
+            reader.start()
+
+    def read(self, name: str, session):
+        """
+            Reader thread of one adapter.
+        """
+        while self.discovering.is_set():
+            updates = session.read_updates(timeout=READ_TIMEOUT)
+            if updates is None:
+                print(f"Adapter {name} stopped reporting")
+                break
+            if updates:
+                merged = self.merge(name, updates)
+                if merged:
+                    self.updates.put(merged)
+
+        with self.lock:
+            self.running_readers -= 1
+            if self.running_readers == 0 and self.discovering.is_set():
+                self.updates.end()
+
+    def merge(self, name: str, updates: list) -> list:
+        """
+            Folds updates of one adapter into the merged feed.
+
+            :return forwarded: the updates to pass on, tagged with adapter and adapter_rssi.
+        """
+        forwarded = []
+        now = time.monotonic()
+        with self.lock:
+            for update in updates:
+                if update["action"] == "del":
+                    continue
+                # Adapters may report addresses differently
+                mac = normalize_mac(update["mac_address"])
+                best = self.best_rssi.setdefault(mac, {})
+                rssi = update.get("rssi")
+                improved = rssi is not None and (name not in best or rssi > best[name])
+                if improved:
+                    best[name] = rssi
+
+                last = self.forwarded.get(mac)
+                if last is not None and now - last < self.dedup_window and not improved and \
+                        not any(field in update for field in INFORMATIVE_FIELDS):
+                    continue
+                self.forwarded[mac] = now
+                forwarded.append(dict(update, mac_address=mac, adapter=name, adapter_rssi=dict(best)))
+        return forwarded
+
+    def read_updates(self, timeout: float = None):
+        return self.updates.read(timeout=timeout)
+
+    def wake(self):
+        self.updates.wake()
+
+    def stop_discovery(self):
+        if not self.readers:
+            return
+        self.discovering.clear()
+        for session in self.sessions.values():
+            session.wake()
+        for reader in self.readers:
+            reader.join(timeout=JOIN_TIMEOUT)
+        self.readers = []
+        for session in self.sessions.values():
+            if session.is_alive():
+                session.stop_discovery()
+
+    def clear(self):
+        self.updates.clear()
+
+    def close(self):
+        self.stop_discovery()
+        for session in self.sessions.values():
+            session.close()
+
+
+def adapter_session(spec: dict):
+    """
+        Session of one entry of the "adapters" list.
+
+        :return name, session: the adapter name used in adapter_rssi and its session.
+    """
+    kind = spec.get("type", "bluez")
+    if kind == "bluez":
+        return spec.get("name") or spec.get("adapter") or "bluez", BluezSession(adapter=spec.get("adapter"))
+    if kind == "bluetoothctl":
+        return spec.get("name") or spec.get("controller") or "bluetoothctl", \
+            BluetoothctlSession(command=spec.get("command"), controller=spec.get("controller"))
+    if kind == "nrf":
+        interface = spec.get("interface", NRF_INTERFACE)
+        return spec.get("name") or interface, CaptureSession(interface=interface, command=spec.get("command"))
+    raise ValueError(f"Unknown adapter type {kind}")
+
+
+def load_adapter_sessions() -> MultiAdapterSession:
+    """
+        MultiAdapterSession over the "adapters" of config.json, the default bluetoothctl
+        controller when none are configured.
+    """
+    config = load_config()
+    sessions = dict(adapter_session(spec) for spec in config.get("adapters", [{"type": "bluetoothctl"}]))
+    return MultiAdapterSession(sessions, dedup_window=float(config.get("dedup_window", DEDUP_WINDOW)))
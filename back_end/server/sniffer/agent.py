@@ -0,0 +1,368 @@
+"""
+    Sensor agent, the sniffer on a node that reports to a dashboard running elsewhere.
+
+    The agent scans like the dashboard's sniffer, in any session mode, but writes nothing to
+    outputs/devices.db. Scans run back to back in windows, the devices seen in a window go
+    into a local spool (a SQLite file) as one sighting each, with the strongest RSSI of the
+    window. A shipper thread seals spooled sightings into numbered batches and POSTs them
+    gzip compressed to the dashboard's /ingest endpoint, oldest first.
+
+    A batch's sequence number and payload are fixed when it is sealed and the batch is only
+    deleted once the dashboard acknowledged it. A batch sent again after a lost answer is the
+    same batch, the dashboard recognises it and writes nothing twice. While the dashboard
+    cannot be reached the spool grows (up to MAX_SPOOLED_BATCHES) and the shipper retries
+    with exponential backoff, so nothing seen during an outage is lost.
+
+    Run from back_end/server, with the agent's token from INGEST_TOKENS on the dashboard:
+        INGEST_TOKEN=<token> python3 -u sniffer/agent.py --url http://dashboard:5000 --agent-id kitchen
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import threading
+from contextlib import closing
+
+import requests
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from sniffer import Sniffer, load_sniffer_mode, SESSION_MODES
+from bluetoothctl import BluetoothctlSession
+from bluez import BluezSession
+from adapters import load_adapter_sessions
+from dbpool import get_pool, begin_immediate
+from events import describe_event
+
+DEFAULT_SPOOL_PATH = os.path.join("outputs", "agent_spool.db")
+# Seconds of one scan window, a device is spooled once per window
+SCAN_WINDOW = 10
+# Most sightings in one batch
+BATCH_SIZE = 5000
+# Seconds the shipper sleeps when there is nothing to ship
+SHIP_INTERVAL = 1.0
+# Retry delays while the dashboard cannot be reached, doubling from the first to the last
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# Seconds to wait for the dashboard to answer one batch
+REQUEST_TIMEOUT = 30
+# Sealed batches kept while the dashboard cannot be reached, the oldest are dropped beyond this
+MAX_SPOOLED_BATCHES = 10000
+# Seconds to wait before scanning again when the session could not be opened
+RESTART_DELAY = 5
+
+
+class SightingSpool():
+    """
+        Sightings waiting to be shipped, kept on disk so they survive outages and restarts.
+
+        :param agent_id: id the batches carry, the one the dashboard knows the agent's token by.
+    """
+    def __init__(self, agent_id: str, path: str = DEFAULT_SPOOL_PATH, max_batches: int = MAX_SPOOLED_BATCHES):
+        self.agent_id: str = agent_id
+        self.path: str = path
+        self.max_batches: int = max_batches
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.create_tables()
+
+    def connect(self):
+        return get_pool(self.path).acquire()
+
+    def create_tables(self):
+        conn = self.connect()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS spool_sighting (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mac_address TEXT NOT NULL,
+                device_name TEXT,
+                timestamp REAL NOT NULL,
+                rssi INTEGER
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS spool_batch (
+                sequence INTEGER PRIMARY KEY,
+                payload BLOB NOT NULL,
+                sightings INTEGER NOT NULL
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS spool_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def add(self, sightings: list):
+        """
+            :param sightings: list of dicts with mac_address, device_name, timestamp and rssi.
+        """
+        conn = self.connect()
+        try:
+            conn.executemany("INSERT INTO spool_sighting (mac_address, device_name, timestamp, rssi) VALUES (?, ?, ?, ?)",
+                             [(s["mac_address"], s.get("device_name"), s["timestamp"], s.get("rssi")) for s in sightings])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def seal(self, batch_size: int = BATCH_SIZE) -> int:
+        """
+            Turns every spooled sighting into batches of at most batch_size.
+            The first sequence number is taken from the clock in milliseconds, so an agent
+            whose spool was deleted does not reuse numbers the dashboard already ingested.
+
+            :return batches: number of batches sealed.
+        """
+        conn = self.connect()
+        sealed = 0
+        try:
+            begin_immediate(conn)
+            row = conn.execute("SELECT value FROM spool_state WHERE key = 'next_sequence'").fetchone()
+            sequence = row[0] if row else int(time.time() * 1000)
+            while True:
+                rows = conn.execute("SELECT id, mac_address, device_name, timestamp, rssi FROM spool_sighting "
+                                    "ORDER BY id LIMIT ?", (batch_size,)).fetchall()
+                if not rows:
+                    break
+                sightings = [{"mac_address": mac, "device_name": name, "timestamp": timestamp, "rssi": rssi}
+                             for _, mac, name, timestamp, rssi in rows]
+                payload = gzip.compress(json.dumps({"agent_id": self.agent_id, "sequence": sequence, "sightings": sightings},
+                                                   separators=(",", ":")).encode("utf-8"))
+                conn.execute("INSERT INTO spool_batch (sequence, payload, sightings) VALUES (?, ?, ?)",
+                             (sequence, payload, len(sightings)))
+                conn.execute("DELETE FROM spool_sighting WHERE id <= ?", (rows[-1][0],))
+                sequence += 1
+                sealed += 1
+
+            if sealed:
+                conn.execute("INSERT OR REPLACE INTO spool_state (key, value) VALUES ('next_sequence', ?)", (sequence,))
+                dropped = conn.execute("DELETE FROM spool_batch WHERE sequence <= ?",
+                                       (sequence - 1 - self.max_batches,)).rowcount
+                if dropped:
+                    print(f"Spool is full, dropped the {dropped} oldest batches")
+            conn.commit()
+        finally:
+            conn.close()
+        return sealed
+
+    def next_batch(self):
+        """
+            :return sequence, payload: the oldest sealed batch, None when there is none.
+        """
+        conn = self.connect()
+        try:
+            return conn.execute("SELECT sequence, payload FROM spool_batch ORDER BY sequence LIMIT 1").fetchone()
+        finally:
+            conn.close()
+
+    def ack(self, sequence: int):
+        """
+            Deletes a batch the dashboard took.
+        """
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM spool_batch WHERE sequence = ?", (sequence,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def backlog(self) -> int:
+        """
+            :return sightings: sightings not shipped yet, sealed or not.
+        """
+        conn = self.connect()
+        try:
+            sealed = conn.execute("SELECT COALESCE(SUM(sightings), 0) FROM spool_batch").fetchone()[0]
+            return sealed + conn.execute("SELECT COUNT(*) FROM spool_sighting").fetchone()[0]
+        finally:
+            conn.close()
+
+
+class IngestShipper():
+    """
+        Ships the spool to the dashboard from a thread of its own.
+
+        :param url: base URL of the dashboard, e.g. http://dashboard:5000.
+        :param token: the agent's ingest token.
+    """
+    def __init__(self, spool: SightingSpool, url: str, token: str, batch_size: int = BATCH_SIZE):
+        self.spool: SightingSpool = spool
+        self.url: str = url.rstrip("/") + "/ingest"
+        self.token: str = token
+        self.batch_size: int = batch_size
+        self.http = requests.Session()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def wake(self):
+        """
+            Ships new sightings now instead of after SHIP_INTERVAL, unless the shipper is backing off.
+        """
+        self.wake_event.set()
+
+    def stop(self, timeout: float = REQUEST_TIMEOUT):
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+
+    def run(self):
+        backoff = 0
+        while not self.stop_event.is_set():
+            if self.ship_pending():
+                backoff = 0
+                self.wake_event.wait(SHIP_INTERVAL)
+                self.wake_event.clear()
+            else:
+                backoff = min(max(backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+                # Jittered, so agents cut off together do not all come back in the same second
+                self.stop_event.wait(backoff * random.uniform(0.5, 1))
+
+    def ship_pending(self) -> bool:
+        """
+            Ships sealed batches until the spool is empty.
+
+            :return shipped: False when the dashboard could not take a batch, it stays spooled.
+        """
+        self.spool.seal(self.batch_size)
+        while not self.stop_event.is_set():
+            batch = self.spool.next_batch()
+            if batch is None:
+                return True
+            if not self.ship(*batch):
+                return False
+        return True
+
+    def ship(self, sequence: int, payload: bytes) -> bool:
+        try:
+            response = self.http.post(self.url, data=payload, timeout=REQUEST_TIMEOUT, headers={
+                "Authorization": f"Bearer {self.token}",
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            })
+        except requests.RequestException as e:
+            print(f"Dashboard unreachable, batch {sequence} stays spooled: {e}")
+            return False
+
+        if response.status_code == 200:
+            self.spool.ack(sequence)
+            return True
+        if response.status_code in (400, 413):
+            # The dashboard will never take this batch, resending it would hold up every later one
+            print(f"Batch {sequence} was rejected and is dropped: {response.status_code} {response.text.strip()}")
+            self.spool.ack(sequence)
+            return True
+        print(f"Batch {sequence} was not accepted, retrying: {response.status_code} {response.text.strip()}")
+        return False
+
+
+class SensorAgent():
+    """
+        Scans in windows of sniffer.scan_time seconds and spools what each window saw.
+
+        :param sniffer: Sniffer with a persistent session, it is kept open across windows.
+    """
+    def __init__(self, sniffer: Sniffer, spool: SightingSpool, shipper: IngestShipper):
+        self.sniffer: Sniffer = sniffer
+        self.spool: SightingSpool = spool
+        self.shipper: IngestShipper = shipper
+        self.stop_event = threading.Event()
+
+    def run(self):
+        self.shipper.start()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    sightings = self.scan_window()
+                except Exception as e:
+                    print(f"Scan failed, retrying in {RESTART_DELAY} seconds: {e}")
+                    self.stop_event.wait(RESTART_DELAY)
+                    continue
+                if sightings:
+                    self.spool.add(sightings)
+                    self.shipper.wake()
+        finally:
+            self.shipper.stop()
+            self.sniffer.session.close()
+
+    def scan_window(self) -> list:
+        """
+            :return sightings: one per device seen in the window, with its strongest RSSI.
+        """
+        seen = {}
+        with closing(self.sniffer.scan_events()) as events:
+            for event in events:
+                if event is None:
+                    continue
+                sighting = seen.get(event["mac_address"])
+                if sighting is None:
+                    seen[event["mac_address"]] = {"mac_address": event["mac_address"], "device_name": event["device_name"],
+                                                  "timestamp": event["timestamp"], "rssi": event["rssi"]}
+                    continue
+                if event["device_name"] is not None:
+                    sighting["device_name"] = event["device_name"]
+                if event["rssi"] is not None and (sighting["rssi"] is None or event["rssi"] > sighting["rssi"]):
+                    sighting["rssi"] = event["rssi"]
+        return list(seen.values())
+
+    def stop(self):
+        """
+            Ends the agent after the current window, from any thread or a signal handler.
+        """
+        self.stop_event.set()
+        self.sniffer.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sensor agent, ships sightings to a dashboard")
+    parser.add_argument("--url", required=True, help="base URL of the dashboard, e.g. http://dashboard:5000")
+    parser.add_argument("--agent-id", default=socket.gethostname(), help="id the dashboard knows the token by, the host name by default")
+    parser.add_argument("--token", default=os.getenv("INGEST_TOKEN"), help="ingest token, INGEST_TOKEN by default")
+    parser.add_argument("--spool", default=DEFAULT_SPOOL_PATH, help="SQLite file sightings wait in until they are shipped")
+    parser.add_argument("--window", type=float, default=SCAN_WINDOW, help="seconds of one scan window")
+    parser.add_argument("--mode", default=None, choices=SESSION_MODES, help="sniffer_mode of config.json by default")
+    parser.add_argument("--bluetoothctl", default="bluetoothctl", help="bluetoothctl executable to drive")
+    parser.add_argument("--adapter", default=None, help="adapter of the bluez mode, e.g. hci0, the first one by default")
+    args = parser.parse_args()
+
+    if not args.token:
+        print("An ingest token is required, pass --token or set INGEST_TOKEN")
+        sys.exit(1)
+    mode = args.mode or load_sniffer_mode()
+    if mode not in SESSION_MODES:
+        print(f"The agent cannot run in {mode} mode, it needs a discovery session")
+        sys.exit(1)
+
+    if mode == "bluez":
+        session = BluezSession(adapter=args.adapter)
+    elif mode == "multi":
+        session = load_adapter_sessions()
+    else:
+        session = BluetoothctlSession(command=[args.bluetoothctl])
+    # Users, devices and notifications stay with the dashboard
+    sniffer = Sniffer(number_of_packets=0, scan_time=args.window, user_data=[], device_data=[], sniffer_mode=mode,
+                      session=session, output=lambda event: print(describe_event(event)))
+    spool = SightingSpool(args.agent_id, path=args.spool)
+    agent = SensorAgent(sniffer, spool, IngestShipper(spool, args.url, args.token))
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: agent.stop())
+    print(f"Agent {args.agent_id} shipping to {args.url}, {spool.backlog()} sightings spooled")
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        print("Agent stopped")
@@ -0,0 +1,264 @@
+import os
+import re
+import time
+import selectors
+import subprocess
+from collections import deque
+
+# bluetoothctl colours its output and prefixes lines with the prompt when it is attached to a pipe
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x01|\x02|\r")
+DEVICE_LINE = re.compile(r"\[(NEW|CHG|DEL)\]\s+Device\s+((?:[0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2})\s*(.*)")
+# "RSSI: -60", or "RSSI: 0xffffffc4 (-60)" in newer versions, TxPower is printed the same way
+SIGNED_VALUE = re.compile(r"(?:0x[0-9A-Fa-f]+\s*\()?(-?\d+)\)?")
+MANUFACTURER_KEY = re.compile(r"0x([0-9A-Fa-f]+)")
+# Continuation lines of a "ManufacturerData Value:" dump, "  4c 00 02 15 ...   L...."
+HEX_DUMP_LINE = re.compile(r"\s+((?:[0-9a-f]{2} )+)")
+
+READ_SIZE = 64 * 1024
+
+
+class BluetoothctlParser():
+    """
+        Turns bluetoothctl output into device updates, one compiled match per line.
+        ManufacturerData values span several lines, they are collected and returned with the
+        next line that is not part of the dump, or by flush().
+
+        An update is a dict with action ("new", "chg" or "del") and mac_address, plus whatever
+        the line carried: device_name, rssi, tx_power, manufacturer_id, manufacturer_data (hex).
+    """
+    def __init__(self):
+        self.pending = None
+
+    def feed(self, line: str) -> list:
+        line = ANSI_ESCAPE.sub("", line)
+        if self.pending is not None:
+            dump = HEX_DUMP_LINE.match(line)
+            if dump:
+                self.pending["manufacturer_data"] += dump.group(1).replace(" ", "")
+                return []
+            updates = self.flush()
+        else:
+            updates = []
+
+        match = DEVICE_LINE.search(line)
+        if match is None:
+            return updates
+
+        action, mac_address, rest = match.group(1).lower(), match.group(2), match.group(3).strip()
+        update = {"action": action, "mac_address": mac_address}
+        if action == "new":
+            update["device_name"] = rest
+        elif action == "chg":
+            key, _, value = rest.partition(":")
+            value = value.strip()
+            if key == "RSSI":
+                update["rssi"] = self.signed_value(value)
+            elif key == "TxPower":
+                update["tx_power"] = self.signed_value(value)
+            elif key in ("Name", "Alias"):
+                update["device_name"] = value
+            elif key == "ManufacturerData Key":
+                manufacturer_id = MANUFACTURER_KEY.match(value)
+                update["manufacturer_id"] = int(manufacturer_id.group(1), 16) if manufacturer_id else None
+            elif key == "ManufacturerData Value":
+                update["manufacturer_data"] = ""
+                self.pending = update
+                return updates
+            else:
+                update["property"] = rest
+        updates.append(update)
+        return updates
+
+    def flush(self) -> list:
+        pending, self.pending = self.pending, None
+        return [pending] if pending is not None else []
+
+    @staticmethod
+    def signed_value(value: str):
+        match = SIGNED_VALUE.match(value)
+        return int(match.group(1)) if match else None
+
+
+class BluetoothctlSession():
+    """
+        Wraps one interactive bluetoothctl process.
+        The session can be reused across scans, so the process is spawned and the controller
+        is powered on only once. Output is read without blocking through a selector, so a
+        read never waits past its deadline however quiet the air is, and wake() ends a wait
+        straight away. Output printed between scans is dropped by start_discovery.
+
+        :param controller: address of the controller to scan with, bluetoothctl's default when None.
+    """
+    def __init__(self, command: list = None, controller: str = None):
+        self.command: list = command or ["bluetoothctl"]
+        self.controller: str = controller
+        self.process = None
+        self.selector = None
+        self.buffer: bytes = b""
+        self.lines = deque()
+        self.parser = BluetoothctlParser()
+        # Set once bluetoothctl closed its output, usually because it exited
+        self.output_closed: bool = False
+        self.wake_read = None
+        self.wake_write = None
+
+    def open(self):
+        """
+            Starts bluetoothctl and powers the controller on, unless the session is already open.
+        """
+        if self.is_alive():
+            return
+
+        self.close()
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+        os.set_blocking(self.process.stdout.fileno(), False)
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ)
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+        self.buffer = b""
+        self.lines.clear()
+        self.output_closed = False
+        if self.controller is not None:
+            self.send(f"select {self.controller}")
+        self.send("power on")
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def send(self, command: str):
+        self.process.stdin.write(f"{command}\n".encode("utf-8"))
+        self.process.stdin.flush()
+
+    def wake(self):
+        """
+            Ends a readline that is waiting, from any thread.
+        """
+        if self.wake_write is not None:
+            try:
+                os.write(self.wake_write, b"\0")
+            except (BlockingIOError, OSError):
+                # Already woken, or closed
+                pass
+
+    def _read_available(self) -> bool:
+        """
+            Reads whatever bluetoothctl has printed so far into complete lines.
+
+            :return open: False once bluetoothctl closed its output.
+        """
+        while True:
+            try:
+                data = os.read(self.process.stdout.fileno(), READ_SIZE)
+            except BlockingIOError:
+                return True
+            if not data:
+                self.output_closed = True
+                if self.buffer:
+                    self.lines.append(self.buffer.decode("utf-8", errors="replace"))
+                    self.buffer = b""
+                return False
+            lines = (self.buffer + data).split(b"\n")
+            self.buffer = lines.pop()
+            self.lines.extend(line.decode("utf-8", errors="replace") for line in lines)
+
+    def readline(self, timeout: float = None) -> str:
+        """
+            Returns the next line printed by bluetoothctl.
+
+            :param timeout: seconds to wait for a line, None waits forever.
+            :return line: the line, or an empty string on timeout, after wake() or when bluetoothctl has exited.
+        """
+        if self.process is None or (self.output_closed and not self.lines):
+            return ""
+        deadline = None if timeout is None else time.monotonic() + max(timeout, 0)
+
+        while not self.lines:
+            if not self._read_available():
+                break
+            if self.lines:
+                break
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            woken = False
+            for key, _ in self.selector.select(remaining):
+                if key.fileobj == self.wake_read:
+                    woken = True
+            if woken:
+                self._drain_wake()
+                self._read_available()
+                break
+
+        return self.lines.popleft() + "\n" if self.lines else ""
+
+    def read_updates(self, timeout: float = None):
+        """
+            Reads the next line and returns the device updates it completed, see BluetoothctlParser.
+
+            :param timeout: seconds to wait for a line, None waits forever.
+            :return updates: list of updates, empty on timeout, after wake() or for lines that are
+                not about a device, None once bluetoothctl has exited.
+        """
+        line = self.readline(timeout=timeout)
+        if line:
+            return self.parser.feed(line)
+        updates = self.parser.flush()
+        if not updates and (self.output_closed or not self.is_alive()):
+            return None
+        return updates
+
+    def _drain_wake(self):
+        try:
+            while os.read(self.wake_read, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def clear(self):
+        """
+            Drops output that was printed while no scan was running.
+        """
+        if self.process is not None:
+            self._read_available()
+            self._drain_wake()
+        self.lines.clear()
+        self.parser.flush()
+
+    def start_discovery(self):
+        self.clear()
+        self.send("scan on")
+
+    def stop_discovery(self):
+        self.send("scan off")
+
+    def close(self):
+        if self.process is None:
+            return
+
+        if self.is_alive():
+            try:
+                self.send("scan off")
+                self.send("exit")
+                self.process.wait(timeout=5)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+        self.selector.close()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+        self.process = None
+        self.selector = None
+        self.wake_read = self.wake_write = None
@@ -0,0 +1,238 @@
+"""
+    BlueZ discovery over D-Bus, the "bluez" sniffer mode.
+
+    Talks to bluetoothd directly instead of driving the bluetoothctl text UI: discovery is
+    started with org.bluez.Adapter1.StartDiscovery, and devices arrive as InterfacesAdded and
+    PropertiesChanged signals with typed values, so there is no output to parse and no
+    dependence on bluetoothctl's locale or colours.
+
+    dbus-next runs the connection on an asyncio loop in a background thread. Signals are turned
+    into the same updates BluetoothctlParser produces (see bluetoothctl.py) and queued for the
+    scan loop, so Sniffer.scan_events reads either session the same way.
+"""
+
+import asyncio
+import threading
+from updates import UpdateQueue
+
+try:
+    from dbus_next import BusType, Message, MessageType, Variant
+    from dbus_next.aio import MessageBus
+except ImportError:
+    MessageBus = None
+
+BLUEZ_SERVICE = "org.bluez"
+ADAPTER_INTERFACE = "org.bluez.Adapter1"
+DEVICE_INTERFACE = "org.bluez.Device1"
+OBJECT_MANAGER_INTERFACE = "org.freedesktop.DBus.ObjectManager"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+MATCH_RULES = (
+    f"type='signal',sender='{BLUEZ_SERVICE}',interface='{OBJECT_MANAGER_INTERFACE}',member='InterfacesAdded'",
+    f"type='signal',sender='{BLUEZ_SERVICE}',interface='{OBJECT_MANAGER_INTERFACE}',member='InterfacesRemoved'",
+    f"type='signal',sender='{BLUEZ_SERVICE}',interface='{PROPERTIES_INTERFACE}',member='PropertiesChanged',arg0='{DEVICE_INTERFACE}'",
+)
+# LE only, and a PropertiesChanged for every advert instead of only when the RSSI changes
+DISCOVERY_FILTER = {"Transport": ("s", "le"), "DuplicateData": ("b", True)}
+# Seconds to wait for bluetoothd to answer a method call
+CALL_TIMEOUT = 10
+
+
+def device_address(path: str, properties: dict = None) -> str:
+    """
+        MAC Address of a device object, from its Address property or else its object path,
+        /org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF.
+    """
+    if properties and "Address" in properties:
+        return properties["Address"].value
+    return path.rsplit("/", 1)[-1].replace("dev_", "", 1).replace("_", ":")
+
+
+def properties_update(action: str, mac_address: str, properties: dict) -> dict:
+    """
+        :param properties: Device1 property name -> Variant.
+        :return update: dict in the form of BluetoothctlParser updates.
+    """
+    update = {"action": action, "mac_address": mac_address}
+    if action == "new":
+        update["device_name"] = properties["Name"].value if "Name" in properties else ""
+    elif "Name" in properties:
+        update["device_name"] = properties["Name"].value
+    if "RSSI" in properties:
+        update["rssi"] = properties["RSSI"].value
+    if "TxPower" in properties:
+        update["tx_power"] = properties["TxPower"].value
+    if properties.get("ManufacturerData"):
+        # Company id -> payload, a device advertises one in practice
+        manufacturer_id, data = next(iter(properties["ManufacturerData"].value.items()))
+        update["manufacturer_id"] = manufacturer_id
+        update["manufacturer_data"] = bytes(data.value).hex()
+    if action == "chg" and len(update) == 2:
+        update["property"] = ", ".join(f"{name}: {variant.value}" for name, variant in properties.items())
+    return update
+
+
+class BluezSession():
+    """
+        One D-Bus connection to bluetoothd, reusable across scans like BluetoothctlSession.
+
+        :param adapter: adapter name, e.g. hci0, the first adapter when None.
+        :param bus_address: D-Bus address to connect to instead of the system bus, e.g. a test bus.
+    """
+    def __init__(self, adapter: str = None, bus_address: str = None):
+        self.adapter: str = adapter
+        self.bus_address: str = bus_address
+        self.adapter_path: str = None
+        self.loop = None
+        self.thread = None
+        self.bus = None
+        self.updates = UpdateQueue()
+
+    def open(self):
+        """
+            Connects to bluetoothd, subscribes to device signals and powers the adapter on,
+            unless the session is already open.
+        """
+        if self.is_alive():
+            return
+        if MessageBus is None:
+            raise RuntimeError("The bluez sniffer mode needs dbus-next, pip install dbus-next")
+
+        self.close()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        try:
+            self.call(self.connect())
+        except Exception:
+            self.close()
+            raise
+
+    def call(self, coroutine):
+        """
+            Runs a coroutine on the session loop and waits for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout=CALL_TIMEOUT)
+
+    async def connect(self):
+        self.bus = await MessageBus(bus_address=self.bus_address, bus_type=BusType.SYSTEM).connect()
+        self.bus.add_message_handler(self.on_message)
+        for rule in MATCH_RULES:
+            await self.method("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus", "AddMatch", "s", [rule])
+
+        objects = (await self.method(BLUEZ_SERVICE, "/", OBJECT_MANAGER_INTERFACE, "GetManagedObjects"))[0]
+        adapters = sorted(path for path, interfaces in objects.items() if ADAPTER_INTERFACE in interfaces)
+        if self.adapter is not None:
+            adapters = [path for path in adapters if path.rsplit("/", 1)[-1] == self.adapter]
+        if not adapters:
+            raise RuntimeError(f"Bluetooth adapter {self.adapter} was not found" if self.adapter else "No Bluetooth adapter was found")
+        self.adapter_path = adapters[0]
+
+        await self.method(BLUEZ_SERVICE, self.adapter_path, PROPERTIES_INTERFACE, "Set", "ssv",
+                          [ADAPTER_INTERFACE, "Powered", Variant("b", True)])
+        self.loop.create_task(self.watch_disconnect(self.bus))
+
+    async def method(self, destination: str, path: str, interface: str, member: str, signature: str = "", body: list = None) -> list:
+        """
+            Calls a D-Bus method.
+
+            :return body: the reply body.
+        """
+        reply = await self.bus.call(Message(destination=destination, path=path, interface=interface, member=member,
+                                            signature=signature, body=body or []))
+        if reply.message_type == MessageType.ERROR:
+            raise RuntimeError(f"{member} failed: {reply.error_name} {' '.join(str(value) for value in reply.body)}")
+        return reply.body
+
+    async def disconnect(self):
+        self.bus.disconnect()
+        try:
+            await self.bus.wait_for_disconnect()
+        except Exception:
+            pass
+
+    async def watch_disconnect(self, bus):
+        try:
+            await bus.wait_for_disconnect()
+        except Exception as e:
+            print(f"D-Bus connection lost: {e}")
+        self.updates.end()
+
+    def on_message(self, message):
+        """
+            Queues device updates of the subscribed signals, runs on the session loop.
+        """
+        if message.message_type != MessageType.SIGNAL:
+            return None
+
+        if message.member == "InterfacesAdded":
+            path, interfaces = message.body
+            if DEVICE_INTERFACE in interfaces:
+                properties = interfaces[DEVICE_INTERFACE]
+                self.updates.put([properties_update("new", device_address(path, properties), properties)])
+        elif message.member == "InterfacesRemoved":
+            path, interfaces = message.body
+            if DEVICE_INTERFACE in interfaces:
+                self.updates.put([{"action": "del", "mac_address": device_address(path)}])
+        elif message.member == "PropertiesChanged" and message.body[0] == DEVICE_INTERFACE:
+            self.updates.put([properties_update("chg", device_address(message.path), message.body[1])])
+        return None
+
+    def is_alive(self) -> bool:
+        return self.bus is not None and self.bus.connected
+
+    def read_updates(self, timeout: float = None):
+        """
+            Returns the device updates that arrived, waiting up to timeout for the first one.
+
+            :param timeout: seconds to wait, None waits forever.
+            :return updates: list of updates, empty on timeout or after wake(), None once the bus is gone.
+        """
+        updates = self.updates.read(timeout=timeout)
+        if not updates and not self.is_alive():
+            return None
+        return updates
+
+    def wake(self):
+        """
+            Ends a read_updates that is waiting, from any thread.
+        """
+        self.updates.wake()
+
+    def clear(self):
+        """
+            Drops updates that arrived while no scan was running.
+        """
+        self.updates.clear()
+
+    def start_discovery(self):
+        self.clear()
+        try:
+            discovery_filter = {key: Variant(signature, value) for key, (signature, value) in DISCOVERY_FILTER.items()}
+            self.call(self.method(BLUEZ_SERVICE, self.adapter_path, ADAPTER_INTERFACE, "SetDiscoveryFilter", "a{sv}", [discovery_filter]))
+        except RuntimeError as e:
+            # Older bluetoothd, discovery still works with the default filter
+            print(f"Discovery filter not applied: {e}")
+        self.call(self.method(BLUEZ_SERVICE, self.adapter_path, ADAPTER_INTERFACE, "StartDiscovery"))
+
+    def stop_discovery(self):
+        try:
+            self.call(self.method(BLUEZ_SERVICE, self.adapter_path, ADAPTER_INTERFACE, "StopDiscovery"))
+        except RuntimeError as e:
+            # bluetoothd answers NotReady or Failed when discovery already ended
+            print(f"Stopping discovery: {e}")
+
+    def close(self):
+        if self.loop is None:
+            return
+
+        if self.is_alive():
+            self.stop_discovery()
+            self.call(self.disconnect())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+        self.bus = None
+        self.adapter_path = None
+        self.clear()
@@ -0,0 +1,224 @@
+"""
+    Shares one discovery session between concurrent scans.
+
+    The adapter only runs one discovery at a time, so scans of different users must not each
+    start their own bluetoothctl and toggle "scan on/off" under each other. The ScanBroker owns
+    the session: discovery runs while at least one scan is subscribed, one thread reads the
+    session, feeds the presence estimator and writes the logs and sightings once, and hands
+    every batch of updates to all subscribers. Each scan keeps its own packet and time limits,
+    matching and events, it reads a ScanSubscription as if it were the session (see
+    Sniffer.scan_events).
+"""
+
+import time
+import threading
+from sniffer import normalize_mac, LOG_FLUSH_INTERVAL
+from updates import UpdateQueue
+from metrics import REGISTRY
+from db import update_presence_estimates, ScanLogWriter
+from events import make_event, LOGS_UPDATED
+
+# Seconds the discovery thread waits for updates before checking for subscribers again
+IDLE_TIMEOUT = 0.5
+# Seconds the last subscriber waits for discovery to stop when it leaves
+JOIN_TIMEOUT = 5
+
+SCAN_SUBSCRIBERS = REGISTRY.gauge("sniffer_scan_subscribers", "Scans reading the shared discovery stream")
+
+
+class ScanSubscription():
+    """
+        One scan's view of the broker, with the methods Sniffer.scan_events uses on a session.
+        start_discovery subscribes, stop_discovery and close unsubscribe.
+
+        :param output: receives the logs_updated events of the broker's log writes.
+    """
+    def __init__(self, broker, output=None):
+        self.broker = broker
+        self.updates = UpdateQueue()
+        self.output = output
+
+    def open(self):
+        # The broker opens the session with the first subscriber
+        pass
+
+    def is_alive(self) -> bool:
+        return not self.updates.ended
+
+    def start_discovery(self):
+        self.updates.clear()
+        self.broker.attach(self)
+
+    def stop_discovery(self):
+        self.broker.detach(self)
+
+    def close(self):
+        self.stop_discovery()
+
+    def read_updates(self, timeout: float = None):
+        """
+            Returns the updates the broker handed over, see UpdateQueue.read.
+        """
+        return self.updates.read(timeout=timeout)
+
+    def wake(self):
+        self.updates.wake()
+
+
+class ScanBroker():
+    """
+        :param session: BluetoothctlSession or BluezSession, shared by all subscriptions.
+        :param estimator: PresenceEstimator fed with the RSSI of every update, once for all subscribers.
+        :param flush_interval: seconds between log writes, None only writes when a scan leaves.
+    """
+    def __init__(self, session, estimator=None, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.session = session
+        self.estimator = estimator
+        self.flush_interval = flush_interval
+        self.subscribers: list = []
+        self.thread = None
+        self.lock = threading.Lock()
+        # One writer per discovery, a device is counted once however many scans saw it
+        self.log_writer = None
+        # MAC Addresses the current discovery logged
+        self.logged: set = set()
+        self.log_lock = threading.Lock()
+
+    def subscribe(self, output=None) -> ScanSubscription:
+        """
+            :param output: receives the logs_updated events, e.g. the scan's event output.
+        """
+        return ScanSubscription(self, output=output)
+
+    def attach(self, subscription: ScanSubscription):
+        """
+            Adds a subscriber, the first one opens the session and starts discovery.
+        """
+        with self.lock:
+            if subscription in self.subscribers:
+                return
+            if self.thread is None:
+                self.session.open()
+                self.session.start_discovery()
+                with self.log_lock:
+                    self.log_writer = ScanLogWriter(flush_interval=self.flush_interval, output=self.logs_updated)
+                    self.logged = set()
+                self.thread = threading.Thread(target=self.discover, daemon=True)
+                self.thread.start()
+            self.subscribers.append(subscription)
+            SCAN_SUBSCRIBERS.set(len(self.subscribers))
+
+    def detach(self, subscription: ScanSubscription):
+        """
+            Removes a subscriber, discovery stops once the last one left.
+            The devices seen so far are written first, so a scan's devices are in the logs
+            table when it ends, as when every scan wrote its own.
+        """
+        if subscription not in self.subscribers:
+            return
+        self.flush_logs()
+
+        with self.lock:
+            if subscription not in self.subscribers:
+                return
+            self.subscribers.remove(subscription)
+            SCAN_SUBSCRIBERS.set(len(self.subscribers))
+            if self.subscribers:
+                return
+            thread = self.thread
+        # Let the discovery thread notice straight away instead of after IDLE_TIMEOUT, and wait
+        # until discovery is off, so the next scan starts a fresh one
+        self.session.wake()
+        if thread is not None:
+            thread.join(timeout=JOIN_TIMEOUT)
+
+    def discover(self):
+        """
+            Discovery thread, reads the session until no subscriber is left or the session ends.
+        """
+        while True:
+            updates = self.session.read_updates(timeout=IDLE_TIMEOUT)
+            with self.lock:
+                subscribers = list(self.subscribers)
+                if updates is None or not subscribers:
+                    self.subscribers.clear()
+                    SCAN_SUBSCRIBERS.set(0)
+                    self.thread = None
+                    log_writer, self.log_writer = self.log_writer, None
+                    if updates is not None and self.session.is_alive():
+                        self.session.stop_discovery()
+                    for subscription in subscribers:
+                        subscription.updates.end()
+                    break
+
+            if updates:
+                self.estimate(updates)
+                for subscription in subscribers:
+                    subscription.updates.put(updates)
+            self.log(updates or ())
+
+        with self.log_lock:
+            if log_writer is not None:
+                log_writer.close()
+
+    def log(self, updates):
+        """
+            Hands the devices the discovery sees for the first time to the log writer, and
+            writes them once the flush interval passed.
+        """
+        with self.log_lock:
+            if self.log_writer is None:
+                return
+            for update in updates:
+                if update["action"] == "del":
+                    continue
+                mac = normalize_mac(update["mac_address"])
+                if mac not in self.logged:
+                    self.logged.add(mac)
+                    self.log_writer.add({"mac_address": mac, "timestamp": update.get("timestamp") or time.time(),
+                                         "rssi": update.get("rssi")})
+            self.log_writer.flush_if_due()
+
+    def flush_logs(self):
+        """
+            Writes the pending devices of the discovery and stores the estimates of every
+            device it logged.
+        """
+        with self.log_lock:
+            if self.log_writer is None:
+                return
+            self.log_writer.flush()
+            if self.estimator is not None:
+                mac_addresses = [mac for mac in self.logged if mac in self.estimator.slots]
+                if mac_addresses:
+                    update_presence_estimates(self.estimator.estimate(mac_addresses, now=time.time()))
+
+    def logs_updated(self, message: str):
+        """
+            Passes a log write on to every subscriber, the web app refreshes the logs on it.
+        """
+        event = make_event(LOGS_UPDATED, message=message)
+        # A copy without the lock, detach writes the logs before it takes the lock
+        for subscription in list(self.subscribers):
+            if subscription.output is not None:
+                subscription.output(event)
+
+    def estimate(self, updates: list):
+        if self.estimator is None:
+            return
+        readings = [update for update in updates if update.get("rssi") is not None and update["action"] != "del"]
+        if readings:
+            now = time.time()
+            self.estimator.update([normalize_mac(update["mac_address"]) for update in readings],
+                                  [update["rssi"] for update in readings],
+                                  [update.get("timestamp") or now for update in readings])
+
+    def stop(self):
+        """
+            Ends every subscription, e.g. before the session is closed.
+        """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.updates.end()
+            self.detach(subscription)
@@ -0,0 +1,206 @@
+"""
+    Streaming ingest of nRF Sniffer for Bluetooth LE captures.
+
+    Packets are read one at a time, from a live tshark capture in -T fields mode or from a
+    Wireshark JSON export parsed incrementally, and folded into running statistics per
+    advertising address. Memory depends on the number of addresses, not on the capture size.
+"""
+
+import os
+import json
+import select
+import subprocess
+
+ADDRESS_FIELD = "btle.advertising_address"
+RSSI_FIELD = "nordic_ble.rssi"
+# Capture time of a packet as unix time
+TIME_FIELD = "frame.time_epoch"
+# Interface name the nRF Sniffer shows up as in tshark -D
+NRF_INTERFACE = "COM5-4.4"
+READ_SIZE = 64 * 1024
+# Seconds a live capture waits for output before it checks whether it was asked to stop
+IDLE_TIMEOUT = 0.5
+
+
+class AddressStats():
+    """
+        Running count, sum, min, max, mean and variance (Welford) of the RSSI of one address.
+    """
+    __slots__ = ("count", "sum", "min", "max", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, rssi: int):
+        self.count += 1
+        self.sum += rssi
+        self.min = rssi if self.min is None or rssi < self.min else self.min
+        self.max = rssi if self.max is None or rssi > self.max else self.max
+        delta = rssi - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (rssi - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else 0.0
+
+
+def collect_address_stats(readings) -> dict:
+    """
+        :param readings: iterable of (address, rssi, timestamp) readings.
+        :return stats: dict of address -> AddressStats.
+    """
+    stats = {}
+    for address, rssi, *_ in readings:
+        address_stats = stats.get(address)
+        if address_stats is None:
+            address_stats = stats[address] = AddressStats()
+        address_stats.add(rssi)
+    return stats
+
+
+def iter_json_array(file, read_size: int = READ_SIZE):
+    """
+        Yields the elements of a top level JSON array one by one, reading the file in chunks
+        instead of loading it whole. Used for Wireshark "Export Packet Dissections as JSON" files.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    while True:
+        chunk = file.read(read_size)
+        buffer += chunk
+        position = 0
+
+        if not started:
+            position = len(buffer) - len(buffer.lstrip())
+            if position == len(buffer):
+                if not chunk:
+                    return
+                buffer = ""
+                continue
+            if buffer[position] != "[":
+                raise ValueError("Capture file is not a JSON array")
+            position += 1
+            started = True
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                element, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The element continues in the next chunk
+                break
+            yield element
+
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise ValueError("Capture file ends in the middle of a packet")
+            return
+
+
+def capture_time(value):
+    """
+        Unix time of a frame.time_epoch value, None when it is missing or not a number.
+    """
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def readings_from_json_export(path: str):
+    """
+        Yields (address, rssi, timestamp) for every packet of a Wireshark JSON export that has
+        an address and RSSI. timestamp is the capture time of the packet, None when the export
+        has no frame layer.
+    """
+    with open(path, "r") as file:
+        for packet in iter_json_array(file):
+            try:
+                layers = packet["_source"]["layers"]
+            except (KeyError, TypeError):
+                continue
+
+            address = layers.get("btle", {}).get(ADDRESS_FIELD)
+            rssi = layers.get("nordic_ble", {}).get(RSSI_FIELD)
+            if address and rssi:
+                yield address, int(rssi), capture_time(layers.get("frame", {}).get(TIME_FIELD))
+
+
+def readings_from_fields(lines):
+    """
+        Yields (address, rssi, timestamp) from tshark -T fields output with the address, RSSI
+        and capture time columns. timestamp is None when the capture time column is missing.
+    """
+    for line in lines:
+        address, _, rest = line.rstrip("\r\n").partition("\t")
+        rssi, _, timestamp = rest.partition("\t")
+        if address and rssi:
+            try:
+                yield address, int(rssi.split(",")[0]), capture_time(timestamp)
+            except ValueError:
+                continue
+
+
+def tshark_capture_command(interface: str, duration: int = None, packet_count: int = None) -> list:
+    command = ["tshark", "-i", interface, "-l", "-T", "fields", "-e", ADDRESS_FIELD, "-e", RSSI_FIELD, "-e", TIME_FIELD]
+    if duration:
+        command += ["-a", f"duration:{int(duration)}"]
+    if packet_count:
+        command += ["-c", str(int(packet_count))]
+    return command
+
+
+def output_lines(stream, stop_event=None, idle_timeout: float = IDLE_TIMEOUT):
+    """
+        Yields the lines of a pipe as they arrive. Waits on select() with a timeout rather
+        than a blocking read, so a stop_event is noticed while nothing is written too.
+    """
+    fd = stream.fileno()
+    partial = b""
+    while stop_event is None or not stop_event.is_set():
+        ready, _, _ = select.select([fd], [], [], idle_timeout)
+        if not ready:
+            continue
+        data = os.read(fd, READ_SIZE)
+        if not data:
+            if partial:
+                yield partial.decode("utf-8", "replace")
+            return
+        lines = (partial + data).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8", "replace")
+
+
+def live_readings(interface: str = NRF_INTERFACE, duration: int = None, packet_count: int = None, command: list = None,
+                  stop_event=None):
+    """
+        Runs a live tshark capture and yields (address, rssi, timestamp) as packets arrive.
+        Close the generator or set stop_event to end the capture early.
+
+        :param interface: capture interface, as listed by interfaces.get_tshark_interfaces.
+        :param duration: stop after this many seconds.
+        :param packet_count: stop after this many packets.
+        :param command: command to run instead of tshark, for tests.
+        :param stop_event: ends the capture once set, also while no packets arrive.
+    """
+    process = subprocess.Popen(command or tshark_capture_command(interface, duration, packet_count),
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield from readings_from_fields(output_lines(process.stdout, stop_event))
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
@@ -0,0 +1,208 @@
+"""
+    Resident scanner service.
+
+    Keeps one Sniffer and one bluetoothctl session alive between scans, so starting a scan
+    no longer pays for interpreter start up, database reads and bluetoothctl power on.
+    Scans of several users run at the same time on one discovery, see broker.py, each with
+    its own packet and time limits. The broker writes the logs of the shared discovery once.
+    Commands arrive as one JSON object per line on a local UNIX socket:
+
+        {"command": "start", "scan": "id", "packets": 100, "scan_time": 15}
+                                                                 streams scan events, then closes
+        {"command": "stop", "scan": "id"}                        stops that scan, every scan without an id
+        {"command": "configure", "packets": 100, "scan_time": 15}  limits of scans that set none
+        {"command": "reload"}                                    re-reads users and devices
+        {"command": "ping"}
+
+    Run from back_end/server:
+        python3 -u sniffer/daemon.py
+        python3 -u sniffer/daemon.py --mode bluez     BlueZ over D-Bus instead of bluetoothctl
+"""
+
+import os
+import sys
+import json
+import threading
+import argparse
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from sniffer import Sniffer, load_sniffer_mode, SESSION_MODES, LOG_FLUSH_INTERVAL
+from bluetoothctl import BluetoothctlSession
+from bluez import BluezSession
+from adapters import load_adapter_sessions
+from broker import ScanBroker
+from db import fetch_all_users, fetch_all_devices
+from events import make_event, encode_event, MESSAGE, ERROR
+from service_socket import lock_service_socket, bind_service_socket
+
+DEFAULT_SOCKET_PATH = os.path.join("outputs", "scanner.sock")
+DEFAULT_PACKETS = 100
+DEFAULT_SCAN_TIME = 15
+
+
+class ScannerDaemon():
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, sniffer_mode: str = "bluetoothctl",
+                 bluetoothctl_command: list = None, adapter: str = None):
+        self.socket_path: str = socket_path
+        if sniffer_mode == "bluez":
+            self.session = BluezSession(adapter=adapter)
+        elif sniffer_mode == "multi":
+            self.session = load_adapter_sessions()
+        else:
+            self.session = BluetoothctlSession(command=bluetoothctl_command)
+        # Holds the default limits, users, devices and the state all scans share
+        self.sniffer = Sniffer(number_of_packets=DEFAULT_PACKETS, scan_time=DEFAULT_SCAN_TIME,
+                               user_data=fetch_all_users(), device_data=fetch_all_devices(),
+                               sniffer_mode=sniffer_mode, session=self.session)
+        self.broker = ScanBroker(self.session, estimator=self.sniffer.estimator,
+                                 flush_interval=LOG_FLUSH_INTERVAL if self.sniffer.streaming else None)
+        # Scan id -> Sniffer of every running scan
+        self.scans: dict = {}
+        self.scans_lock = threading.Lock()
+        self.server = None
+        self.lock_file = None
+
+    def serve_forever(self):
+        """
+            :raises RuntimeError: when another daemon serves the socket, it keeps the adapter.
+        """
+        self.lock_file = lock_service_socket(self.socket_path)
+        self.session.open()
+        self.server = bind_service_socket(self.socket_path)
+        print(f"Scanner daemon listening on {self.socket_path}")
+
+        try:
+            while True:
+                connection, _ = self.server.accept()
+                threading.Thread(target=self.handle_client, args=(connection,), daemon=True).start()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.stop_scans()
+        self.broker.stop()
+        self.session.close()
+        self.sniffer.notifier.close(timeout=5)
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        # Only the daemon holding the lock owns the socket file
+        if self.lock_file is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def handle_client(self, connection):
+        with connection:
+            try:
+                line = connection.makefile("r").readline()
+                command = json.loads(line) if line else {}
+            except ValueError:
+                self.reply(connection, {"error": "Invalid command"})
+                return
+
+            name = command.get("command")
+            if name == "start":
+                self.start_scan(connection, command)
+            elif name == "stop":
+                stopped = self.stop_scans(command.get("scan"))
+                self.reply(connection, {"message": f"Stopping {stopped} scans"})
+            elif name == "configure":
+                self.configure(command)
+                self.reply(connection, {"message": "Scanner configured"})
+            elif name == "reload":
+                self.sniffer.refresh(user_data=fetch_all_users(), device_data=fetch_all_devices())
+                self.reply(connection, {"message": "Users and devices reloaded"})
+            elif name == "ping":
+                self.reply(connection, {"message": "pong", "scanning": bool(self.scans), "scans": len(self.scans)})
+            else:
+                self.reply(connection, {"error": f"Unknown command {name}"})
+
+    def reply(self, connection, payload: dict):
+        try:
+            connection.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        except OSError:
+            pass
+
+    def configure(self, command: dict):
+        if "packets" in command:
+            self.sniffer.number_of_packets = int(command["packets"])
+        if "scan_time" in command:
+            self.sniffer.scan_time = int(command["scan_time"])
+
+    def stop_scans(self, scan_id: str = None) -> int:
+        """
+            :param scan_id: id the scan was started with, every running scan when None.
+            :return stopped: number of scans asked to stop.
+        """
+        with self.scans_lock:
+            scans = [scanner for key, scanner in self.scans.items() if scan_id is None or key == scan_id]
+        for scanner in scans:
+            scanner.stop()
+        return len(scans)
+
+    def start_scan(self, connection, command: dict):
+        """
+            Runs one scan and streams its events to the client as JSON lines, the same format
+            sniffer/main.py prints. The connection is closed when the scan ends.
+            The scan subscribes to the shared discovery, scans that are already running go on.
+        """
+        scan_id = str(command.get("scan") or id(connection))
+
+        def send_event(event):
+            try:
+                connection.sendall((encode_event(event) + "\n").encode("utf-8"))
+            except OSError:
+                # The client went away, no point in finishing the scan for it
+                scanner.stop()
+
+        scanner = Sniffer(number_of_packets=int(command.get("packets", self.sniffer.number_of_packets)),
+                          scan_time=int(command.get("scan_time", self.sniffer.scan_time)),
+                          user_data=self.sniffer.user_data, device_data=self.sniffer.device_data,
+                          sniffer_mode=self.sniffer.sniffer_mode, session=self.broker.subscribe(output=send_event),
+                          output=send_event, streaming=self.sniffer.streaming, notifier=self.sniffer.notifier,
+                          throttle=self.sniffer.throttle, estimator=self.sniffer.estimator, feed_estimator=False,
+                          write_logs=False)
+        with self.scans_lock:
+            running = scan_id in self.scans
+            if not running:
+                self.scans[scan_id] = scanner
+        if running:
+            send_event(make_event(ERROR, message=f"Scan {scan_id} is already running."))
+            return
+
+        try:
+            send_event(make_event(MESSAGE, message=f"Sniffer received {scanner.number_of_packets} packets, and {scanner.scan_time} scan_time in seconds"))
+            scanner.run_bluetoothctl()
+        finally:
+            with self.scans_lock:
+                del self.scans[scan_id]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident Bluetooth scanner service")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="path of the UNIX socket to listen on")
+    parser.add_argument("--bluetoothctl", default="bluetoothctl", help="bluetoothctl executable to drive")
+    parser.add_argument("--mode", default=None, choices=SESSION_MODES,
+                        help="drive bluetoothctl, talk to BlueZ over D-Bus or scan with every adapter of config.json, "
+                             "sniffer_mode of config.json by default")
+    parser.add_argument("--adapter", default=None, help="adapter of the bluez mode, e.g. hci0, the first one by default")
+    args = parser.parse_args()
+
+    mode = args.mode or load_sniffer_mode()
+    if mode not in SESSION_MODES:
+        print(f"The scanner daemon cannot run in {mode} mode, those scans run as sniffer/main.py")
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(args.socket) or ".", exist_ok=True)
+    daemon = ScannerDaemon(socket_path=args.socket, sniffer_mode=mode, bluetoothctl_command=[args.bluetoothctl],
+                           adapter=args.adapter)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        print("Scanner daemon stopped")
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
@@ -2,6 +2,9 @@ import os
 import sqlite3
 from datetime import datetime
 import time
+from vendors import get_resolver
+from dbpool import get_pool, begin_immediate, DEFAULT_DB_PATH
+from metrics import UPDATE_LOGS_DURATION
 
 """
     WORK IN PROGRESS. CURRENTLY NOT IN USE
@@ -12,13 +15,9 @@ def connect_db():
     # Ensure the 'outputs' directory exists
     os.makedirs('outputs', exist_ok=True)
     
-    # Connect to the database (creates the file if it doesn't exist)
-    conn = sqlite3.connect('outputs/devices.db')
-    
-    # Enable foreign keys in sqlite
-    conn.execute("PRAGMA foreign_keys = ON")
-    
-    return conn
+    # Take a connection from the shared pool (creates the file if it doesn't exist).
+    # It is already in WAL mode with foreign keys on, close() hands it back to the pool.
+    return get_pool(DEFAULT_DB_PATH).acquire()
 
 def create_tables():
     conn = connect_db()
@@ -53,9 +52,116 @@ def create_tables():
         last_seen INTEGER NOT NULL,
         count INTEGER NOT NULL,
         scan_number INTEGER NOT NULL,
-        FOREIGN KEY (mac_address) REFERENCES device(mac_address)
+        change_seq INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    # Logs tables created before change_seq existed
+    cursor.execute("PRAGMA table_info(logs)")
+    if "change_seq" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE logs ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_logs_last_seen ON logs (last_seen, mac_address)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_logs_vendor_last_seen ON logs (device_vendor, last_seen, mac_address)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_logs_target_last_seen ON logs (target_device, last_seen, mac_address)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_logs_change_seq ON logs (change_seq)")
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS scan_counter (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        scan_number INTEGER NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_counter (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        change_seq INTEGER NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS app_metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sighting (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        mac_address TEXT NOT NULL,
+        scan_number INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        rssi INTEGER
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_sighting_timestamp ON sighting (timestamp)")
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sighting_rollup (
+        bucket TEXT NOT NULL,
+        bucket_start INTEGER NOT NULL,
+        mac_address TEXT NOT NULL,
+        sightings INTEGER NOT NULL,
+        rssi_count INTEGER NOT NULL,
+        rssi_sum INTEGER NOT NULL,
+        rssi_min INTEGER,
+        rssi_max INTEGER,
+        first_seen INTEGER NOT NULL,
+        last_seen INTEGER NOT NULL,
+        PRIMARY KEY (bucket, bucket_start, mac_address)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_sighting_rollup_mac ON sighting_rollup (bucket, mac_address, bucket_start)")
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS notification_throttle (
+        email TEXT NOT NULL,
+        mac_address TEXT NOT NULL,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (email, mac_address)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS presence_estimate (
+        mac_address TEXT PRIMARY KEY,
+        rssi REAL NOT NULL,
+        distance REAL NOT NULL,
+        presence REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_batch (
+        agent_id TEXT NOT NULL,
+        sequence INTEGER NOT NULL,
+        scan_number INTEGER NOT NULL,
+        sightings INTEGER NOT NULL,
+        received_at INTEGER NOT NULL,
+        PRIMARY KEY (agent_id, sequence)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS scan_session (
+        user_email TEXT PRIMARY KEY,
+        scan_key TEXT NOT NULL,
+        worker_pid INTEGER NOT NULL,
+        pid INTEGER,
+        sid TEXT,
+        started_at INTEGER NOT NULL,
+        worker_start_time INTEGER,
+        pid_start_time INTEGER
     )
     ''')
+    # Scan session tables created before the start times were recorded
+    cursor.execute("PRAGMA table_info(scan_session)")
+    columns = [column[1] for column in cursor.fetchall()]
+    for column in ("worker_start_time", "pid_start_time"):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE scan_session ADD COLUMN {column} INTEGER")
 
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS device_vendor (
@@ -251,51 +357,423 @@ def query_user_data_by_email(email: str):
 
 ###### Logs ############
 
-def update_logs(device_list: list):
+def next_scan_number(cursor) -> int:
+    """
+        Increments and returns the scan counter kept in the scan_counter table.
+        The first call on an existing database seeds the counter from the logs table,
+        every call after that is a single primary key update.
+
+        :param cursor: cursor of an open connection, the caller commits.
+        :return scan_number: the number assigned to the new scan.
+    """
+    cursor.execute("UPDATE scan_counter SET scan_number = scan_number + 1 WHERE id = 1")
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT MAX(scan_number) FROM logs")
+        result = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO scan_counter (id, scan_number) VALUES (1, ?)",
+                       ((result if result is not None else 0) + 1,))
+
+    cursor.execute("SELECT scan_number FROM scan_counter WHERE id = 1")
+    return cursor.fetchone()[0]
+
+
+def next_change_seq(cursor) -> int:
+    """
+        Increments and returns the change counter that stamps every write to logs rows.
+        It is taken inside the write transaction and SQLite has one writer at a time, so
+        changes commit in counter order. A reader that sees the counter at N has seen every
+        row changed up to N, whichever scan wrote it.
+
+        :param cursor: cursor of an open write transaction, the caller commits.
+    """
+    cursor.execute("UPDATE change_counter SET change_seq = change_seq + 1 WHERE id = 1")
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT MAX(change_seq) FROM logs")
+        result = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO change_counter (id, change_seq) VALUES (1, ?)",
+                       ((result if result is not None else 0) + 1,))
+
+    cursor.execute("SELECT change_seq FROM change_counter WHERE id = 1")
+    return cursor.fetchone()[0]
+
+
+def resolve_registered_devices(cursor, mac_addresses: list) -> dict:
+    """
+        Finds which scanned MAC Addresses are registered devices with one set based query.
+        The scanned MAC Addresses are loaded into a temporary table which is then joined
+        against the device table once, instead of querying per MAC.
+
+        :param cursor: cursor of an open connection.
+        :param mac_addresses: MAC Addresses seen in the scan.
+        :return registered: dict of registered MAC -> device vendor.
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS scan_batch (mac_address TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM scan_batch")
+    cursor.executemany("INSERT OR IGNORE INTO scan_batch (mac_address) VALUES (?)",
+                       ((mac,) for mac in mac_addresses))
+
+    cursor.execute('''
+        SELECT scan_batch.mac_address, device.device_vendor
+        FROM scan_batch
+        JOIN device ON device.mac_address = scan_batch.mac_address
+    ''')
+    registered = {mac: vendor for mac, vendor in cursor.fetchall()}
+
+    cursor.execute("DELETE FROM scan_batch")
+    return registered
+
+
+def update_logs(device_list: list, scan_number: int = None, output=print):
+    """
+        Writes a finished scan to the logs table.
+        Vendors and target flags are resolved for the whole scan at once and every row is
+        written with a single executemany upsert, so the cost no longer grows with a
+        round trip per MAC Address.
+
+        :param device_list: list of scanned devices, each a dict with at least mac_address.
+        :param scan_number: write into an existing scan instead of starting a new one.
+        :param output: callable the "Logs were updated" line is passed to.
+        :return scan_number: the scan number the rows were written with.
+    """
+    started = time.perf_counter()
     conn = connect_db()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT MAX(scan_number) FROM logs")
-    result = cursor.fetchone()[0]
-    new_scan_number = (result if result is not None else 0) + 1
+    try:
+        begin_immediate(conn)
+        new_scan_number = scan_number if scan_number is not None else next_scan_number(cursor)
+        write_log_rows(cursor, device_list, new_scan_number)
+        conn.commit()
+    finally:
+        conn.close()
+
+    UPDATE_LOGS_DURATION.observe(time.perf_counter() - started)
+    output(f"Logs were updated at {datetime.now()}")
+    return new_scan_number
+
 
+def write_log_rows(cursor, device_list: list, scan_number: int):
+    """
+        Upserts the logs rows and appends the sightings of a list of devices, inside the
+        caller's transaction. A device counts as seen at its timestamp, now when it has none,
+        so sightings that arrive late never move last_seen back.
+    """
     current_time = int(time.time())
-    for device in device_list:
+
+    mac_addresses = [device.get("mac_address") for device in device_list]
+    prefix_vendors = get_resolver().lookup_many(mac_addresses, default=None)
+
+    devices = []
+    sightings = []
+    for device, prefix_vendor in zip(device_list, prefix_vendors):
         mac = device.get("mac_address")
-        
-        # 1. Try to get vendor from device table
-        cursor.execute("SELECT device_vendor FROM device WHERE mac_address = ?", (mac,))
-        result = cursor.fetchone()
-        if result and result[0]:
-            device_vendor = result[0]
-        else:
-            # 2. Try to get vendor from device_vendor table
-            mac_prefix = mac[:8].upper()
-            cursor.execute("SELECT vendor_name FROM device_vendor WHERE mac_address_prefix = ?", (mac_prefix,))
-            result = cursor.fetchone()
-            device_vendor = result[0] if result else device.get("device_vendor", "Unknown")
+        seen = int(device.get("timestamp") or current_time)
+        devices.append((mac, prefix_vendor or device.get("device_vendor", "Unknown"), 1, seen, seen))
+        sightings.append((mac, seen, device.get("rssi")))
+
+    write_device_aggregates(cursor, devices, sightings, scan_number)
+
+
+def write_device_aggregates(cursor, devices: list, sightings: list, scan_number: int):
+    """
+        Upserts one logs row per device and appends its sightings, inside the caller's
+        transaction. A device may stand for several sightings, its count is added to the row.
+
+        :param devices: (mac_address, prefix vendor, count, first_seen, last_seen) tuples.
+        :param sightings: (mac_address, timestamp, rssi) tuples.
+    """
+    registered = resolve_registered_devices(cursor, [device[0] for device in devices])
+    change_seq = next_change_seq(cursor)
+
+    rows = []
+    for mac, prefix_vendor, count, first_seen, last_seen in devices:
+        # 1. Vendor from device table, 2. vendor from the MAC prefix
+        device_vendor = registered.get(mac) or prefix_vendor
+        target_device = 1 if mac in registered else 0
+        rows.append((mac, device_vendor, target_device, first_seen, last_seen, count, scan_number, change_seq))
+
+    cursor.executemany("""
+        INSERT INTO logs (mac_address, device_vendor, target_device, first_seen, last_seen, count, scan_number, change_seq)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(mac_address) DO UPDATE SET
+            first_seen = MIN(logs.first_seen, excluded.first_seen),
+            last_seen = MAX(logs.last_seen, excluded.last_seen),
+            count = logs.count + excluded.count,
+            scan_number = excluded.scan_number,
+            change_seq = excluded.change_seq,
+            target_device = excluded.target_device,
+            device_vendor = excluded.device_vendor
+    """, rows)
+
+    # Append only history, logs only keeps the latest state per MAC Address
+    cursor.executemany("INSERT INTO sighting (mac_address, scan_number, timestamp, rssi) VALUES (?, ?, ?, ?)",
+                       ((mac, scan_number, timestamp, rssi) for mac, timestamp, rssi in sightings))
+
+
+class SightingAggregates():
+    """
+        Devices and per minute sighting rollups of a set of agent sightings. Both ingest paths
+        write agent batches in this form, the sharded service (sniffer/ingest.py) and
+        ingest_batch, so agent sightings never become raw sighting rows in either of them.
+    """
+    def __init__(self):
+        # MAC Address -> [prefix vendor, count, first_seen, last_seen]
+        self.devices: dict = {}
+        # (MAC Address, minute) -> [sightings, rssi_count, rssi_sum, rssi_min, rssi_max, first_seen, last_seen]
+        self.rollups: dict = {}
+
+    def add(self, mac: str, seen: int, rssi):
+        """
+            Adds one sighting, seen is its timestamp in whole seconds.
+        """
+        self.add_device(mac, None, 1, seen, seen)
+        self.add_rollup(mac, seen - seen % ROLLUP_BUCKETS["minute"], 1, 0 if rssi is None else 1, rssi or 0,
+                        rssi, rssi, seen, seen)
+
+    def add_device(self, mac: str, vendor, count: int, first_seen: int, last_seen: int):
+        device = self.devices.get(mac)
+        if device is None:
+            self.devices[mac] = [vendor, count, first_seen, last_seen]
+            return
+        device[0] = device[0] or vendor
+        device[1] += count
+        device[2] = min(device[2], first_seen)
+        device[3] = max(device[3], last_seen)
+
+    def add_rollup(self, mac: str, start: int, sightings: int, rssi_count: int, rssi_sum: int, rssi_min, rssi_max,
+                   first_seen: int, last_seen: int):
+        rollup = self.rollups.get((mac, start))
+        if rollup is None:
+            self.rollups[(mac, start)] = [sightings, rssi_count, rssi_sum, rssi_min, rssi_max, first_seen, last_seen]
+            return
+        rollup[0] += sightings
+        rollup[1] += rssi_count
+        rollup[2] += rssi_sum
+        if rssi_min is not None and (rollup[3] is None or rssi_min < rollup[3]):
+            rollup[3] = rssi_min
+        if rssi_max is not None and (rollup[4] is None or rssi_max > rollup[4]):
+            rollup[4] = rssi_max
+        rollup[5] = min(rollup[5], first_seen)
+        rollup[6] = max(rollup[6], last_seen)
+
+    def resolve_vendors(self, resolver=None):
+        """
+            Looks up the prefix vendor of the devices that have none yet.
+        """
+        macs = [mac for mac, device in self.devices.items() if device[0] is None]
+        vendors = (resolver or get_resolver()).lookup_many(macs, default=None)
+        for mac, vendor in zip(macs, vendors):
+            self.devices[mac][0] = vendor or "Unknown"
+
+    def device_rows(self) -> list:
+        """
+            :return devices: see write_device_aggregates.
+        """
+        return [(mac, *device) for mac, device in self.devices.items()]
+
+    def rollup_rows(self) -> list:
+        """
+            :return rollups: see write_sighting_rollups.
+        """
+        return [(*key, *rollup) for key, rollup in self.rollups.items()]
+
+
+def ingest_batch(agent_id: str, sequence: int, sightings: list):
+    """
+        Writes a batch of sightings shipped by a sensor agent (sniffer/agent.py) as a scan of
+        its own. Batches are keyed by agent and sequence number and written in the same
+        transaction as their rows, so a batch the agent sends again, because the answer to
+        the first attempt was lost, is recognised and nothing is counted twice.
+        The sightings are written as device aggregates and sighting rollups, like the sharded
+        ingest service writes them.
+
+        :param sightings: list of dicts with mac_address, timestamp and rssi.
+        :return scan_number: the scan number the rows were written with, None when the batch
+            was ingested before.
+    """
+    current_time = int(time.time())
+    aggregates = SightingAggregates()
+    for sighting in sightings:
+        aggregates.add(sighting["mac_address"], int(sighting.get("timestamp") or current_time), sighting.get("rssi"))
+    aggregates.resolve_vendors()
 
-        cursor.execute("SELECT 1 FROM device WHERE mac_address = ?", (mac,))
-        target_device = 1 if cursor.fetchone() else 0
+    conn = connect_db()
+    cursor = conn.cursor()
 
-        cursor.execute("SELECT count FROM logs WHERE mac_address = ?", (mac,))
-        row = cursor.fetchone()
-        if row:
-            new_count = row[0] + 1
-            cursor.execute("""
-                UPDATE logs 
-                SET last_seen = ?, count = ?, scan_number = ?, target_device = ?, device_vendor = ?
-                WHERE mac_address = ?
-            """, (current_time, new_count, new_scan_number, target_device, device_vendor, mac))
-        else:
+    try:
+        begin_immediate(conn)
+        scan_number = next_scan_number(cursor)
+        cursor.execute("""
+            INSERT OR IGNORE INTO ingest_batch (agent_id, sequence, scan_number, sightings, received_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (agent_id, sequence, scan_number, len(sightings), current_time))
+        if cursor.rowcount == 0:
+            # Also takes back the scan number
+            conn.rollback()
+            return None
+
+        write_device_aggregates(cursor, aggregates.device_rows(), [], scan_number)
+        write_sighting_rollups(cursor, aggregates.rollup_rows())
+        conn.commit()
+    finally:
+        conn.close()
+    return scan_number
+
+
+def batch_ingested(agent_id: str, sequence: int) -> bool:
+    conn = connect_db()
+    try:
+        cursor = conn.execute("SELECT 1 FROM ingest_batch WHERE agent_id = ? AND sequence = ?", (agent_id, sequence))
+        return cursor.fetchone() is not None
+    finally:
+        conn.close()
+
+
+def ingest_aggregates(batches: list, parts: list):
+    """
+        Writes one epoch of the sharded ingest service (sniffer/ingest.py): the device
+        aggregates and sighting rollups the shards made of its batches and the keys of those
+        batches, as one scan in one transaction.
+        The keys are inserted first. A batch whose key is taken already, e.g. by a server
+        worker that ingests without the service, is left out of the aggregates, the rest of
+        the epoch is written.
+
+        :param batches: (agent_id, sequence, number of sightings) of every batch in the epoch.
+        :param parts: ((agent_id, sequence), devices, rollups) of every shard and batch, see
+            SightingAggregates.device_rows and rollup_rows.
+        :return scan_number, duplicates: the scan number the epoch was written with, None when
+            all its batches were ingested before, and the (agent_id, sequence) of those that were.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    try:
+        begin_immediate(conn)
+        scan_number = next_scan_number(cursor)
+        received_at = int(time.time())
+        duplicates = []
+        for agent_id, sequence, count in batches:
             cursor.execute("""
-                INSERT INTO logs (mac_address, device_vendor, target_device, first_seen, last_seen, count, scan_number) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (mac, device_vendor, target_device, current_time, current_time, 1, new_scan_number))
+                INSERT OR IGNORE INTO ingest_batch (agent_id, sequence, scan_number, sightings, received_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (agent_id, sequence, scan_number, count, received_at))
+            if cursor.rowcount == 0:
+                duplicates.append((agent_id, sequence))
+        if len(duplicates) == len(batches):
+            conn.rollback()
+            return None, duplicates
+
+        # The shards aggregate per batch, the batches kept are merged here
+        aggregates = SightingAggregates()
+        ignored = set(duplicates)
+        for key, devices, rollups in parts:
+            if tuple(key) in ignored:
+                continue
+            for device in devices:
+                aggregates.add_device(*device)
+            for rollup in rollups:
+                aggregates.add_rollup(*rollup)
+
+        write_device_aggregates(cursor, aggregates.device_rows(), [], scan_number)
+        write_sighting_rollups(cursor, aggregates.rollup_rows())
+        conn.commit()
+    finally:
+        conn.close()
+    return scan_number, duplicates
+
+
+class ScanLogWriter():
+    """
+        Collects the devices of one scan and writes them to the logs table in batches.
+        All batches of a scan share one scan number, so each MAC Address is still counted
+        once per scan.
+
+        :param flush_interval: seconds between writes, None only writes when the writer is closed.
+        :param output: callable the "Logs were updated" line of every write is passed to.
+    """
+    def __init__(self, flush_interval: float = None, output=print):
+        self.flush_interval = flush_interval
+        self.output = output
+        self.pending: list = []
+        self.scan_number = None
+        self.last_flush = time.time()
+
+    def add(self, device: dict):
+        self.pending.append(device)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.flush_interval is not None and time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+
+        self.scan_number = update_logs(device_list=self.pending, scan_number=self.scan_number, output=self.output)
+        self.pending = []
+
+    def close(self):
+        # A scan without any devices still takes a scan number, as it always has
+        if self.pending or self.scan_number is None:
+            self.scan_number = update_logs(device_list=self.pending, scan_number=self.scan_number, output=self.output)
+            self.pending = []
+
+
+def fetch_logs_changed_since(change_seq: int = None):
+    """
+        Reads the log rows changed after a change sequence, for delta syncs.
+        The high water mark and the rows are read in one transaction, so a client that
+        asks again from the returned change_seq cannot miss a write.
+
+        :param change_seq: change_seq of the client's high water mark, None returns the
+            rows of the latest change only.
+        :return (high_water_mark, rows): high_water_mark is {"change_seq", "scan_number", "last_seen"},
+            rows are dicts in the same shape as the /logs items.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
 
-    print(f"Logs were updated at {datetime.now()}")
-    conn.commit()
-    conn.close()
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT scan_number FROM scan_counter WHERE id = 1")
+        result = cursor.fetchone()
+        current_scan_number = result[0] if result else 0
+        cursor.execute("SELECT change_seq FROM change_counter WHERE id = 1")
+        result = cursor.fetchone()
+        current_change_seq = result[0] if result else 0
+        cursor.execute("SELECT MAX(last_seen) FROM logs")
+        last_seen = cursor.fetchone()[0]
+
+        cursor.execute('''
+            SELECT logs.mac_address, device_vendor, target_device, first_seen, last_seen, count, scan_number,
+                   presence_estimate.distance, presence_estimate.presence
+            FROM logs
+            LEFT JOIN presence_estimate ON presence_estimate.mac_address = logs.mac_address
+            WHERE change_seq > ?
+            ORDER BY last_seen DESC, logs.mac_address DESC
+        ''', (change_seq if change_seq is not None else max(current_change_seq - 1, 0),))
+        rows = [
+            {
+                "mac_address": row[0],
+                "device_vendor": row[1],
+                "target_device": bool(row[2]),
+                "first_seen": row[3],
+                "last_seen": row[4],
+                "count": row[5],
+                "scan_number": row[6],
+                "distance": row[7],
+                "presence": row[8],
+            }
+            for row in cursor.fetchall()
+        ]
+        conn.commit()
+    finally:
+        conn.close()
+
+    high_water_mark = {"change_seq": current_change_seq, "scan_number": current_scan_number, "last_seen": last_seen or 0}
+    return high_water_mark, rows
 
 
 
@@ -303,6 +781,283 @@ def update_logs(device_list: list):
 
 ###### Logs ############
 
+###### Sightings ######
+
+# Rollup bucket name -> bucket width in seconds
+ROLLUP_BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+# Adds new aggregates to the rollup row of the same bucket, device and bucket start
+ROLLUP_UPSERT = '''
+    ON CONFLICT(bucket, bucket_start, mac_address) DO UPDATE SET
+        sightings = sightings + excluded.sightings,
+        rssi_count = rssi_count + excluded.rssi_count,
+        rssi_sum = rssi_sum + excluded.rssi_sum,
+        rssi_min = CASE WHEN rssi_min IS NULL OR excluded.rssi_min < rssi_min THEN excluded.rssi_min ELSE rssi_min END,
+        rssi_max = CASE WHEN rssi_max IS NULL OR excluded.rssi_max > rssi_max THEN excluded.rssi_max ELSE rssi_max END,
+        first_seen = MIN(first_seen, excluded.first_seen),
+        last_seen = MAX(last_seen, excluded.last_seen)
+'''
+ROLLUP_WATERMARK_KEY = "sighting_rollup_watermark"
+
+
+def get_metadata(cursor, key: str, default=None):
+    cursor.execute("SELECT value FROM app_metadata WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    return row[0] if row else default
+
+
+def set_metadata(cursor, key: str, value):
+    cursor.execute("INSERT INTO app_metadata (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                   (key, str(value)))
+
+
+def rollup_sightings(batch_size: int = 100000) -> int:
+    """
+        Folds raw sightings that have not been rolled up yet into the per minute, hour and day
+        aggregates of sighting_rollup. Progress is tracked by a sighting id watermark stored in
+        app_metadata, in the same transaction as the aggregates, so every sighting is counted once.
+
+        :param batch_size: most sightings folded per call, call again until it returns 0.
+        :return rolled_up: number of sightings folded in.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    try:
+        begin_immediate(conn)
+        watermark = int(get_metadata(cursor, ROLLUP_WATERMARK_KEY, 0))
+        cursor.execute("SELECT MAX(id) FROM sighting WHERE id <= ?", (watermark + batch_size,))
+        upper = cursor.fetchone()[0]
+        if upper is None or upper <= watermark:
+            conn.rollback()
+            return 0
+
+        for bucket, seconds in ROLLUP_BUCKETS.items():
+            cursor.execute('''
+                INSERT INTO sighting_rollup (bucket, bucket_start, mac_address, sightings, rssi_count, rssi_sum,
+                                             rssi_min, rssi_max, first_seen, last_seen)
+                SELECT ?, (timestamp / ?) * ?, mac_address, COUNT(*), COUNT(rssi), COALESCE(SUM(rssi), 0),
+                       MIN(rssi), MAX(rssi), MIN(timestamp), MAX(timestamp)
+                FROM sighting
+                WHERE id > ? AND id <= ?
+                GROUP BY (timestamp / ?), mac_address
+            ''' + ROLLUP_UPSERT, (bucket, seconds, seconds, watermark, upper, seconds))
+
+        cursor.execute("SELECT COUNT(*) FROM sighting WHERE id > ? AND id <= ?", (watermark, upper))
+        rolled_up = cursor.fetchone()[0]
+        set_metadata(cursor, ROLLUP_WATERMARK_KEY, upper)
+        conn.commit()
+        return rolled_up
+    finally:
+        conn.close()
+
+
+def write_sighting_rollups(cursor, rollups: list):
+    """
+        Adds sightings the caller already rolled up per minute to the minute, hour and day
+        rollups, inside the caller's transaction. Agent sightings are written this way, see
+        SightingAggregates.
+
+        :param rollups: (mac_address, minute bucket_start, sightings, rssi_count, rssi_sum,
+            rssi_min, rssi_max, first_seen, last_seen) tuples.
+    """
+    for bucket, seconds in ROLLUP_BUCKETS.items():
+        cursor.executemany('''
+            INSERT INTO sighting_rollup (bucket, bucket_start, mac_address, sightings, rssi_count, rssi_sum,
+                                         rssi_min, rssi_max, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''' + ROLLUP_UPSERT, ((bucket, start - start % seconds, mac, *values) for mac, start, *values in rollups))
+
+
+def prune_sightings(raw_retention_days: int, minute_retention_days: int = None, batch_retention_days: int = None) -> int:
+    """
+        Applies the retention policy. Raw sightings older than raw_retention_days are deleted,
+        but only once they have been rolled up. Minute rollups can be given a retention of
+        their own, hour and day rollups are kept. The keys of ingested agent batches are
+        dropped after batch_retention_days, an agent only resends the batch it is shipping.
+
+        :return deleted: number of raw sightings deleted.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    now = int(time.time())
+
+    try:
+        begin_immediate(conn)
+        watermark = int(get_metadata(cursor, ROLLUP_WATERMARK_KEY, 0))
+        cursor.execute("DELETE FROM sighting WHERE timestamp < ? AND id <= ?",
+                       (now - raw_retention_days * 86400, watermark))
+        deleted = cursor.rowcount
+
+        if minute_retention_days is not None:
+            cursor.execute("DELETE FROM sighting_rollup WHERE bucket = 'minute' AND bucket_start < ?",
+                           (now - minute_retention_days * 86400,))
+
+        if batch_retention_days is not None:
+            cursor.execute("DELETE FROM ingest_batch WHERE received_at < ?", (now - batch_retention_days * 86400,))
+
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
+
+###### Sightings ######
+
+###### Notification Throttle ###
+
+def consume_notification_tokens(pairs: list, burst: int, cooldown: float, now: float = None) -> set:
+    """
+        Token bucket per (owner email, MAC Address), kept in the notification_throttle table
+        so the limit holds across scans and processes. Every bucket holds up to burst tokens
+        and regains one token per cooldown seconds, a notification costs one token.
+
+        :param pairs: (email, mac_address) tuples that want to notify.
+        :param burst: notifications allowed back to back.
+        :param cooldown: seconds for one token to come back.
+        :param now: current unix time, for tests.
+        :return allowed: the pairs that got a token.
+    """
+    now = time.time() if now is None else now
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return set()
+
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    try:
+        # Read and update in one write transaction, two scans cannot both spend the last token
+        begin_immediate(conn)
+        buckets = {}
+        for email, mac in pairs:
+            cursor.execute("SELECT tokens, updated_at FROM notification_throttle WHERE email = ? AND mac_address = ?",
+                           (email, mac))
+            buckets[(email, mac)] = cursor.fetchone()
+
+        allowed = set()
+        rows = []
+        for pair in pairs:
+            bucket = buckets[pair]
+            if bucket is None:
+                tokens = float(burst)
+            else:
+                tokens = min(float(burst), bucket[0] + max(0.0, now - bucket[1]) / cooldown)
+
+            if tokens >= 1:
+                tokens -= 1
+                allowed.add(pair)
+            rows.append((pair[0], pair[1], tokens, now))
+
+        cursor.executemany("""
+            INSERT INTO notification_throttle (email, mac_address, tokens, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(email, mac_address) DO UPDATE SET
+                tokens = excluded.tokens,
+                updated_at = excluded.updated_at
+        """, rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return allowed
+
+###### Notification Throttle ###
+
+###### Presence Estimate ###
+
+def update_presence_estimates(estimates: dict, updated_at: float = None):
+    """
+        Stores the latest smoothed RSSI, distance and presence confidence per MAC Address,
+        the /logs rows carry them next to the counts. Their logs rows get a new change_seq,
+        so delta syncs pick up the new estimates.
+
+        :param estimates: as returned by PresenceEstimator.estimate, a dict of parallel arrays.
+        :param updated_at: unix time of the estimates.
+    """
+    updated_at = time.time() if updated_at is None else updated_at
+    rows = [
+        (mac, round(rssi, 1), round(distance, 2), round(presence, 3), updated_at)
+        for mac, rssi, distance, presence in zip(estimates["mac_address"], estimates["rssi"].tolist(),
+                                                 estimates["distance"].tolist(), estimates["presence"].tolist())
+        # Devices without an RSSI reading have no estimate
+        if distance == distance
+    ]
+    if not rows:
+        return
+
+    conn = connect_db()
+    cursor = conn.cursor()
+
+    try:
+        begin_immediate(conn)
+        cursor.executemany("""
+            INSERT INTO presence_estimate (mac_address, rssi, distance, presence, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(mac_address) DO UPDATE SET
+                rssi = excluded.rssi,
+                distance = excluded.distance,
+                presence = excluded.presence,
+                updated_at = excluded.updated_at
+        """, rows)
+        change_seq = next_change_seq(cursor)
+        cursor.executemany("UPDATE logs SET change_seq = ? WHERE mac_address = ?", ((change_seq, row[0]) for row in rows))
+        conn.commit()
+    finally:
+        conn.close()
+
+###### Presence Estimate ###
+
+###### Scan Session ###
+
+def register_scan_session(user_email: str, scan_key: str, worker_pid: int, pid: int = None, sid: str = None,
+                          worker_start_time: int = None, pid_start_time: int = None):
+    """
+        Records the scan a server worker relays for a user, replacing the user's previous one.
+
+        :param scan_key: id of this scan, the daemon scan id for scans in the scanner daemon.
+        :param worker_pid: pid of the server worker relaying the scan.
+        :param pid: pid of the sniffer process, None for scans in the scanner daemon.
+        :param worker_start_time: start time of the worker process, with pid_start_time it tells
+            the recorded processes from later ones that got the same pid.
+    """
+    conn = connect_db()
+    try:
+        conn.execute("""
+            INSERT OR REPLACE INTO scan_session (user_email, scan_key, worker_pid, pid, sid, started_at,
+                                                 worker_start_time, pid_start_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_email, scan_key, worker_pid, pid, sid, int(time.time()), worker_start_time, pid_start_time))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def fetch_scan_session(user_email: str):
+    """
+        :return session: dict with the columns of the user's scan_session row, None when no scan is recorded.
+    """
+    conn = connect_db()
+    try:
+        cursor = conn.execute("SELECT user_email, scan_key, worker_pid, pid, sid, started_at, worker_start_time, pid_start_time "
+                              "FROM scan_session WHERE user_email = ?", (user_email,))
+        row = cursor.fetchone()
+        return dict(zip([column[0] for column in cursor.description], row)) if row else None
+    finally:
+        conn.close()
+
+
+def delete_scan_session(user_email: str, scan_key: str):
+    """
+        Drops the scan, unless the user started another one since.
+    """
+    conn = connect_db()
+    try:
+        conn.execute("DELETE FROM scan_session WHERE user_email = ? AND scan_key = ?", (user_email, scan_key))
+        conn.commit()
+    finally:
+        conn.close()
+
+###### Scan Session ###
+
 ###### Device Vendor ###
 
 def get_logs_with_vendor():
@@ -310,21 +1065,16 @@ def get_logs_with_vendor():
     cursor = conn.cursor()
 
     cursor.execute('''
-        SELECT 
-            logs.mac_address,
-            COALESCE(device_vendor.vendor_name, 'Unknown') AS vendor_name,
-            logs.first_seen,
-            logs.last_seen,
-            logs.count,
-            logs.scan_number
+        SELECT mac_address, first_seen, last_seen, count, scan_number
         FROM logs
-        LEFT JOIN device_vendor
-        ON logs.mac_address LIKE device_vendor.mac_address_prefix || '%'
     ''')
 
-    results = cursor.fetchall()
+    rows = cursor.fetchall()
     conn.close()
-    return results
+
+    # Vendors come from the in memory resolver instead of a LIKE join per log row
+    vendors = get_resolver().lookup_many([row[0] for row in rows])
+    return [(row[0], vendor) + row[1:] for row, vendor in zip(rows, vendors)]
 
 
 ###### Device Vendor ###
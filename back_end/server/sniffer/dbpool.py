@@ -0,0 +1,139 @@
+"""
+    Shared SQLite connection layer.
+
+    The sniffer and the Flask app write the same outputs/devices.db. Every connection made
+    through here (the sniffer pool below, and the SQLAlchemy engine through configure_connection)
+    runs in WAL mode with the same tuning, so log writes and dashboard reads stop blocking
+    each other, and waits on the write lock are bounded by a busy timeout instead of failing.
+"""
+
+import os
+import sqlite3
+import threading
+from metrics import DB_QUERIES
+
+DEFAULT_DB_PATH = os.path.join("outputs", "devices.db")
+BUSY_TIMEOUT_MS = 5000
+POOL_SIZE = 8
+# Statements kept compiled per connection, pooled connections keep them between calls
+CACHED_STATEMENTS = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    # NORMAL is durable across application crashes in WAL mode, only a power loss can drop the last commits
+    "PRAGMA synchronous = NORMAL",
+    # Negative values are KiB, 16 MiB of page cache per connection
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA foreign_keys = ON",
+)
+
+
+def configure_connection(conn):
+    """
+        Applies the shared PRAGMAs to a raw sqlite3 connection.
+        Also registered as a SQLAlchemy connect listener by the Flask app.
+    """
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+
+class CountingCursor(sqlite3.Cursor):
+    """
+        Counts every statement into sniffer_db_queries_total, an executemany counts once.
+    """
+    def execute(self, *args):
+        DB_QUERIES.inc()
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        DB_QUERIES.inc()
+        return super().executemany(*args)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+        sqlite3 connection whose close() hands it back to its pool, so the existing
+        connect / close pattern in db.py keeps working unchanged.
+    """
+    pool = None
+
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        DB_QUERIES.inc()
+        return super().execute(*args)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def close_for_real(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool():
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path: str = path
+        self.size: int = size
+        self.idle: list = []
+        self.lock = threading.Lock()
+
+    def acquire(self) -> PooledConnection:
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, factory=PooledConnection,
+                               check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+        configure_connection(conn)
+        conn.pool = self
+        return conn
+
+    def release(self, conn: PooledConnection):
+        # Whatever the caller did not commit is dropped, the next user gets a clean connection
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close_for_real()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close_for_real()
+
+
+_pools: dict = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str = DEFAULT_DB_PATH) -> ConnectionPool:
+    """
+        Returns the pool for a database file, one pool per absolute path.
+    """
+    key = os.path.abspath(path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(key)
+        return _pools[key]
+
+
+def begin_immediate(conn):
+    """
+        Starts a write transaction straight away. In WAL mode a transaction that reads first
+        and writes later can fail with SQLITE_BUSY when another writer committed in between,
+        taking the write lock up front makes it wait on the busy timeout instead.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
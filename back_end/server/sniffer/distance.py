@@ -0,0 +1,223 @@
+"""
+    Vectorised RSSI smoothing, distance and presence estimation.
+
+    RSSI readings are smoothed per device with a one dimensional Kalman filter (a random walk
+    model, which settles into an EMA with a gain that adapts to how long a device was quiet),
+    turned into a distance with the log-distance path-loss model
+
+        distance = 10 ** ((tx_power - rssi) / (10 * n))
+
+    using a per device calibrated tx_power, and given a presence confidence between 0 and 1
+    that falls as the filter gets less certain and as the last sighting ages.
+    Everything works on NumPy arrays, a batch of adverts costs a few array operations per
+    advert a single device sent in that batch, not Python work per advert.
+"""
+
+import threading
+import numpy as np
+from settings import load_config
+from vendors import normalize_mac
+
+# Measured RSSI at 1 meter of a typical BLE tag
+DEFAULT_TX_POWER = -59.0
+# 2 for free space, indoors usually somewhere between 2 and 4
+PATH_LOSS_EXPONENT = 2.0
+# Variance of a single RSSI reading in dB^2, about 4 dB standard deviation
+MEASUREMENT_NOISE = 16.0
+# How much the true RSSI may drift per second in dB^2, people and tags move
+PROCESS_NOISE = 1.0
+# Seconds after which an unseen device has lost about two thirds of its presence confidence
+PRESENCE_TIMEOUT = 30.0
+
+
+def rssi_to_distance(rssi, tx_power=DEFAULT_TX_POWER, path_loss_exponent: float = PATH_LOSS_EXPONENT) -> np.ndarray:
+    """
+        Log-distance path-loss model, in meters.
+
+        :param rssi: RSSI values in dBm, scalar or array.
+        :param tx_power: RSSI at 1 meter in dBm, scalar or array matching rssi.
+    """
+    rssi = np.asarray(rssi, dtype=np.float64)
+    tx_power = np.asarray(tx_power, dtype=np.float64)
+    return np.power(10.0, (tx_power - rssi) / (10.0 * path_loss_exponent))
+
+
+def calibrate_tx_power(rssi, distance, path_loss_exponent: float = PATH_LOSS_EXPONENT) -> float:
+    """
+        Estimates the tx_power of a device from readings taken at known distances.
+        The median keeps single reflections from skewing the calibration.
+
+        :param rssi: RSSI readings in dBm.
+        :param distance: distance in meters of each reading, or one distance for all.
+    """
+    rssi = np.asarray(rssi, dtype=np.float64)
+    distance = np.broadcast_to(np.asarray(distance, dtype=np.float64), rssi.shape)
+    return float(np.median(rssi + 10.0 * path_loss_exponent * np.log10(distance)))
+
+
+class PresenceEstimator():
+    """
+        Keeps the smoothed RSSI of every device in NumPy arrays and updates it from batches
+        of adverts.
+
+        :param tx_power: MAC Address -> calibrated tx_power for devices that have one.
+        :param default_tx_power: tx_power of every other device.
+        :param path_loss_exponent: n of the path-loss model.
+        :param measurement_noise: variance of one RSSI reading in dB^2.
+        :param process_noise: RSSI drift per second in dB^2.
+        :param presence_timeout: seconds for the presence confidence to decay by a factor e.
+    """
+    def __init__(self, tx_power: dict = None, default_tx_power: float = DEFAULT_TX_POWER,
+                 path_loss_exponent: float = PATH_LOSS_EXPONENT, measurement_noise: float = MEASUREMENT_NOISE,
+                 process_noise: float = PROCESS_NOISE, presence_timeout: float = PRESENCE_TIMEOUT):
+        self.calibrated_tx_power: dict = dict(tx_power or {})
+        self.default_tx_power: float = default_tx_power
+        self.path_loss_exponent: float = path_loss_exponent
+        self.measurement_noise: float = measurement_noise
+        self.process_noise: float = process_noise
+        self.presence_timeout: float = presence_timeout
+
+        self.slots: dict = {}
+        self.mac_addresses: list = []
+        self.rssi = np.zeros(0)
+        self.variance = np.zeros(0)
+        self.last_seen = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.tx_power = np.zeros(0)
+        # The scanner daemon updates the estimator on its discovery thread while scans read it
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.mac_addresses)
+
+    def slots_for(self, mac_addresses) -> np.ndarray:
+        """
+            Returns the array index of every MAC Address, adding unknown devices.
+        """
+        slots = self.slots
+        indices = np.fromiter((slots.get(mac, -1) for mac in mac_addresses), dtype=np.int64, count=len(mac_addresses))
+        if (indices < 0).any():
+            for position in np.flatnonzero(indices < 0):
+                mac = mac_addresses[position]
+                if mac not in slots:
+                    slots[mac] = len(self.mac_addresses)
+                    self.mac_addresses.append(mac)
+                indices[position] = slots[mac]
+            self._grow(len(self.mac_addresses))
+        return indices
+
+    def _grow(self, size: int):
+        old_size = len(self.rssi)
+        if size <= old_size:
+            return
+        new_size = max(size, old_size * 2, 64)
+        extra = new_size - old_size
+        self.rssi = np.concatenate([self.rssi, np.zeros(extra)])
+        self.variance = np.concatenate([self.variance, np.zeros(extra)])
+        self.last_seen = np.concatenate([self.last_seen, np.zeros(extra)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.tx_power = np.concatenate([self.tx_power, np.full(extra, self.default_tx_power)])
+        for mac, tx_power in self.calibrated_tx_power.items():
+            slot = self.slots.get(mac)
+            if slot is not None:
+                self.tx_power[slot] = tx_power
+
+    def calibrate(self, mac_address: str, tx_power: float):
+        with self.lock:
+            self.calibrated_tx_power[mac_address] = tx_power
+            self.tx_power[self.slots_for([mac_address])[0]] = tx_power
+
+    def update(self, mac_addresses: list, rssi, timestamps):
+        """
+            Folds a batch of adverts into the filter state.
+            Adverts are applied per device in timestamp order. Each pass handles the next
+            advert of every device in the batch at once, so the number of passes is the
+            largest number of adverts a single device sent in the batch.
+
+            :param mac_addresses: MAC Address of every advert.
+            :param rssi: RSSI of every advert in dBm.
+            :param timestamps: unix time of every advert.
+        """
+        if len(mac_addresses) == 0:
+            return
+
+        with self.lock:
+            slots = self.slots_for(mac_addresses)
+            rssi = np.asarray(rssi, dtype=np.float64)
+            timestamps = np.asarray(timestamps, dtype=np.float64)
+
+            order = np.lexsort((timestamps, slots))
+            slots, rssi, timestamps = slots[order], rssi[order], timestamps[order]
+            group_starts = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+            group_sizes = np.diff(np.r_[group_starts, len(slots)])
+
+            measurement_noise = self.measurement_noise
+            for rank in range(int(group_sizes.max())):
+                positions = group_starts[group_sizes > rank] + rank
+                slot = slots[positions]
+                reading = rssi[positions]
+                timestamp = timestamps[positions]
+
+                new = self.count[slot] == 0
+                elapsed = np.maximum(timestamp - self.last_seen[slot], 0.0)
+                predicted_variance = self.variance[slot] + self.process_noise * elapsed
+                gain = predicted_variance / (predicted_variance + measurement_noise)
+                smoothed = self.rssi[slot] + gain * (reading - self.rssi[slot])
+
+                self.rssi[slot] = np.where(new, reading, smoothed)
+                self.variance[slot] = np.where(new, measurement_noise, (1.0 - gain) * predicted_variance)
+                self.last_seen[slot] = np.maximum(self.last_seen[slot], timestamp)
+                self.count[slot] += 1
+
+    def estimate(self, mac_addresses: list = None, now: float = None) -> dict:
+        """
+            Distance and presence confidence of the given devices, all devices when None.
+
+            :param now: unix time the presence confidence is computed for, the latest advert when None.
+            :return estimates: dict of arrays, mac_address, rssi, distance and presence.
+        """
+        with self.lock:
+            if mac_addresses is None:
+                mac_addresses = list(self.mac_addresses)
+                slots = np.arange(len(mac_addresses))
+            else:
+                slots = self.slots_for(mac_addresses)
+
+            last_seen = self.last_seen[slots]
+            if now is None:
+                now = float(self.last_seen[:len(self.mac_addresses)].max()) if len(self.mac_addresses) else 0.0
+            age = np.maximum(now - last_seen, 0.0)
+            variance = self.variance[slots] + self.process_noise * age
+            seen = self.count[slots] > 0
+
+            presence = np.where(seen, np.exp(-age / self.presence_timeout) * self.measurement_noise / (variance + self.measurement_noise), 0.0)
+            distance = np.where(seen, rssi_to_distance(self.rssi[slots], self.tx_power[slots], self.path_loss_exponent), np.nan)
+            return {"mac_address": list(mac_addresses), "rssi": self.rssi[slots], "distance": distance, "presence": presence}
+
+    def get(self, mac_address: str, now: float = None):
+        """
+            Estimate of one device as plain floats for events and log rows.
+
+            :return estimate: dict with rssi, distance and presence, or None when the device has no RSSI yet.
+        """
+        with self.lock:
+            slot = self.slots.get(mac_address)
+            if slot is None or self.count[slot] == 0:
+                return None
+            estimates = self.estimate([mac_address], now=now)
+            return {
+                "rssi": round(float(estimates["rssi"][0]), 1),
+                "distance": round(float(estimates["distance"][0]), 2),
+                "presence": round(float(estimates["presence"][0]), 3),
+            }
+
+
+def load_estimator() -> PresenceEstimator:
+    """
+        Estimator with the calibration from config.json, tx_power maps MAC Addresses to their
+        measured RSSI at 1 meter and path_loss_exponent sets n. Defaults when there is no config.
+    """
+    config = load_config()
+    tx_power = {normalize_mac(mac): float(value) for mac, value in config.get("tx_power", {}).items()}
+    return PresenceEstimator(tx_power=tx_power,
+                             path_loss_exponent=float(config.get("path_loss_exponent", PATH_LOSS_EXPONENT)))
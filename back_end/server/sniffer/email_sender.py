@@ -1,47 +1,239 @@
 import smtplib
-import json
+import time
+import queue
+import threading
+from collections import defaultdict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from metrics import EMAILS_SENT, EMAIL_FAILURES, EMAIL_SEND_DURATION
+from settings import read_config
 
-def import_json_file(path: str):
-    # Load the JSON file
-    with open(path, 'r') as file:
-        data = json.load(file)
+DEFAULT_SMTP_HOST = "smtp.gmail.com"
+DEFAULT_SMTP_PORT = 587
+SUBJECT = "Bluetooth Sniffer Dashboard Notification"
 
-    return data
+# Notifications for the same address that arrive within this many seconds go out as one digest
+BATCH_WINDOW = 2.0
+MAX_RETRIES = 4
+RETRY_BACKOFF = 1.0
+# SMTP servers drop idle connections, one left unused this long is closed instead of kept open
+IDLE_TIMEOUT = 60.0
 
 
-def send_email(text: str, email=None):
-    ## TODO make it work with multiple emails
-
-    data = import_json_file(path='config.json')
-    # Email details
-    # Extract username and password
-    sender_email = data.get('username')
-    if email == None:
-        receiver_email = data.get('receiver')
-    else:
-        receiver_email = email
-    password = data.get('password')
-
-
-    subject = "Bluetooth Sniffer Dashboard Notification"
+def build_message(text: str, sender_email: str, receiver_email: str):
     body = f"Target device is within the vicinity.\n\n{text} \n\n\nBluetooth Sniffer Dashboard Notification via Bluetooth Sniffer"
 
     # Create the email
     msg = MIMEMultipart()
     msg['From'] = sender_email
     msg['To'] = receiver_email
-    msg['Subject'] = subject
+    msg['Subject'] = SUBJECT
     msg.attach(MIMEText(body, 'plain'))
+    return msg
 
-    # Send the email
-    try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
+
+def format_digest(devices: list) -> str:
+    """
+        :param devices: matched devices, dicts with device_name, mac_address and timestamp.
+    """
+    message = "Matched Devices:\n"
+    for d in devices:
+        message += f"- {d['device_name']} ({d['mac_address']}) at {time.ctime(d['timestamp'])}\n"
+    return message
+
+
+class SMTPConnection():
+    """
+        One SMTP connection that is opened on first use and kept for later messages, so
+        consecutive notifications skip the TLS handshake and login.
+    """
+    def __init__(self, config: dict):
+        self.config: dict = config
+        self.server = None
+        self.last_used = 0.0
+
+    def open(self):
+        server = smtplib.SMTP(self.config.get("smtp_host", DEFAULT_SMTP_HOST),
+                              int(self.config.get("smtp_port", DEFAULT_SMTP_PORT)), timeout=30)
+        try:
             server.ehlo()
-            server.starttls()
-            server.login(sender_email, password)
-            server.sendmail(sender_email, receiver_email, msg.as_string())
+            if self.config.get("use_tls", True):
+                server.starttls()
+                server.ehlo()
+            if self.config.get("password"):
+                server.login(self.config.get("username"), self.config.get("password"))
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.last_used = time.monotonic()
+
+    def send(self, receiver_email: str, text: str):
+        started = time.perf_counter()
+        if self.server is not None and time.monotonic() - self.last_used > IDLE_TIMEOUT:
+            self.close()
+        if self.server is None:
+            self.open()
+
+        sender_email = self.config.get("username")
+        msg = build_message(text, sender_email, receiver_email)
+        try:
+            self.server.sendmail(sender_email, receiver_email, msg.as_string())
+        except smtplib.SMTPResponseException:
+            # The server answered, the connection itself is still usable
+            raise
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Drop the broken connection, the retry opens a new one
+            self.server.close()
+            self.server = None
+            raise
+        self.last_used = time.monotonic()
+        EMAIL_SEND_DURATION.observe(time.perf_counter() - started)
+        EMAILS_SENT.inc()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+
+class NotificationDispatcher():
+    """
+        Sends target match notifications from a background thread, so a scan never waits
+        on SMTP. Matches for the same address that arrive within the batch window are
+        merged into one digest, all mails share one persistent SMTP connection and failed
+        sends are retried with exponential backoff.
+
+        :param config: email settings, config.json is read when not given. Besides receiver,
+            username and password it may set smtp_host, smtp_port and use_tls, e.g. to point
+            the sniffer at a local SMTP server.
+        :param batch_window: seconds to collect matches before sending.
+        :param max_retries: attempts per digest before it is dropped.
+        :param retry_backoff: seconds before the first retry, doubled on every further one.
+    """
+    def __init__(self, config: dict = None, batch_window: float = BATCH_WINDOW,
+                 max_retries: int = MAX_RETRIES, retry_backoff: float = RETRY_BACKOFF):
+        self.config = config
+        self.batch_window: float = batch_window
+        self.max_retries: int = max_retries
+        self.retry_backoff: float = retry_backoff
+        self.queue = queue.Queue()
+        self.connection = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def notify(self, devices: list, email=None):
+        """
+            Queues a notification and returns straight away.
+
+            :param devices: matched devices, dicts with device_name, mac_address and timestamp.
+            :param email: receiver, the receiver from config.json when None.
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.queue.put((email, list(devices)))
+
+    def close(self, timeout: float = None):
+        """
+            Sends everything still queued, then closes the SMTP connection.
+        """
+        with self.lock:
+            thread = self.thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=IDLE_TIMEOUT)
+            except queue.Empty:
+                if self.connection is not None:
+                    self.connection.close()
+                continue
+
+            if item is None:
+                break
+
+            # Collect whatever else arrives within the batch window
+            pending = defaultdict(list)
+            deadline = time.monotonic() + self.batch_window
+            stop = False
+            while item is not None:
+                email, devices = item
+                pending[email].extend(devices)
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+                else:
+                    stop = item is None
+
+            for email, devices in pending.items():
+                self._send_with_retry(email, format_digest(devices))
+
+            if stop:
+                break
+
+        if self.connection is not None:
+            self.connection.close()
+
+    def _send_with_retry(self, email, text: str) -> bool:
+        for attempt in range(self.max_retries):
+            try:
+                if self.connection is None:
+                    if self.config is None:
+                        self.config = read_config()
+                    self.connection = SMTPConnection(self.config)
+
+                receiver_email = email if email is not None else self.config.get("receiver")
+                self.connection.send(receiver_email, text)
+                print(f"Email sent to {receiver_email} successfully!")
+                return True
+            except Exception as e:
+                EMAIL_FAILURES.inc()
+                print(f"Error: {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.retry_backoff * 2 ** attempt)
+        return False
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> NotificationDispatcher:
+    """
+        Returns the process wide dispatcher.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = NotificationDispatcher()
+    return _dispatcher
+
+
+def send_email(text: str, email=None):
+    """
+        Sends one email right away over a connection of its own.
+        Scans use the NotificationDispatcher instead.
+    """
+    try:
+        data = read_config()
+        receiver_email = data.get('receiver') if email is None else email
+        connection = SMTPConnection(data)
+        try:
+            connection.send(receiver_email, text)
+        finally:
+            connection.close()
         print(f"Email sent to {receiver_email} successfully!")
     except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        EMAIL_FAILURES.inc()
+        print(f"Error: {e}")
@@ -0,0 +1,87 @@
+"""
+    Typed events the sniffer reports while scanning.
+
+    Every event is a JSON object with an "event" field, written as one line (NDJSON) to stdout
+    by sniffer/main.py or to the client connection by the scanner daemon:
+
+        {"event": "scan_start", "packets": 100, "scan_time": 15}
+        {"event": "device_seen", "mac_address": "aa:bb:cc:dd:ee:ff", "device_name": "Tag", "timestamp": 1700000000.0}
+        {"event": "match", "mac_address": "aa:bb:cc:dd:ee:ff", "device_name": "My Tag", "timestamp": 1700000000.0,
+         "rssi": -63.5, "distance": 1.68, "presence": 0.74}
+        {"event": "logs_updated", "message": "Logs were updated at ..."}
+        {"event": "scan_end", "devices": 12, "matches": 1}
+        {"event": "error", "message": "..."}
+        {"event": "message", "message": "..."}
+        {"event": "metrics", "metrics": {"sniffer_scans_total": {"type": "counter", "value": 1}, ...}}
+
+    rssi, distance and presence of a match are the smoothed estimate, see distance.py, and are
+    left out for devices without an RSSI reading.
+    A metrics event carries what the sniffer measured since its previous one, see metrics.py.
+    The server merges it into /metrics instead of showing it.
+    The server decodes each line once and forwards the events as they are.
+"""
+
+import sys
+import json
+
+SCAN_START = "scan_start"
+DEVICE_SEEN = "device_seen"
+MATCH = "match"
+LOGS_UPDATED = "logs_updated"
+SCAN_END = "scan_end"
+ERROR = "error"
+MESSAGE = "message"
+METRICS = "metrics"
+
+EVENT_TYPES = {SCAN_START, DEVICE_SEEN, MATCH, LOGS_UPDATED, SCAN_END, ERROR, MESSAGE, METRICS}
+
+
+def make_event(event_type: str, **fields) -> dict:
+    return {"event": event_type, **fields}
+
+
+def encode_event(event: dict) -> str:
+    return json.dumps(event, separators=(",", ":"))
+
+
+def decode_event(line: str) -> dict:
+    """
+        Turns one line of sniffer output back into an event.
+        Lines that are not events, e.g. prints from modules that do not know about events,
+        become message events, so a consumer only ever has to handle events.
+    """
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            event = None
+        if isinstance(event, dict) and event.get("event") in EVENT_TYPES:
+            return event
+    return make_event(MESSAGE, message=line)
+
+
+def write_event(event: dict):
+    """
+        Default event sink, one JSON line per event on stdout.
+    """
+    sys.stdout.write(encode_event(event) + "\n")
+    sys.stdout.flush()
+
+
+def describe_event(event: dict) -> str:
+    """
+        Human readable form of an event, the text the scanner page shows for it.
+    """
+    event_type = event.get("event")
+    if event_type == DEVICE_SEEN:
+        return event["mac_address"].upper()
+    if event_type == MATCH:
+        return f"Target device found: {event['device_name']} ({event['mac_address']})"
+    if event_type == SCAN_START:
+        return f"Scanning until {event['packets']} unique Bluetooth devices are found."
+    if event_type == SCAN_END:
+        return f"Scan finished, {event['devices']} devices found and {event['matches']} matched."
+    if event_type == ERROR:
+        return f"An error occurred: {event['message']}"
+    return str(event.get("message", ""))
@@ -0,0 +1,406 @@
+"""
+    Sharded ingest service for sensor agent batches, used by POST /ingest when INGEST_WORKERS
+    is set (see app/ingest_client.py).
+
+    Sightings are partitioned by a CRC32 of their MAC Address across a pool of shard
+    processes, so all sightings of a device pass through one shard. A shard aggregates the
+    devices of every batch in memory, one logs row per device however many sightings it got,
+    rolls their sightings up per minute like rollup_sightings does, and resolves their prefix
+    vendors (SightingAggregates in db.py, which ingest_batch writes batches with as well).
+
+    Batches are grouped into epochs. Every FLUSH_INTERVAL, or once FLUSH_SIGHTINGS have
+    arrived, the current epoch is closed: every shard hands its aggregates to the one writer
+    process, which commits the epoch, its logs upserts, sighting rollups and ingest_batch keys,
+    in a single transaction as one scan. A batch whose key another writer took in the meantime
+    is left out of the epoch and answered as a duplicate. Epochs are committed in order and a
+    batch is only answered once its epoch is, so an answered batch is on disk and an
+    unanswered one was not written at all, agents resending it still get it counted once.
+
+    SQLite takes one writer at a time, so the writer stays serial. The shards take the
+    aggregation, rollups and vendor lookups off it, it is left with one logs upsert per device
+    and three rollup upserts per device and minute of every epoch, however many sightings the
+    epoch had. Like with ingest_batch, agent sightings never become raw sighting rows.
+
+        python3 sniffer/ingest.py --socket outputs/ingest.sock --workers 4
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import zlib
+import socket
+import argparse
+import threading
+import multiprocessing
+from vendors import get_resolver
+from db import batch_ingested, ingest_aggregates, SightingAggregates
+from service_socket import lock_service_socket, bind_service_socket
+
+# Seconds batches are collected into one epoch before it is written
+FLUSH_INTERVAL = 0.05
+# Sightings after which an epoch is closed early, bounds the size of one transaction
+FLUSH_SIGHTINGS = 50000
+# Seconds a batch waits for its epoch to be written before it is answered with an error
+TICKET_TIMEOUT = 30
+# Seconds between checks that the shard and writer processes are still running
+WATCH_INTERVAL = 1.0
+
+
+def shard_of(mac_address: str, shards: int) -> int:
+    """
+        Shard of a MAC Address. CRC32 instead of hash(), which is salted per process.
+    """
+    return zlib.crc32(mac_address.encode("utf-8")) % shards
+
+
+def send_ingest_command(socket_path: str, command: dict, timeout: float = TICKET_TIMEOUT + 5):
+    """
+        Sends a single command to the ingest service and returns its reply.
+
+        :param command: command object, e.g. {"command": "ping"}.
+        :return reply: the decoded reply, or None when the service is not running.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(socket_path)
+            connection.sendall((json.dumps(command) + "\n").encode("utf-8"))
+            reply = connection.makefile("r").readline()
+            return json.loads(reply) if reply else None
+    except (OSError, ValueError):
+        return None
+
+
+def run_shard(index: int, inbox, writer_inbox):
+    """
+        Shard process, aggregates the sightings of its MAC Addresses until the epoch is closed.
+        Batches are aggregated apart, the writer leaves out the ones that were ingested before.
+
+        :param inbox: ("rows", (agent_id, sequence), [(mac_address, timestamp, rssi), ...]) and
+            ("flush", epoch) messages, None ends the shard.
+        :param writer_inbox: gets ("shard", epoch, index, [((agent_id, sequence), devices, rollups), ...]) for every epoch.
+    """
+    resolver = get_resolver()
+    # (agent_id, sequence) -> SightingAggregates of the batches of the current epoch
+    batches = {}
+
+    while True:
+        message = inbox.get()
+        if message is None:
+            return
+
+        if message[0] == "rows":
+            now = int(time.time())
+            aggregates = batches.setdefault(message[1], SightingAggregates())
+            for mac, timestamp, rssi in message[2]:
+                aggregates.add(mac, int(timestamp or now), rssi)
+        else:
+            parts = []
+            for key, aggregates in batches.items():
+                aggregates.resolve_vendors(resolver)
+                parts.append((key, aggregates.device_rows(), aggregates.rollup_rows()))
+            writer_inbox.put(("shard", message[1], index, parts))
+            batches = {}
+
+
+def run_writer(inbox, results, shards: int):
+    """
+        Writer process, commits every epoch once all shards and the service handed in their part.
+
+        :param inbox: ("batches", epoch, batches) from the service and ("shard", ...) from the shards, None ends the writer.
+        :param results: gets (epoch, scan_number, error, duplicate batch keys) for every epoch, in order.
+    """
+    # Epoch -> {"batches": list or None, "parts": per batch parts of the shards that handed theirs in, "shards": count}
+    epochs = {}
+    next_epoch = 0
+
+    while True:
+        message = inbox.get()
+        if message is None:
+            return
+
+        epoch = epochs.setdefault(message[1], {"batches": None, "parts": [], "shards": 0})
+        if message[0] == "batches":
+            epoch["batches"] = message[2]
+        else:
+            epoch["parts"] += message[3]
+            epoch["shards"] += 1
+
+        while next_epoch in epochs and epochs[next_epoch]["batches"] is not None \
+                and epochs[next_epoch]["shards"] == shards:
+            epoch = epochs.pop(next_epoch)
+            try:
+                # Batches written by someone else meanwhile are left out and answered as duplicates
+                scan_number, duplicates = ingest_aggregates(epoch["batches"], epoch["parts"])
+                results.put((next_epoch, scan_number, None, duplicates))
+            except Exception as e:
+                # Nothing of the epoch was written, its agents send the batches again
+                print(f"Error writing ingest epoch {next_epoch}: {e}")
+                results.put((next_epoch, None, str(e), []))
+            next_epoch += 1
+
+
+class IngestTicket():
+    """
+        A batch waiting for its epoch to be written.
+    """
+    def __init__(self, key: tuple, sightings: int):
+        self.key: tuple = key
+        self.sightings: int = sightings
+        self.scan_number = None
+        self.error = None
+        # Another writer took the batch first
+        self.duplicate: bool = False
+        self.done = threading.Event()
+
+
+class IngestService():
+    """
+        :param socket_path: UNIX socket POST /ingest hands batches to.
+        :param workers: number of shard processes.
+    """
+    def __init__(self, socket_path: str, workers: int, flush_interval: float = FLUSH_INTERVAL,
+                 flush_sightings: int = FLUSH_SIGHTINGS):
+        self.socket_path: str = socket_path
+        self.workers: int = max(1, workers)
+        self.flush_interval: float = flush_interval
+        self.flush_sightings: int = flush_sightings
+        self.shard_inboxes: list = []
+        self.writer_inbox = None
+        self.results = None
+        self.processes: list = []
+        self.lock = threading.Lock()
+        # (agent_id, sequence) -> IngestTicket of batches that are not written yet
+        self.in_flight: dict = {}
+        self.epoch: int = 0
+        self.epoch_tickets: list = []
+        self.epoch_sightings: int = 0
+        # Epoch -> its tickets, for epochs handed to the writer
+        self.closed_epochs: dict = {}
+        self.stopping = threading.Event()
+        self.server = None
+        self.lock_file = None
+
+    def start(self):
+        """
+            Starts the shard and writer processes, before any thread of the service runs.
+        """
+        self.writer_inbox = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.shard_inboxes = [multiprocessing.Queue() for _ in range(self.workers)]
+        self.processes = [multiprocessing.Process(target=run_writer, args=(self.writer_inbox, self.results, self.workers),
+                                                  name="ingest-writer", daemon=True)]
+        self.processes += [multiprocessing.Process(target=run_shard, args=(index, inbox, self.writer_inbox),
+                                                   name=f"ingest-shard-{index}", daemon=True)
+                           for index, inbox in enumerate(self.shard_inboxes)]
+        for process in self.processes:
+            process.start()
+
+        threading.Thread(target=self.flush_epochs, daemon=True).start()
+        threading.Thread(target=self.collect_results, daemon=True).start()
+
+    def serve_forever(self):
+        """
+            :raises RuntimeError: when another service serves the socket, both would write
+                batches the other one did not see yet.
+        """
+        self.lock_file = lock_service_socket(self.socket_path)
+        self.start()
+        self.server = bind_service_socket(self.socket_path)
+        print(f"Ingest service listening on {self.socket_path} with {self.workers} shards")
+
+        try:
+            while not self.stopping.is_set():
+                connection, _ = self.server.accept()
+                threading.Thread(target=self.handle_client, args=(connection,), daemon=True).start()
+        except OSError:
+            if not self.stopping.is_set():
+                raise
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+            Writes what was handed in so far and stops the processes.
+        """
+        self.stopping.set()
+        with self.lock:
+            self.close_epoch()
+        for inbox in self.shard_inboxes:
+            inbox.put(None)
+        for process in self.processes[1:]:
+            process.join(timeout=5)
+        if self.writer_inbox is not None:
+            self.writer_inbox.put(None)
+            self.processes[0].join(timeout=10)
+        deadline = time.monotonic() + 5
+        while self.closed_epochs and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        # Only the service holding the lock owns the socket file
+        if self.lock_file is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def stop(self):
+        """
+            Ends serve_forever from a signal handler or another thread.
+        """
+        self.stopping.set()
+        if self.server is not None:
+            self.server.shutdown(socket.SHUT_RDWR)
+
+    def handle_client(self, connection):
+        with connection:
+            try:
+                line = connection.makefile("r").readline()
+                command = json.loads(line) if line else {}
+            except ValueError:
+                self.reply(connection, {"error": "Invalid command"})
+                return
+
+            name = command.get("command")
+            if name == "ingest":
+                self.reply(connection, self.submit(command["agent_id"], command["sequence"], command["sightings"]))
+            elif name == "ping":
+                self.reply(connection, {"message": "pong", "workers": self.workers, "in_flight": len(self.in_flight)})
+            else:
+                self.reply(connection, {"error": f"Unknown command {name}"})
+
+    def reply(self, connection, payload: dict):
+        try:
+            connection.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        except OSError:
+            pass
+
+    def submit(self, agent_id: str, sequence: int, sightings: list) -> dict:
+        """
+            Hands a batch to the shards and waits until its epoch is written.
+
+            :param sightings: [mac_address, timestamp, rssi] lists, MAC Addresses normalized.
+            :return reply: scan_number and duplicate, or error.
+        """
+        key = (agent_id, sequence)
+        with self.lock:
+            ticket = self.in_flight.get(key)
+            duplicate = ticket is not None or batch_ingested(agent_id, sequence)
+            if not duplicate:
+                ticket = IngestTicket(key, len(sightings))
+                self.in_flight[key] = ticket
+                partitions = [[] for _ in range(self.workers)]
+                for mac, timestamp, rssi in sightings:
+                    partitions[shard_of(mac, self.workers)].append((mac, timestamp, rssi))
+                # Sent under the lock, so every shard gets the rows of an epoch before its flush
+                for inbox, rows in zip(self.shard_inboxes, partitions):
+                    if rows:
+                        inbox.put(("rows", key, rows))
+                self.epoch_tickets.append(ticket)
+                self.epoch_sightings += len(sightings)
+                if self.epoch_sightings >= self.flush_sightings:
+                    self.close_epoch()
+
+        # A resend of a batch still in flight waits for it, so its answer too means written
+        if ticket is not None and not ticket.done.wait(TICKET_TIMEOUT):
+            return {"error": "Batch was not written in time"}
+        if ticket is not None and ticket.duplicate:
+            duplicate = True
+        elif ticket is not None and ticket.error is not None:
+            return {"error": ticket.error}
+        if duplicate:
+            return {"scan_number": None, "duplicate": True}
+        return {"scan_number": ticket.scan_number, "duplicate": False}
+
+    def close_epoch(self):
+        """
+            Hands the current epoch to the writer, the caller holds the lock.
+        """
+        if not self.epoch_tickets or not self.processes:
+            return
+        self.closed_epochs[self.epoch] = self.epoch_tickets
+        self.writer_inbox.put(("batches", self.epoch, [(*ticket.key, ticket.sightings) for ticket in self.epoch_tickets]))
+        for inbox in self.shard_inboxes:
+            inbox.put(("flush", self.epoch))
+        self.epoch += 1
+        self.epoch_tickets = []
+        self.epoch_sightings = 0
+
+    def flush_epochs(self):
+        """
+            Closes the epoch every flush_interval, and stops the service when a process died.
+        """
+        last_watch = time.monotonic()
+        while not self.stopping.wait(self.flush_interval):
+            with self.lock:
+                self.close_epoch()
+
+            if time.monotonic() - last_watch >= WATCH_INTERVAL:
+                last_watch = time.monotonic()
+                dead = [process.name for process in self.processes if not process.is_alive()]
+                if dead:
+                    # Epochs of that process are never completed, batches in flight were not
+                    # written and are sent again, to a new service the dashboard starts
+                    print(f"Ingest processes ended: {', '.join(dead)}, stopping the service")
+                    self.fail("Ingest service stopped")
+                    self.stop()
+                    return
+
+    def fail(self, error: str):
+        with self.lock:
+            tickets = list(self.in_flight.values())
+            self.in_flight.clear()
+            self.closed_epochs.clear()
+            self.epoch_tickets = []
+        for ticket in tickets:
+            ticket.error = error
+            ticket.done.set()
+
+    def collect_results(self):
+        """
+            Answers the batches of every epoch the writer finished.
+        """
+        while True:
+            try:
+                epoch, scan_number, error, duplicates = self.results.get()
+            except (EOFError, OSError):
+                return
+            duplicates = set(duplicates)
+            with self.lock:
+                tickets = self.closed_epochs.pop(epoch, [])
+                for ticket in tickets:
+                    self.in_flight.pop(ticket.key, None)
+            for ticket in tickets:
+                ticket.scan_number = scan_number
+                ticket.error = error
+                ticket.duplicate = ticket.key in duplicates
+                ticket.done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded ingest service for sensor agent batches")
+    parser.add_argument("--socket", default=os.path.join("outputs", "ingest.sock"), help="UNIX socket to listen on")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of shard processes")
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL, help="seconds per epoch")
+    args = parser.parse_args()
+
+    service = IngestService(args.socket, args.workers, flush_interval=args.flush_interval)
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 import subprocess
+from capture import NRF_INTERFACE
+
+# tshark -D describes nRF Sniffer interfaces like this, e.g. "COM5-4.4 (nRF Sniffer for Bluetooth LE COM5)"
+NRF_DESCRIPTION = "nRF Sniffer for Bluetooth LE"
 
 def get_tshark_interfaces():
     """
@@ -48,27 +52,39 @@ def get_tshark_interfaces():
         print(f"An unexpected error occurred: {e}")
         return []
     
-def check_for_nrf_sniffer(interfaces: list, sniffer_mode: str):
+def find_nrf_interface(interfaces: list, configured: str = None):
     """
-        check_for_nrf_sniffer checks all the interfaces received by the 
-        interfaces list. And checks for COM5-4.4 if it exists then it returns 
-        a True Boolean. Otherwise returns False.
+        Picks the nRF Sniffer interface to capture on among the interfaces found by tshark.
 
         :param interfaces: list of all interfaces found by tshark.
+        :param configured: "nrf_interface" from config.json, when set only that interface is used.
+        :return name: the interface name, None when no nRF Sniffer was found.
+    """
+    if not interfaces:
+        print("No interfaces found or unable to retrieve interfaces.")
+        return None
+
+    names = [interface['name'] for interface in interfaces]
+    if configured:
+        return configured if configured in names else None
+
+    for interface in interfaces:
+        if NRF_DESCRIPTION in interface['description'] or NRF_DESCRIPTION in interface['name']:
+            return interface['name']
+    return NRF_INTERFACE if NRF_INTERFACE in names else None
+
+def check_for_nrf_sniffer(nrf_interface: str, sniffer_mode: str):
+    """
+        check_for_nrf_sniffer checks whether the scan has something to capture on.
+        Session modes report adapters that fail themselves, tshark mode needs the
+        interface found by find_nrf_interface.
+
+        :param nrf_interface: interface returned by find_nrf_interface.
 
         Returns:
             boolean: a boolean value based on whether or not nRF sniffer was found
     """
-    sniffer_boolean = False
-    
-    if sniffer_mode == "bluetoothctl":
+    if sniffer_mode in ("bluetoothctl", "bluez", "multi"):
         return True
-    
-    if interfaces:
-        for interface in interfaces:
-            if interface['name'] == 'COM5-4.4':
-                sniffer_boolean = True
-    else:
-        print("No interfaces found or unable to retrieve interfaces.")
 
-    return sniffer_boolean
\ No newline at end of file
+    return nrf_interface is not None
\ No newline at end of file
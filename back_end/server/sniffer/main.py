@@ -1,8 +1,9 @@
 from interfaces import *
 from outputs import *
-from sniffer import Sniffer
+from sniffer import Sniffer, load_sniffer_mode, load_nrf_interface
 from db import fetch_all_users, fetch_all_devices
-import math
+from events import make_event, write_event, MESSAGE, ERROR
+from distance import calibrate_tx_power
 import sys
 
 todays_date = ""
@@ -15,24 +16,25 @@ def estimate_tx_power(rssi, distance):
         This function is not needed in the main code base. But is used at the start of
         every project to estimate the power of your device.
         
-        :param rssi: The received signal strength (in dBm).
+        :param rssi: The received signal strength (in dBm), one reading or a list of readings.
         :param distance: The distance from the transmitter (in meters).
-        :return: Estimated Tx Power (in dBm).
+        :return: Estimated Tx Power (in dBm), put it under "tx_power" in config.json.
     """
-    n = 2  # Path-loss exponent (can vary, use 2 for free space)
-    tx_power = rssi + (10 * n * math.log10(distance))
-    return tx_power
+    return calibrate_tx_power(rssi, distance)
 
 # Default values
 DEFAULT_PACKETS = 100
 DEFAULT_SCAN_TIME = 15
 
 if __name__ == "__main__":
-    sniffer_mode = "bluetoothctl"
+    sniffer_mode = load_sniffer_mode()
     user_data = fetch_all_users()
     device_data = fetch_all_devices()
-    interfaces = []  # get_tshark_interfaces()
-    interface_found = check_for_nrf_sniffer(interfaces=interfaces, sniffer_mode=sniffer_mode)
+    # Only tshark mode captures on a tshark interface
+    nrf_interface = None
+    if sniffer_mode == "tshark":
+        nrf_interface = find_nrf_interface(get_tshark_interfaces(), load_nrf_interface())
+    interface_found = check_for_nrf_sniffer(nrf_interface=nrf_interface, sniffer_mode=sniffer_mode)
     todays_date = str(get_current_date())
 
     # Read from arguments or use defaults
@@ -43,15 +45,19 @@ if __name__ == "__main__":
         packets = DEFAULT_PACKETS
         scan_time = DEFAULT_SCAN_TIME
 
-    print(f"Sniffer received {packets} packets, and {scan_time} scan_time in seconds")
+    write_event(make_event(MESSAGE, message=f"Sniffer received {packets} packets, and {scan_time} scan_time in seconds"))
 
     sniffer = Sniffer(number_of_packets=packets, scan_time=scan_time,
                       user_data=user_data, device_data=device_data,
                       sniffer_mode=sniffer_mode)
 
     if interface_found:
-        sniffer.output_source_addresses(f"outputs\\{todays_date}\\{todays_date}.json")
+        sniffer.output_source_addresses(f"outputs\\{todays_date}\\{todays_date}.json", interface=nrf_interface)
+        # Wait for the queued match emails before the process exits
+        sniffer.notifier.close()
+        # Email timings of this scan, the scan end report was sent before the mails went out
+        sniffer.report_metrics()
     else:
-        print("nRF Sniffer for Bluetooth LE was not found!")
-        print("Exiting program!")
+        write_event(make_event(ERROR, message="nRF Sniffer for Bluetooth LE was not found!"))
+        write_event(make_event(MESSAGE, message="Exiting program!"))
         exit()
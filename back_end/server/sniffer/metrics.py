@@ -0,0 +1,222 @@
+"""
+    Counters, gauges and histograms in the Prometheus text format.
+
+    The sniffer and the Flask app each keep a registry. The sniffer sends what it measured
+    during a scan as a metrics event (see events.py), and the app merges it into its own
+    registry, which /metrics serves. So sniffer numbers show up however the sniffer runs
+    (as a sniffer/main.py process or inside the scanner daemon) without a second endpoint
+    to scrape.
+
+    Recording is a lock and an addition, hot loops should still count locally and record once
+    per batch or scan.
+"""
+
+import bisect
+import threading
+
+# Seconds, for work that takes milliseconds to seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter():
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self.lock:
+            value = self.value
+            if reset:
+                self.value = 0
+        return {"type": self.kind, "value": value}
+
+    def merge(self, snapshot: dict):
+        self.inc(snapshot["value"])
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge():
+    """
+        :param function: called on every scrape for the current value instead of set().
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function=None):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.function = function
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def snapshot(self, reset: bool = False) -> dict:
+        # A gauge is a current value, there is nothing to reset
+        return {"type": self.kind, "value": self.get()}
+
+    def merge(self, snapshot: dict):
+        self.set(snapshot["value"])
+
+    def samples(self):
+        yield self.name, self.get()
+
+
+class Histogram():
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.buckets: tuple = tuple(sorted(buckets))
+        # One count per bucket plus +Inf, not cumulative until rendered
+        self.counts: list = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self.lock:
+            snapshot = {"type": self.kind, "buckets": list(self.buckets), "counts": list(self.counts),
+                        "sum": self.sum, "count": self.count}
+            if reset:
+                self.counts = [0] * (len(self.buckets) + 1)
+                self.sum = 0.0
+                self.count = 0
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        if tuple(snapshot["buckets"]) != self.buckets:
+            raise ValueError(f"{self.name}: bucket bounds differ")
+        with self.lock:
+            self.counts = [count + other for count, other in zip(self.counts, snapshot["counts"])]
+            self.sum += snapshot["sum"]
+            self.count += snapshot["count"]
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{format_value(bound)}"}}', cumulative
+        yield f"{self.name}_sum", self.sum
+        yield f"{self.name}_count", self.count
+
+
+class Registry():
+    def __init__(self):
+        self.metrics: dict = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """
+            Adds a metric, or returns the one already registered under its name, so modules
+            can declare their metrics at import time however often they are imported.
+        """
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str, function=None) -> Gauge:
+        return self.register(Gauge(name, documentation, function))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def snapshot(self, reset: bool = False, prefix: str = "") -> dict:
+        """
+            :param reset: zero counters and histograms, so the next snapshot only holds what
+                happened since this one.
+            :param prefix: only metrics whose name starts with it.
+            :return snapshot: name -> plain dict, JSON serialisable.
+        """
+        with self.lock:
+            metrics = [metric for name, metric in self.metrics.items() if name.startswith(prefix)]
+        return {metric.name: metric.snapshot(reset=reset) for metric in metrics}
+
+    def merge(self, snapshot: dict, documentation: str = "Reported by the sniffer"):
+        """
+            Adds a snapshot taken with reset=True in another process. Unknown metrics are created.
+        """
+        for name, values in snapshot.items():
+            with self.lock:
+                metric = self.metrics.get(name)
+            if metric is None:
+                if values["type"] == "histogram":
+                    metric = self.histogram(name, documentation, tuple(values["buckets"]))
+                elif values["type"] == "gauge":
+                    metric = self.gauge(name, documentation)
+                else:
+                    metric = self.counter(name, documentation)
+            metric.merge(values)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# Metrics of this process
+REGISTRY = Registry()
+
+###### Sniffer ######
+
+ADVERTS_PARSED = REGISTRY.counter("sniffer_adverts_parsed_total", "Adverts parsed from bluetoothctl or tshark")
+SCANS = REGISTRY.counter("sniffer_scans_total", "Scans run")
+SCAN_DURATION = REGISTRY.histogram("sniffer_scan_duration_seconds", "Wall time of a scan",
+                                   buckets=(1, 5, 10, 15, 30, 60, 120, 300, 600))
+UPDATE_LOGS_DURATION = REGISTRY.histogram("sniffer_update_logs_seconds", "Time of one update_logs call")
+DB_QUERIES = REGISTRY.counter("sniffer_db_queries_total", "SQL statements run through the sniffer connection pool")
+SCAN_DB_QUERIES = REGISTRY.histogram("sniffer_scan_db_queries", "SQL statements run during one scan",
+                                     buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+EMAILS_SENT = REGISTRY.counter("sniffer_emails_sent_total", "Notification emails sent")
+EMAIL_FAILURES = REGISTRY.counter("sniffer_email_failures_total", "Notification email attempts that failed")
+EMAIL_SEND_DURATION = REGISTRY.histogram("sniffer_email_send_seconds", "Time to hand one email to the SMTP server, including connecting")
+
+###### Sniffer ######
@@ -0,0 +1,41 @@
+"""
+    UNIX sockets of the local services (scanner daemon, ingest service, Socket.IO broker).
+
+    A service takes an exclusive flock on <socket>.lock before it touches the socket. A second
+    instance fails to get the lock and refuses to start, instead of removing the socket of the
+    running one and serving next to it: two ingest services would both see a batch as new and
+    write it twice. The lock goes away with the process, so a socket file left behind by a
+    service that crashed is stale and replaced.
+"""
+
+import os
+import fcntl
+import socket
+
+
+def lock_service_socket(socket_path: str):
+    """
+        :return lock_file: holds the lock, keep it open while the service runs.
+        :raises RuntimeError: when another process serves socket_path.
+    """
+    lock_file = open(socket_path + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(f"Another process is serving {socket_path}")
+    return lock_file
+
+
+def bind_service_socket(socket_path: str, backlog: int = 128) -> socket.socket:
+    """
+        Listens on socket_path, the caller holds lock_service_socket, so a socket file found
+        there is stale.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(backlog)
+    return server
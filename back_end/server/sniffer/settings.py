@@ -0,0 +1,45 @@
+"""
+    config.json of the sniffer, read once per process and shared by the modules with settings
+    in it: email_sender, distance, adapters, throttle and sniffer.
+"""
+
+import json
+import threading
+
+CONFIG_PATH = "config.json"
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def import_json_file(path: str):
+    # Load the JSON file
+    with open(path, 'r') as file:
+        data = json.load(file)
+
+    return data
+
+
+def read_config(path: str = CONFIG_PATH) -> dict:
+    """
+        Reads config.json once per process.
+
+        :raises OSError, ValueError: when there is no config or it cannot be read.
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = import_json_file(path=path)
+    return _config
+
+
+def load_config() -> dict:
+    """
+        config.json for the optional settings, an empty config when there is none or it
+        cannot be read, so every setting falls back to its default.
+    """
+    try:
+        return read_config()
+    except (OSError, ValueError):
+        return {}
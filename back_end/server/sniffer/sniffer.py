@@ -1,24 +1,97 @@
 import subprocess
+import threading
 import time
-import math
-from datetime import datetime, timedelta
-from email_sender import send_email, import_json_file
+from email_sender import format_digest, get_dispatcher, NotificationDispatcher
+from settings import load_config
+from throttle import load_throttle, NotificationThrottle
+from capture import AddressStats, collect_address_stats, readings_from_json_export, live_readings, NRF_INTERFACE
 import sys
 import os
-from db import update_logs
+from collections import defaultdict
+from contextlib import closing
+from distance import load_estimator, rssi_to_distance, PresenceEstimator
+from db import update_logs, update_presence_estimates, ScanLogWriter
+from vendors import normalize_mac
+from bluetoothctl import BluetoothctlSession
+from bluez import BluezSession
+from adapters import load_adapter_sessions
+from events import make_event, write_event, SCAN_START, DEVICE_SEEN, MATCH, LOGS_UPDATED, SCAN_END, ERROR, MESSAGE, METRICS
+from metrics import REGISTRY, ADVERTS_PARSED, SCANS, SCAN_DURATION, DB_QUERIES, SCAN_DB_QUERIES
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
+# Seconds between log writes while a streaming scan is running
+LOG_FLUSH_INTERVAL = 1.0
+# Adverts collected before they are folded into the presence estimates in one vectorised update
+ESTIMATE_BATCH_SIZE = 4096
+# Seconds a quiet bluetoothctl scan waits before yielding None, so periodic work (log flushes) still runs
+IDLE_WAKEUP = 0.5
+# Update fields passed on with the device event besides the name and RSSI
+ADVERT_FIELDS = ("tx_power", "manufacturer_id", "manufacturer_data", "adapter", "adapter_rssi")
+DEFAULT_SNIFFER_MODE = "bluetoothctl"
+# Modes that scan through a live discovery session, the ones the scanner daemon can run
+SESSION_MODES = ("bluetoothctl", "bluez", "multi")
+
+
+def load_sniffer_mode() -> str:
+    """
+        Sniffer mode from config.json, "bluetoothctl" (the default), "bluez", "multi" or "tshark".
+    """
+    return load_config().get("sniffer_mode", DEFAULT_SNIFFER_MODE)
+
+
+def load_nrf_interface():
+    """
+        "nrf_interface" from config.json, the tshark interface tshark mode captures on.
+        None picks the nRF Sniffer tshark finds, see interfaces.find_nrf_interface.
+    """
+    return load_config().get("nrf_interface")
+
+
+def build_device_index(device_data: list) -> dict:
+    """
+        Builds a normalized MAC Address -> registered devices index, so matching a scanned
+        device is a single dict lookup instead of a pass over every registered device.
+
+        :param device_data: devices as returned by fetch_all_devices.
+        :return device_index: dict of MAC Address -> list of device dicts.
+    """
+    device_index = defaultdict(list)
+    for device in device_data:
+        device_index[normalize_mac(device['mac_address'])].append(device)
+    return dict(device_index)
+
 
 class Sniffer():
-    def __init__(self, number_of_packets: int, scan_time: int, user_data: list, device_data: list, sniffer_mode="tshark"):
+    def __init__(self, number_of_packets: int, scan_time: int, user_data: list, device_data: list, sniffer_mode="tshark",
+                 session=None, output=write_event, streaming: bool = True,
+                 notifier: NotificationDispatcher = None, throttle: NotificationThrottle = None,
+                 estimator: PresenceEstimator = None, feed_estimator: bool = True, write_logs: bool = True):
         print("Initialising Sniffer Object")
         self.number_of_packets = number_of_packets
         self.scan_time: int = scan_time
-        self.last_check = datetime.now()
         self.user_data: list = user_data
         self.device_data: list = device_data
+        self.device_index: dict = build_device_index(device_data)
         self.sniffer_mode: str = sniffer_mode
+        # BluetoothctlSession or BluezSession kept open between scans, None opens one per scan
+        self.session = session
+        # Receives every event of a scan as a dict, see events.py
+        self.output = output
+        self.streaming: bool = streaming
+        # Match emails are queued here and sent in the background, a scan never waits on SMTP
+        self.notifier: NotificationDispatcher = notifier if notifier is not None else get_dispatcher()
+        # Owners hear about the same device at most once per cooldown, however often scans run
+        self.throttle: NotificationThrottle = throttle if throttle is not None else load_throttle()
+        # Smoothed RSSI, distance and presence confidence per device, kept across scans
+        self.estimator: PresenceEstimator = estimator if estimator is not None else load_estimator()
+        # False when a ScanBroker feeds the estimator once for all scans sharing its discovery
+        self.feed_estimator: bool = feed_estimator
+        # False when a ScanBroker writes the logs and sightings once for all scans sharing its discovery
+        self.write_logs: bool = write_logs
+        self.stop_event = threading.Event()
+        # Discovery session of the running scan, stop() wakes it
+        self.active_session = None
 
         print(f"{len(user_data)} users found in the Database")
         print(f"{len(device_data)} devices found in the Database")
@@ -70,58 +143,155 @@ class Sniffer():
     #     except Exception as e:
     #         return f"An error occurred: {str(e)}"
 
-    def run_bluetoothctl(self):
-        try:
-            process = subprocess.Popen(
-                ["bluetoothctl"],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+    def new_session(self):
+        """
+            Discovery session of the sniffer mode, bluetoothctl, BlueZ over D-Bus or every
+            configured adapter at once.
+        """
+        if self.sniffer_mode == "bluez":
+            return BluezSession()
+        if self.sniffer_mode == "multi":
+            return load_adapter_sessions()
+        return BluetoothctlSession()
 
-            commands = [
-                "power on\n",
-                "scan on\n",
-            ]
+    def scan_events(self):
+        """
+            Generator that yields a device event as soon as the session reports a new or changed
+            device, a bluetoothctl [NEW] or [CHG] Device line or a BlueZ D-Bus signal. A change
+            carries only what changed, an RSSI update yields the RSSI with device_name None, a
+            ManufacturerData update its company id or payload. Removed devices are not sightings
+            and yield nothing.
+            Yields None whenever nothing arrived within IDLE_WAKEUP, so consumers can run periodic
+            work (log flushes) in quiet environments. Ends at the scan_time deadline, on stop()
+            or when bluetoothctl exits or bluetoothd goes away, reads never wait past the
+            deadline. Close the generator to end the scan early.
+
+            :return event: dict with mac_address, device_name, timestamp and rssi (None when the
+                line has none), plus tx_power, manufacturer_id or manufacturer_data when present, or None.
+        """
+        # A persistent session is reused as is, otherwise it only lives for this scan
+        session = self.session if self.session is not None else self.new_session()
+        session.open()
+        session.start_discovery()
+        self.stop_event.clear()
+        self.active_session = session
 
-            for command in commands:
-                process.stdin.write(command)
-                process.stdin.flush()
+        try:
+            start_time = time.monotonic()
+            deadline = start_time + self.scan_time
 
-            print(f"Scanning until {self.number_of_packets} unique Bluetooth devices are found.")
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.emit(MESSAGE, message=f"Timeout reached at {time.monotonic() - start_time:.3f}, stopping scan.")
+                    break
 
-            scanned_devices = {}
-            start_time = time.time()
+                updates = session.read_updates(timeout=min(remaining, IDLE_WAKEUP))
+                events = [self.device_event(update) for update in updates or () if update["action"] != "del"]
+                if events:
+                    yield from events
+                else:
+                    yield None
 
-            while True:
-                output = process.stdout.readline()
-                if "Device" in output:
-                    parts = output.split()
-                    if len(parts) >= 4:
-                        mac_address = parts[2].strip()
-                        device_name = " ".join(parts[3:]).strip()
-                        scanned_devices[mac_address.lower()] = device_name
-                        print(f"{mac_address}")
-                
-                if len(scanned_devices) >= self.number_of_packets:
-                    print(f"Found {self.number_of_packets} devices, stopping scan.")
+                if self.stop_event.is_set():
+                    self.emit(MESSAGE, message="Scan stopped on request.")
                     break
 
-                # Optional timeout to avoid infinite loop
-                if time.time() - start_time > self.scan_time:
-                    print(f"Timeout reached at {time.time() - start_time}, stopping scan.")
+                if updates is None:
+                    self.emit(MESSAGE, message=f"{self.sniffer_mode} session ended, stopping scan.")
                     break
+        finally:
+            self.active_session = None
+            if session is self.session:
+                if session.is_alive():
+                    session.stop_discovery()
+            else:
+                session.close()
+
+    def device_event(self, update: dict) -> dict:
+        """
+            Device event of one session update, see scan_events.
+        """
+        event = {
+            "mac_address": normalize_mac(update["mac_address"]),
+            "device_name": update.get("device_name"),
+            # Capture time when the session reports one, e.g. tshark frame.time_epoch
+            "timestamp": update.get("timestamp") or time.time(),
+            "rssi": update.get("rssi")
+        }
+        for field in ADVERT_FIELDS:
+            if field in update:
+                event[field] = update[field]
+        return event
+
+    def emit(self, event_type: str, **fields):
+        self.output(make_event(event_type, **fields))
+
+    def match_device(self, mac_address: str) -> list:
+        """
+            Returns the registered devices that have the scanned MAC Address.
 
-            process.stdin.write("scan off\n")
-            process.stdin.write("exit\n")
-            process.stdin.flush()
+            :param mac_address: scanned MAC Address, already lower case.
+        """
+        return self.device_index.get(mac_address, [])
+
+    def run_bluetoothctl(self):
+        try:
+            self.emit(SCAN_START, packets=self.number_of_packets, scan_time=self.scan_time)
+            started, queries_before = time.perf_counter(), DB_QUERIES.value
+            adverts = 0
+
+            scanned_devices = {}
+            # Best RSSI per adapter of every device, when the session reports several adapters
+            adapter_rssi = {}
+            email_device_map = defaultdict(list)
+            # In streaming mode new devices reach the logs table during the scan, not only at the end
+            log_writer = ScanLogWriter(flush_interval=LOG_FLUSH_INTERVAL if self.streaming else None,
+                                       output=lambda message: self.emit(LOGS_UPDATED, message=message)) if self.write_logs else None
+
+            with closing(self.scan_events()) as events:
+                for event in events:
+                    if event is None:
+                        if log_writer is not None:
+                            log_writer.flush_if_due()
+                        continue
+
+                    adverts += 1
+                    mac = event["mac_address"]
+                    if event["rssi"] is not None and self.feed_estimator:
+                        self.estimator.update([mac], [event["rssi"]], [event["timestamp"]])
+                    self.emit(DEVICE_SEEN, **event)
+                    if "adapter_rssi" in event:
+                        adapter_rssi[mac] = event["adapter_rssi"]
+                    if mac in scanned_devices:
+                        if event["device_name"] is not None:
+                            scanned_devices[mac] = event["device_name"]
+                        continue
+
+                    scanned_devices[mac] = event["device_name"] or ""
+                    if log_writer is not None:
+                        log_writer.add(event)
+
+                    # Check against known devices
+                    for device in self.match_device(mac):
+                        self.emit_match(mac, device['device_name'], event["timestamp"])
+                        email_device_map[device['email']].append({
+                            "mac_address": mac,
+                            "device_name": device['device_name'],
+                            "timestamp": event["timestamp"]
+                        })
 
-            # Finish process
-            process.communicate()
+                    if len(scanned_devices) >= self.number_of_packets:
+                        self.emit(MESSAGE, message=f"Found {self.number_of_packets} devices, stopping scan.")
+                        break
 
-            # --- Here comes your compare_bluetoothctl_output logic directly ---
-            from collections import defaultdict
+            if log_writer is not None:
+                log_writer.close()
+                self.store_estimates(scanned_devices)
+
+            for email, devices in email_device_map.items():
+                self.emit(MESSAGE, message=format_digest(devices))
+            self.notify_owners(email_device_map)
 
             # Build formatted device list for logs
             formatted_devices_list = []
@@ -131,101 +301,200 @@ class Sniffer():
                     "device_name": name,
                     "timestamp": time.time()
                 }
+                if mac in adapter_rssi:
+                    current_device["adapter_rssi"] = adapter_rssi[mac]
                 formatted_devices_list.append(current_device)
 
-            # Check against known devices
-            email_device_map = defaultdict(list)
-            for mac, name in scanned_devices.items():
-                for device in self.device_data:
-                    if device['mac_address'].lower() == mac:
-                        email_device_map[device['email']].append({
-                            "mac_address": mac,
-                            "device_name": device['device_name'],
-                            "timestamp": time.time()
-                        })
-
-            for email, devices in email_device_map.items():
-                message = "Matched Devices:\n"
-                for d in devices:
-                    message += f"- {d['device_name']} ({d['mac_address']}) at {time.ctime(d['timestamp'])}\n"
-                
-                print(message)
-                send_email(text=message, email=email)
-            
-            update_logs(device_list=formatted_devices_list)
-
+            self.record_scan(started, queries_before, adverts)
+            self.emit(SCAN_END, devices=len(scanned_devices), matches=sum(len(devices) for devices in email_device_map.values()))
             return formatted_devices_list
 
         except Exception as e:
+            self.emit(ERROR, message=str(e))
             return f"An error occurred: {str(e)}"
 
+    def record_scan(self, started: float, queries_before: int, adverts: int):
+        """
+            Records a finished scan and reports everything the sniffer measured since the last
+            report as a metrics event. Adverts are counted by the scan loops and added here once,
+            the loops themselves carry no instrumentation.
 
-    def has_three_minutes_passed(self):
+            :param started: time.perf_counter() at the start of the scan.
+            :param queries_before: DB_QUERIES.value at the start of the scan.
         """
-            Checks if three minutes have passed since last time a check has been made.
-            This is so that the user does not get spammed with notifications. So a notification every three minutes
+        SCANS.inc()
+        ADVERTS_PARSED.inc(adverts)
+        SCAN_DURATION.observe(time.perf_counter() - started)
+        SCAN_DB_QUERIES.observe(DB_QUERIES.value - queries_before)
+        self.report_metrics()
 
-            :return three_minutes_passed: Boolean value if three minutes have passed.
+    def report_metrics(self):
+        self.emit(METRICS, metrics=REGISTRY.snapshot(reset=True, prefix="sniffer_"))
+
+    def emit_match(self, mac: str, device_name: str, timestamp: float):
+        """
+            Match event with the current distance and presence estimate of the device, when it has one.
         """
-        # Define the time of the last check
-        last_check_time = self.last_check - timedelta(minutes=3)
+        self.emit(MATCH, mac_address=mac, device_name=device_name, timestamp=timestamp,
+                  **(self.estimator.get(mac) or {}))
 
-        # Check if 3 minutes have passed
-        time_elapsed = self.last_check - last_check_time
-        three_minutes_passed = time_elapsed >= timedelta(minutes=3)
+    def store_estimates(self, mac_addresses):
+        """
+            Writes the estimates of the devices of a finished scan next to their log rows.
+        """
+        mac_addresses = [mac for mac in mac_addresses if mac in self.estimator.slots]
+        if mac_addresses:
+            update_presence_estimates(self.estimator.estimate(mac_addresses, now=time.time()))
 
-        if three_minutes_passed == False:
-            self.last_check = datetime.now()
+    def notify_owners(self, email_device_map: dict):
+        """
+            Queues the match emails the throttle lets through.
+
+            :param email_device_map: owner email -> matched devices of this scan.
+        """
+        allowed = self.throttle.filter(email_device_map)
+        for email, devices in allowed.items():
+            self.notifier.notify(devices=devices, email=email)
+
+        held_back = sum(len(devices) for devices in email_device_map.values()) - sum(len(devices) for devices in allowed.values())
+        if held_back:
+            self.emit(MESSAGE, message=f"{held_back} match notifications held back, their devices notified recently.")
+
+    def stop(self):
+        """
+            Asks a running scan to finish early. The scan still writes its logs.
+        """
+        self.stop_event.set()
+        session = self.active_session
+        if session is not None:
+            session.wake()
+
+    def refresh(self, user_data: list, device_data: list):
+        """
+            Replaces the cached users and devices, used by long running scanners when
+            devices are added or deleted.
+        """
+        self.user_data = user_data
+        self.device_data = device_data
+        self.device_index = build_device_index(device_data)
+        self.emit(MESSAGE, message=f"{len(user_data)} users found in the Database")
+        self.emit(MESSAGE, message=f"{len(device_data)} devices found in the Database")
 
-        return three_minutes_passed
 
     def extract_addresses_and_rssi(self, json_file):
         """
-            Imports json file
-            Check for packets
-            Separates traffic from nordic ble sniffer
-            Counts the number of packets found in the file per MAC Address.
+            Streams a Wireshark JSON export of nRF Sniffer traffic packet by packet and
+            keeps running RSSI statistics per MAC Address, so memory stays flat however
+            large the capture is.
 
             :param json_file: captured packets in json format form Wireshark.
-            :return adress_rssi_list: returs the list of all counted up MAC Addresses.
+            :return adress_rssi_list: (address, count, average rssi) for every MAC Address.
+        """
+        stats = collect_address_stats(readings_from_json_export(json_file))
+        return [(address, address_stats.count, address_stats.mean) for address, address_stats in stats.items()]
+
+    def run_tshark(self, interface: str = NRF_INTERFACE, readings=None):
         """
-        data = import_json_file(path=json_file)
-        address_rssi_counts = {}
-
-        for packet in data:
-            try:
-                layers = packet["_source"]["layers"]
-                btle_layer = layers.get("btle", {})
-                nordic_ble_layer = layers.get("nordic_ble", {})
-                
-                source_address = btle_layer.get("btle.advertising_address")
-                rssi = nordic_ble_layer.get("nordic_ble.rssi")
-
-                if source_address and rssi:
-                    if source_address in address_rssi_counts:
-                        address_rssi_counts[source_address]["count"] += 1
-                        address_rssi_counts[source_address]["rssi"].append(int(rssi))
-                    else:
-                        address_rssi_counts[source_address] = {
-                            "count": 1,
-                            "rssi": [int(rssi)]
-                        }
-            except KeyError:
-                continue
-
-        address_rssi_list = [
-            (address, data["count"], sum(data["rssi"]) / len(data["rssi"]))
-            for address, data in address_rssi_counts.items()
-        ]
-
-        return address_rssi_list
-    
-    def output_source_addresses(self, json_file_path: str):
-        if self.sniffer_mode == "bluetoothctl":
+            Live capture through tshark on the nRF Sniffer interface.
+            Runs for scan_time seconds or until number_of_packets unique devices were seen,
+            logs and matches devices as they arrive like run_bluetoothctl does.
+
+            :param interface: tshark interface, see interfaces.get_tshark_interfaces.
+            :param readings: (address, rssi, timestamp) iterable to use instead of a live capture,
+                timestamp may be None or left out for the time the reading is processed.
+            :return stats: dict of MAC Address -> AddressStats.
+        """
+        self.emit(SCAN_START, packets=self.number_of_packets, scan_time=self.scan_time)
+        started, queries_before = time.perf_counter(), DB_QUERIES.value
+        stats = {}
+        email_device_map = defaultdict(list)
+        log_writer = ScanLogWriter(flush_interval=LOG_FLUSH_INTERVAL if self.streaming else None,
+                                   output=lambda message: self.emit(LOGS_UPDATED, message=message))
+
+        # Adverts waiting for the next vectorised estimator update
+        batch_macs, batch_rssi, batch_timestamps = [], [], []
+
+        def update_estimates():
+            self.estimator.update(batch_macs, batch_rssi, batch_timestamps)
+            batch_macs.clear()
+            batch_rssi.clear()
+            batch_timestamps.clear()
+
+        if readings is None:
+            # Ends on its own when the scan is stopped, while the capture is quiet too
+            readings = live_readings(interface, duration=self.scan_time, stop_event=self.stop_event)
+        readings = iter(readings)
+        self.stop_event.clear()
+        try:
+            for address, rssi, *captured in readings:
+                if self.stop_event.is_set():
+                    self.emit(MESSAGE, message="Scan stopped on request.")
+                    break
+
+                mac = normalize_mac(address)
+                timestamp = captured[0] if captured and captured[0] else time.time()
+                batch_macs.append(mac)
+                batch_rssi.append(rssi)
+                batch_timestamps.append(timestamp)
+
+                address_stats = stats.get(mac)
+                if address_stats is not None:
+                    address_stats.add(rssi)
+                    if len(batch_macs) >= ESTIMATE_BATCH_SIZE:
+                        update_estimates()
+                    continue
+
+                address_stats = stats[mac] = AddressStats()
+                address_stats.add(rssi)
+                event = {"mac_address": mac, "device_name": "", "timestamp": timestamp, "rssi": rssi}
+                self.emit(DEVICE_SEEN, **event)
+                log_writer.add(event)
+
+                matched_devices = self.match_device(mac)
+                if matched_devices:
+                    # The match event reports the estimate including this advert
+                    update_estimates()
+                for device in matched_devices:
+                    self.emit_match(mac, device['device_name'], event["timestamp"])
+                    email_device_map[device['email']].append({
+                        "mac_address": mac,
+                        "device_name": device['device_name'],
+                        "timestamp": event["timestamp"]
+                    })
+
+                if len(stats) >= self.number_of_packets:
+                    self.emit(MESSAGE, message=f"Found {self.number_of_packets} devices, stopping scan.")
+                    break
+            else:
+                if self.stop_event.is_set():
+                    self.emit(MESSAGE, message="Scan stopped on request.")
+        finally:
+            # Ends a live capture that was stopped early
+            if hasattr(readings, "close"):
+                readings.close()
+
+        update_estimates()
+        log_writer.close()
+        self.store_estimates(stats)
+        self.notify_owners(email_device_map)
+        self.record_scan(started, queries_before, sum(address_stats.count for address_stats in stats.values()))
+        self.emit(SCAN_END, devices=len(stats), matches=sum(len(devices) for devices in email_device_map.values()))
+        return stats
+
+    def output_source_addresses(self, json_file_path: str, interface: str = NRF_INTERFACE):
+        if self.sniffer_mode in SESSION_MODES:
             output = self.run_bluetoothctl()
             #self.compare_bluetoothctl_output(output)
             return True
 
+        if self.sniffer_mode == "tshark":
+            if os.path.exists(json_file_path):
+                # Replays a capture exported from Wireshark earlier
+                self.run_tshark(readings=readings_from_json_export(json_file_path))
+            else:
+                self.run_tshark(interface=interface or NRF_INTERFACE)
+            return True
+
         print("Sniffer mode has not been recognised.")
 
         return None
@@ -261,53 +530,35 @@ class Sniffer():
             }
             formatted_devices_list.append(current_device)
         
-        from collections import defaultdict
-
         # Optionally check if this scanned device is in known devices
         email_device_map = defaultdict(list)
         for mac, name in scanned_devices.items():
-            for device in self.device_data:
-                if device['mac_address'].lower() == mac:
-                    email_device_map[device['email']].append({
-                        "mac_address": mac,
-                        "device_name": device['device_name'],
-                        "timestamp": time.time()
-                    })
+            for device in self.match_device(mac):
+                email_device_map[device['email']].append({
+                    "mac_address": mac,
+                    "device_name": device['device_name'],
+                    "timestamp": time.time()
+                })
 
         for email, devices in email_device_map.items():
-            message = "Matched Devices:\n"
-            for d in devices:
-                message += f"- {d['device_name']} ({d['mac_address']}) at {time.ctime(d['timestamp'])}\n"
-            
-            print(message)
-            send_email(text=message, email=email)
+            print(format_digest(devices))
+        self.notify_owners(email_device_map)
         
-        update_logs(device_list=formatted_devices_list)
+        update_logs(device_list=formatted_devices_list, output=lambda message: self.emit(LOGS_UPDATED, message=message))
 
         return matched_devices
 
     def calculate_distance(self, rssi, tx_power):
         """
             Calculate the distance between the beacon and peripheral using RSSI.
+            Single reading form of distance.rssi_to_distance, scans use self.estimator.
             
             :param rssi: The received signal strength indicator (in dBm).
             :param tx_power: The measured signal strength at 1 meter (in dBm).
             
             Returns: Estimated distance in meters.
         """
-        # # Example usage
-        # rssi_value = -65  # Example RSSI value in dBm
-        # tx_power_value = -59  # Example TX power in dBm (adjust as per your beacon specs)
-
-        # distance = calculate_distance(rssi_value, tx_power_value)
-        # print(f"Estimated distance: {distance:.2f} meters")
-
         if rssi == 0:
             return -1  # Cannot determine distance
 
-        # Path-loss model for distance calculation
-        ratio = rssi / tx_power
-        if ratio < 1.0:
-            return math.pow(10, ratio)
-        else:
-            return math.pow(10, (tx_power - rssi) / (10 * 2))
\ No newline at end of file
+        return float(rssi_to_distance(rssi, tx_power))
\ No newline at end of file
@@ -0,0 +1,52 @@
+from db import consume_notification_tokens
+from settings import load_config
+
+# One email per owner and device every three minutes by default
+DEFAULT_COOLDOWN = 3 * 60
+DEFAULT_BURST = 1
+
+
+class NotificationThrottle():
+    """
+        Limits match notifications per (owner email, device), however often scans run.
+        The token buckets live in SQLite, so the limit also holds for scans that each run
+        in a new sniffer/main.py process.
+
+        :param cooldown: seconds until a device may notify its owner again.
+        :param burst: notifications a device may send back to back before the cooldown applies.
+    """
+    def __init__(self, cooldown: float = DEFAULT_COOLDOWN, burst: int = DEFAULT_BURST):
+        self.cooldown: float = cooldown
+        self.burst: int = burst
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+            Reads notification_cooldown and notification_burst from config.json settings.
+        """
+        return cls(cooldown=float(config.get("notification_cooldown", DEFAULT_COOLDOWN)),
+                   burst=int(config.get("notification_burst", DEFAULT_BURST)))
+
+    def filter(self, email_device_map: dict, now: float = None) -> dict:
+        """
+            Drops the matches whose (owner, device) bucket is empty and spends a token for the rest.
+
+            :param email_device_map: owner email -> matched devices, dicts with mac_address.
+            :return allowed: the same mapping with only the matches that may be sent.
+        """
+        pairs = [(email, device["mac_address"]) for email, devices in email_device_map.items() for device in devices]
+        allowed_pairs = consume_notification_tokens(pairs, burst=self.burst, cooldown=self.cooldown, now=now)
+
+        allowed = {}
+        for email, devices in email_device_map.items():
+            devices = [device for device in devices if (email, device["mac_address"]) in allowed_pairs]
+            if devices:
+                allowed[email] = devices
+        return allowed
+
+
+def load_throttle() -> NotificationThrottle:
+    """
+        Throttle with the policy from config.json, the defaults when there is no config.
+    """
+    return NotificationThrottle.from_config(load_config())
@@ -0,0 +1,68 @@
+"""
+    Hand over of device updates from reader threads to a scan loop.
+
+    Sessions whose updates arrive on another thread (BlueZ signals, broker subscriptions,
+    adapter readers) queue them here, and read_updates is a read of this queue with the
+    semantics Sniffer.scan_events expects from every session.
+"""
+
+import queue
+
+# Queued by wake(), ends a waiting read
+_WAKE = object()
+# Queued when the producer is gone, reads return None from then on
+_END = object()
+
+
+class UpdateQueue():
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.ended: bool = False
+
+    def put(self, updates: list):
+        self.queue.put(updates)
+
+    def end(self):
+        self.queue.put(_END)
+
+    def wake(self):
+        """
+            Ends a read that is waiting, from any thread.
+        """
+        self.queue.put(_WAKE)
+
+    def clear(self):
+        """
+            Drops whatever was queued, also an end, so the queue can be used again.
+        """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.ended = False
+
+    def read(self, timeout: float = None):
+        """
+            Returns every update queued so far, waiting up to timeout for the first batch.
+
+            :param timeout: seconds to wait, None waits forever.
+            :return updates: list of updates, empty on timeout or after wake(), None once ended.
+        """
+        if self.ended:
+            return None
+        try:
+            items = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        updates = [update for item in items if isinstance(item, list) for update in item]
+        if _END in items:
+            self.ended = True
+            return updates or None
+        return updates
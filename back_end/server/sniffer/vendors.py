@@ -0,0 +1,163 @@
+"""
+    Shared MAC Address vendor resolver.
+
+    Loads mac_vendor_list.txt once into dicts keyed by the integer value of the prefix.
+    24 bit OUIs (MA-L) are the common case and cost a single dict lookup, the longer
+    MA-M (28 bit) and MA-S (36 bit) assignments are only checked for OUIs that have them.
+    Used by the sniffer when writing logs and by the Flask app when adding devices.
+    normalize_mac is the one MAC Address form both sides key devices by.
+"""
+
+import os
+import hashlib
+import threading
+
+VENDOR_LIST_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mac_vendor_list.txt")
+HEX_DIGITS = set("0123456789abcdefABCDEF")
+
+
+def normalize_mac(mac_address: str) -> str:
+    """
+        Brings a MAC Address into the form bluetoothctl scans are keyed by, aa:bb:cc:dd:ee:ff.
+    """
+    return mac_address.strip().lower().replace("-", ":")
+
+
+def parse_prefix(prefix: str):
+    """
+        Turns a vendor list prefix such as 00:00:0a, 70:B3:D5:2 or 70-B3-D5-2A-0/36 into
+        its integer value and length in bits.
+
+        :return (value, bits): or None when the prefix is not valid.
+    """
+    prefix, _, mask = prefix.strip().partition("/")
+    digits = "".join(char for char in prefix if char not in ":-.")
+    if not digits or any(char not in HEX_DIGITS for char in digits):
+        return None
+
+    bits = len(digits) * 4
+    value = int(digits, 16)
+    if mask:
+        # An explicit mask wins over the number of digits written out, e.g. 70:B3:D5:20:00:00/28
+        mask_bits = int(mask)
+        value >>= bits - mask_bits
+        bits = mask_bits
+    return value, bits
+
+
+def parse_vendor_file(path: str = VENDOR_LIST_PATH):
+    """
+        Reads mac_vendor_list.txt in one pass.
+        Lines look like "0010 - 00:00:0a - OMRON TATEISI ELECTRONICS CO.", headers are skipped.
+
+        :return rows: list of (mac_prefix, vendor_name) tuples in file order.
+    """
+    rows = []
+    with open(path, "r") as file:
+        for line in file:
+            parts = line.strip().split(" - ")
+            if len(parts) == 3:
+                _, mac_prefix, vendor = parts
+                rows.append((mac_prefix, vendor))
+    return rows
+
+
+def vendor_file_hash(path: str = VENDOR_LIST_PATH) -> str:
+    """
+        SHA-256 of the vendor list, used to tell whether the device_vendor table is up to date.
+    """
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class VendorResolver():
+    def __init__(self, rows: list):
+        """
+            :param rows: (mac_prefix, vendor_name) pairs, the first entry for a prefix wins.
+        """
+        self.ouis: dict = {}
+        # bits -> {prefix value: vendor} for assignments longer than 24 bits, longest first
+        self.longer_prefixes: dict = {}
+        self.ouis_with_longer_prefixes: set = set()
+
+        for mac_prefix, vendor in rows:
+            parsed = parse_prefix(mac_prefix)
+            if parsed is None:
+                continue
+            value, bits = parsed
+            if bits == 24:
+                self.ouis.setdefault(value, vendor)
+            elif 24 < bits <= 48:
+                self.longer_prefixes.setdefault(bits, {}).setdefault(value, vendor)
+                self.ouis_with_longer_prefixes.add(value >> (bits - 24))
+
+        self.longer_prefixes = dict(sorted(self.longer_prefixes.items(), reverse=True))
+
+    @classmethod
+    def from_file(cls, path: str = VENDOR_LIST_PATH):
+        return cls(parse_vendor_file(path))
+
+    def __len__(self) -> int:
+        return len(self.ouis) + sum(len(prefixes) for prefixes in self.longer_prefixes.values())
+
+    def lookup(self, mac_address: str, default="Unknown"):
+        """
+            Returns the vendor of a MAC Address in any of the usual notations.
+
+            :param mac_address: e.g. aa:bb:cc:dd:ee:ff, AA-BB-CC-DD-EE-FF or aabbccddeeff.
+            :param default: returned when the vendor is not known or the MAC is malformed.
+        """
+        if mac_address[2:3] == ":":
+            # Fast path for the aa:bb:cc:dd:ee:ff form every scan produces
+            digits = mac_address[:8].replace(":", "")
+        else:
+            digits = mac_address.replace("-", "").replace(".", "")[0:6]
+
+        try:
+            oui = int(digits, 16)
+        except ValueError:
+            return default
+
+        if oui in self.ouis_with_longer_prefixes:
+            all_digits = mac_address.replace(":", "").replace("-", "").replace(".", "")
+            if len(all_digits) != 12:
+                return self.ouis.get(oui, default)
+            full = int(all_digits, 16)
+            for bits, prefixes in self.longer_prefixes.items():
+                vendor = prefixes.get(full >> (48 - bits))
+                if vendor is not None:
+                    return vendor
+
+        return self.ouis.get(oui, default)
+
+    def lookup_many(self, mac_addresses, default="Unknown") -> list:
+        """
+            Resolves a batch of MAC Addresses, returns the vendors in the same order.
+        """
+        lookup = self.lookup
+        if self.ouis_with_longer_prefixes:
+            return [lookup(mac, default) for mac in mac_addresses]
+
+        # Only 24 bit prefixes are loaded, so the OUI dict can be used inline
+        get = self.ouis.get
+        try:
+            return [get(int(mac[:8].replace(":", ""), 16), default) if mac[2:3] == ":" else lookup(mac, default)
+                    for mac in mac_addresses]
+        except ValueError:
+            return [lookup(mac, default) for mac in mac_addresses]
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver() -> VendorResolver:
+    """
+        Returns the process wide resolver, loading the vendor list on first use.
+    """
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = VendorResolver.from_file()
+    return _resolver
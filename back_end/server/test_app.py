@@ -1,6 +1,20 @@
+import os
+import sys
+import gzip
+import json
+import time
+import threading
+import subprocess
 import pytest
-from app import create_app
-from app.models import db, User
+from app import create_app, populate_device_vendors, VENDOR_LIST_HASH_KEY
+from app.models import db, User, Device, DeviceVendor, AppMetadata, SightingRollup, Logs, Sighting, IngestBatch
+from config import Config
+from app.relay import OutputRelay
+import app.relay as relay_module
+import app.routes as routes_module
+from app.scan_registry import find_remote_scan, process_start_time
+from app.message_queue import UnixSocketManager, MessageBroker
+from db import register_scan_session, fetch_scan_session, delete_scan_session
 
 # Fixture to create a test client and initialize an in-memory database
 @pytest.fixture
@@ -86,6 +100,47 @@ def test_add_device(client):
     except AssertionError:
         raise
 
+# Test that a vendor missing from the vendor list is looked up after add_device answered, and a miss is remembered
+def test_add_device_resolves_vendor_later(client, monkeypatch):
+    login_res = login_user(client)
+    token = login_res.json["access_token"]
+    lookups = []
+
+    def query_mac_vendors_api(prefix):
+        lookups.append(prefix)
+        return "Acme" if prefix == "02:00:5e" else "Unknown"
+
+    def wait_for(condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def vendor_of(mac_address):
+        with client.application.app_context():
+            return db.session.get(Device, mac_address).device_vendor
+
+    def add_device(mac_address):
+        return client.post("/add_device", headers={"Authorization": f"Bearer {token}"},
+                           json={"mac_address": mac_address, "device_name": "Unlisted", "date_added": "2025-04-01", "email": "test@example.com"})
+
+    monkeypatch.setattr(routes_module, "query_mac_vendors_api", query_mac_vendors_api)
+    monkeypatch.setattr(routes_module, "vendor_api_misses", {})
+    try:
+        assert add_device("02:00:5e:00:00:01").status_code == 201
+        assert wait_for(lambda: vendor_of("02:00:5e:00:00:01") == "Acme")
+
+        assert add_device("02:00:5f:00:00:01").status_code == 201
+        assert wait_for(lambda: "02:00:5f" in routes_module.vendor_api_misses)
+        assert add_device("02:00:5f:00:00:02").status_code == 201
+        time.sleep(0.2)
+        assert lookups == ["02:00:5e", "02:00:5f"]
+        assert vendor_of("02:00:5f:00:00:02") == "Unknown"
+    finally:
+        with client.application.app_context():
+            Device.query.filter(Device.mac_address.like("02:00:5%")).delete(synchronize_session=False)
+            db.session.commit()
+
 # Test getting list of devices
 def test_get_devices(client):
     login_res = login_user(client)
@@ -128,6 +183,293 @@ def test_delete_device(client):
     except AssertionError:
         raise
 
+# Test reading presence history from the sighting rollups
+def test_logs_history(client):
+    login_res = login_user(client)
+    token = login_res.json["access_token"]
+    with client.application.app_context():
+        for mac in ("aa:00:00:00:00:01", "aa:00:00:00:00:02"):
+            db.session.add(SightingRollup(bucket="hour", bucket_start=3600, mac_address=mac, sightings=2,
+                                          rssi_count=2, rssi_sum=-120, rssi_min=-70, rssi_max=-50,
+                                          first_seen=3600, last_seen=3700))
+        db.session.commit()
+
+    try:
+        res = client.get("/logs/history?bucket=hour&start=0&end=7200", headers={"Authorization": f"Bearer {token}"})
+        device_res = client.get("/logs/history/AA:00:00:00:00:01?start=0&end=7200", headers={"Authorization": f"Bearer {token}"})
+        bad_res = client.get("/logs/history?bucket=week", headers={"Authorization": f"Bearer {token}"})
+        assert res.status_code == 200
+        assert res.json["points"] == [{"bucket_start": 3600, "devices": 2, "sightings": 4}]
+        assert device_res.json["points"][0]["rssi_avg"] == -60
+        assert bad_res.status_code == 400
+    finally:
+        with client.application.app_context():
+            SightingRollup.query.filter(SightingRollup.bucket_start == 3600).delete()
+            db.session.commit()
+
+# Test walking the logs with keyset pagination and server side filters
+def test_get_logs_paginated(client):
+    login_res = login_user(client)
+    token = login_res.json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    with client.application.app_context():
+        for i in range(5):
+            db.session.add(Logs(mac_address=f"bb:00:00:00:00:0{i}", device_vendor="Paging Vendor", target_device=i == 0,
+                                first_seen=100, last_seen=100 + i // 2, count=1, scan_number=1))
+        db.session.commit()
+
+    try:
+        macs = []
+        cursor = None
+        while True:
+            url = "/logs?vendor=Paging%20Vendor&limit=2" + (f"&cursor={cursor}" if cursor else "")
+            res = client.get(url, headers=headers)
+            assert res.status_code == 200
+            assert len(res.json["items"]) <= 2
+            macs += [log["mac_address"] for log in res.json["items"]]
+            cursor = res.json["next_cursor"]
+            if not cursor:
+                break
+
+        assert macs == ["bb:00:00:00:00:04", "bb:00:00:00:00:03", "bb:00:00:00:00:02", "bb:00:00:00:00:01", "bb:00:00:00:00:00"]
+        target_res = client.get("/logs?vendor=Paging%20Vendor&target=true", headers=headers)
+        assert [log["mac_address"] for log in target_res.json["items"]] == ["bb:00:00:00:00:00"]
+        range_res = client.get("/logs?vendor=Paging%20Vendor&since=101&until=101", headers=headers)
+        assert len(range_res.json["items"]) == 2
+        search_res = client.get("/logs?search=BB:00:00:00:00:03", headers=headers)
+        assert [log["mac_address"] for log in search_res.json["items"]] == ["bb:00:00:00:00:03"]
+        assert len(client.get("/logs?search=paging%20vend", headers=headers).json["items"]) == 5
+        assert client.get("/logs?search=100%25", headers=headers).json["items"] == []
+        # Search matches the start of the MAC Address or vendor only
+        assert client.get("/logs?search=00:00:03", headers=headers).json["items"] == []
+        assert client.get("/logs?search=vendor", headers=headers).json["items"] == []
+        assert client.get("/logs?cursor=not-a-cursor", headers=headers).status_code == 400
+        for bad_cursor in (["100", "bb:00:00:00:00:03"], [100], [100, None], [True, "bb:00:00:00:00:03"], [{"x": 1}, "bb"]):
+            res = client.get(f"/logs?cursor={routes_module.encode_cursor(bad_cursor)}", headers=headers)
+            assert res.status_code == 400 and res.json["message"] == "Invalid cursor"
+        assert client.get(f"/devices?cursor={routes_module.encode_cursor([1])}", headers=headers).status_code == 400
+        for bad_arg in ("since=abc", "until=1.5", "limit=ten", "since_change=x"):
+            res = client.get(f"/logs?{bad_arg}", headers=headers)
+            assert res.status_code == 400 and res.json["message"].endswith("must be an integer")
+        assert client.get("/logs/history?start=yesterday", headers=headers).status_code == 400
+    finally:
+        with client.application.app_context():
+            Logs.query.filter(Logs.device_vendor == "Paging Vendor").delete()
+            db.session.commit()
+
+# Test that since_change only returns rows changed after it and every page carries the high water mark
+def test_get_logs_delta(client):
+    login_res = login_user(client)
+    token = login_res.json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    with client.application.app_context():
+        for i in range(3):
+            db.session.add(Logs(mac_address=f"cc:00:00:00:00:0{i}", device_vendor="Delta Vendor", target_device=False,
+                                first_seen=100, last_seen=100, count=1, scan_number=9000 - i, change_seq=9000 + i))
+        db.session.commit()
+
+    try:
+        res = client.get("/logs?vendor=Delta%20Vendor", headers=headers)
+        assert "change_seq" in res.json["high_water_mark"]
+        assert len(res.json["items"]) == 3
+        delta_res = client.get("/logs?vendor=Delta%20Vendor&since_change=9000", headers=headers)
+        assert sorted(log["mac_address"] for log in delta_res.json["items"]) == ["cc:00:00:00:00:01", "cc:00:00:00:00:02"]
+    finally:
+        with client.application.app_context():
+            Logs.query.filter(Logs.device_vendor == "Delta Vendor").delete()
+            db.session.commit()
+
+# Test that logs deltas only reach WebSocket clients that signed in with a valid token
+def test_logs_delta_requires_token(client, monkeypatch):
+    token = login_user(client).json["access_token"]
+    app = client.application
+    with app.app_context():
+        db.session.add(Logs(mac_address="cc:00:00:00:01:00", device_vendor="Room Vendor", target_device=False,
+                            first_seen=100, last_seen=100, count=1, scan_number=9100, change_seq=9100))
+        db.session.commit()
+    monkeypatch.setitem(routes_module.logs_delta_state, "change_seq", 9099)
+
+    anonymous = routes_module.socketio.test_client(app)
+    forged = routes_module.socketio.test_client(app, query_string="token=not-a-jwt")
+    dashboard = routes_module.socketio.test_client(app, query_string=f"token={token}")
+    try:
+        # The anonymous client stays connected without ever presenting a token
+        for socket_client in (forged, dashboard):
+            socket_client.emit("websocket_handle_connect")
+        with app.app_context():
+            routes_module.broadcast_logs_delta()
+
+        assert [event["name"] for event in anonymous.get_received()] == []
+        assert not forged.is_connected()
+        deltas = [event for event in dashboard.get_received() if event["name"] == "logs_delta"]
+        assert len(deltas) == 1
+        assert "cc:00:00:00:01:00" in [row["mac_address"] for row in deltas[0]["args"][0]["items"]]
+    finally:
+        for socket_client in (anonymous, dashboard):
+            socket_client.disconnect()
+        with app.app_context():
+            Logs.query.filter(Logs.device_vendor == "Room Vendor").delete()
+            db.session.commit()
+
+# Test that the output relay batches lines, keeps partial lines until they end and splits overlong ones
+def test_output_relay_batches_lines(monkeypatch):
+    monkeypatch.setattr(relay_module, "MAX_LINE_BYTES", 16)
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"one\ntwo\nthr")
+    os.write(write_fd, b"ee\n\n" + b"x" * 26 + b"\nlast")
+    os.close(write_fd)
+
+    batches = []
+    with os.fdopen(read_fd, "rb") as stream:
+        assert OutputRelay(stream, batches.append, max_batch_lines=2).run() is True
+
+    lines = [line for batch in batches for line in batch]
+    assert all(len(batch) <= 2 for batch in batches)
+    assert lines[:3] == ["one", "two", "three"]
+    assert [len(line) for line in lines[3:5]] == [16, 10]
+    assert lines[-1] == "last"
+
+# Test that /metrics serves the sniffer measurements from scan output and keeps them off the scanner page
+def test_metrics_endpoint(client, monkeypatch):
+    frames = []
+    class RecordingSocketIO():
+        def emit(self, name, data, room=None):
+            frames.append((name, data))
+    monkeypatch.setattr(routes_module, "socketio", RecordingSocketIO())
+
+    snapshot = {"sniffer_adverts_parsed_total": {"type": "counter", "value": 42},
+                "sniffer_update_logs_seconds": {"type": "histogram", "buckets": [0.01, 0.1], "counts": [1, 1, 0], "sum": 0.06, "count": 2}}
+    lines = [json.dumps({"event": "metrics", "metrics": snapshot}), json.dumps({"event": "scan_end", "devices": 0, "matches": 0})]
+    process = subprocess.Popen([sys.executable, "-c", f"print({chr(10).join(lines)!r})"], stdout=subprocess.PIPE)
+    before = routes_module.REGISTRY.snapshot()["sniffer_adverts_parsed_total"]["value"]
+    routes_module.process_monitor("test@example.com", process, threading.Event(), sid=None)
+
+    events = [event for name, data in frames if name == "scan_update" for event in data.get("events", [])]
+    assert [event["event"] for event in events] == ["scan_end"]
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.content_type.startswith("text/plain")
+    body = res.get_data(as_text=True)
+    assert f"sniffer_adverts_parsed_total {before + 42}" in body
+    assert 'sniffer_update_logs_seconds_bucket{le="+Inf"}' in body
+    assert "# TYPE dashboard_active_scans gauge" in body
+
+# Test that agents post gzip batches with their own token and a resent batch is not written twice
+def test_ingest(client, monkeypatch):
+    monkeypatch.setattr(Config, "INGEST_TOKENS", {"node-1": "secret-1", "node-2": "secret-2"})
+    macs = ["dd:00:00:00:00:01", "dd:00:00:00:00:02"]
+    now = int(time.time())
+    batch = {"agent_id": "node-1", "sequence": 7, "sightings": [{"mac_address": "DD:00:00:00:00:01", "timestamp": now, "rssi": -60},
+                                                                {"mac_address": macs[1], "timestamp": now, "rssi": None}]}
+    body = gzip.compress(json.dumps(batch).encode("utf-8"))
+    headers = {"Authorization": "Bearer secret-1", "Content-Encoding": "gzip", "Content-Type": "application/json"}
+
+    try:
+        first = client.post("/ingest", data=body, headers=headers)
+        again = client.post("/ingest", data=body, headers=headers)
+        assert first.status_code == 200
+        assert first.json["duplicate"] is False and first.json["sightings"] == 2
+        assert again.status_code == 200 and again.json["duplicate"] is True
+        with client.application.app_context():
+            log = db.session.get(Logs, macs[0])
+            assert log.count == 1 and log.last_seen == now
+            # Agent sightings are rolled up right away, like the ingest service does it
+            assert Sighting.query.filter(Sighting.mac_address.in_(macs)).count() == 0
+            assert SightingRollup.query.filter(SightingRollup.mac_address.in_(macs), SightingRollup.bucket == "minute").count() == 2
+
+        future = {"agent_id": "node-1", "sequence": 8, "sightings": [{"mac_address": macs[0], "timestamp": now + 86400, "rssi": -60}]}
+        assert client.post("/ingest", json=future, headers={"Authorization": "Bearer secret-1"}).status_code == 200
+        with client.application.app_context():
+            # An agent clock running a day ahead cannot pin last_seen in the future
+            assert db.session.get(Logs, macs[0]).last_seen <= time.time() + Config.INGEST_MAX_CLOCK_SKEW
+
+        # A batch an agent held back while offline arrives late and moves first_seen back
+        older = {"agent_id": "node-1", "sequence": 6, "sightings": [{"mac_address": macs[0], "timestamp": now - 3600, "rssi": -70}]}
+        assert client.post("/ingest", json=older, headers={"Authorization": "Bearer secret-1"}).status_code == 200
+        with client.application.app_context():
+            log = db.session.get(Logs, macs[0])
+            assert log.first_seen == now - 3600 and log.count == 3
+
+        assert client.post("/ingest", data=body, headers=dict(headers, Authorization="Bearer wrong")).status_code == 401
+        assert client.post("/ingest", data=body, headers=dict(headers, Authorization="Bearer secret-2")).status_code == 403
+        assert client.post("/ingest", data=b"not gzip", headers=headers).status_code == 400
+        assert client.post("/ingest", json={"sequence": -1, "sightings": []}, headers={"Authorization": "Bearer secret-1"}).status_code == 400
+        assert "dashboard_ingest_duplicates_total" in client.get("/metrics").get_data(as_text=True)
+    finally:
+        with client.application.app_context():
+            Logs.query.filter(Logs.mac_address.in_(macs)).delete()
+            SightingRollup.query.filter(SightingRollup.mac_address.in_(macs)).delete()
+            IngestBatch.query.filter(IngestBatch.agent_id == "node-1").delete()
+            db.session.commit()
+
+# Test that a scan another worker relays is found, stopped and seen ending, entries of dead workers are dropped
+# and pids that went to other processes are never signalled
+def test_remote_scan():
+    worker = subprocess.Popen(["sleep", "30"])
+    scan = subprocess.Popen(["sleep", "30"])
+    started = {"worker_start_time": process_start_time(worker.pid), "pid_start_time": process_start_time(scan.pid)}
+    try:
+        assert find_remote_scan("remote@example.com") is None
+
+        register_scan_session("remote@example.com", "scan-1", os.getpid(), pid=scan.pid)
+        assert find_remote_scan("remote@example.com") is None  # relayed by this worker
+
+        # A row that recorded other processes under these pids, e.g. left behind before a reboot
+        register_scan_session("remote@example.com", "scan-0", worker.pid, pid=scan.pid,
+                              worker_start_time=started["worker_start_time"], pid_start_time=started["pid_start_time"] - 1)
+        find_remote_scan("remote@example.com").kill()
+        assert scan.poll() is None
+        register_scan_session("remote@example.com", "scan-0", worker.pid, pid=scan.pid,
+                              worker_start_time=started["worker_start_time"] - 1, pid_start_time=started["pid_start_time"])
+        assert find_remote_scan("remote@example.com") is None
+        assert fetch_scan_session("remote@example.com") is None
+
+        register_scan_session("remote@example.com", "scan-1", worker.pid, pid=scan.pid, **started)
+        remote = find_remote_scan("remote@example.com")
+        assert remote.pid == scan.pid and remote.poll() is None
+        remote.terminate()
+        assert scan.wait(timeout=5) != 0
+        with pytest.raises(subprocess.TimeoutExpired):
+            remote.wait(timeout=0.2)
+        # The relaying worker drops the entry once it saw the scan end
+        delete_scan_session("remote@example.com", "scan-1")
+        assert remote.wait(timeout=1) == 0
+
+        register_scan_session("remote@example.com", "scan-2", worker.pid, pid=scan.pid, **started)
+        worker.kill()
+        worker.wait()
+        assert find_remote_scan("remote@example.com") is None
+        assert fetch_scan_session("remote@example.com") is None
+    finally:
+        worker.kill()
+        scan.kill()
+        for scan_key in ("scan-0", "scan-1", "scan-2"):
+            delete_scan_session("remote@example.com", scan_key)
+
+# Test that messages published through the local broker reach a subscribed worker
+def test_message_broker(tmp_path):
+    socket_path = str(tmp_path / "socketio.sock")
+    broker = MessageBroker(socket_path)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+
+    subscriber = UnixSocketManager(f"unix://{socket_path}")
+    publisher = UnixSocketManager(f"unix://{socket_path}")
+    other_channel = UnixSocketManager(f"unix://{socket_path}", channel="other")
+    received = []
+    threading.Thread(target=lambda: received.extend(subscriber._listen()), daemon=True).start()
+
+    # The subscriber may still be connecting, publish until it got a message
+    deadline = time.time() + 10
+    while not received and time.time() < deadline:
+        other_channel._publish({"method": "emit", "event": "elsewhere"})
+        publisher._publish({"method": "emit", "event": "scan_update"})
+        time.sleep(0.1)
+    assert received and all(message["event"] == "scan_update" for message in received)
+    with pytest.raises(RuntimeError):
+        MessageBroker(socket_path).serve_forever()
+    broker.server.close()
+
 # Test deleting a user
 def test_delete_user(client):
     login_res = login_user(client)
@@ -150,3 +492,32 @@ def test_delete_user(client):
         assert res.json["message"] == "User deleted successfully"
     except AssertionError:
         raise
+
+
+# Test that the vendor loader is idempotent and records the vendor list hash
+def test_populate_device_vendors_idempotent(client):
+    with client.application.app_context():
+        vendor_count = DeviceVendor.query.count()
+        db.session.delete(db.session.get(AppMetadata, VENDOR_LIST_HASH_KEY))
+        db.session.commit()
+
+        populate_device_vendors()
+        try:
+            assert DeviceVendor.query.count() == vendor_count
+            assert db.session.get(AppMetadata, VENDOR_LIST_HASH_KEY) is not None
+        except AssertionError:
+            raise
+
+# Test that a changed vendor list replaces renamed and dropped vendors
+def test_populate_device_vendors_reloads_changed_list(client, tmp_path):
+    vendor_list = tmp_path / "mac_vendor_list.txt"
+    vendor_list.write_text("0010 - 00:00:0a - Renamed Vendor\n0020 - 00:00:0b - Other Vendor\n0030 - 00:00:0b - Duplicate\n")
+    with client.application.app_context():
+        try:
+            populate_device_vendors(str(vendor_list))
+            assert DeviceVendor.query.count() == 2
+            assert db.session.get(DeviceVendor, "00:00:0a").vendor_name == "Renamed Vendor"
+            assert db.session.get(DeviceVendor, "00:00:0b").vendor_name == "Other Vendor"
+        finally:
+            populate_device_vendors()
+        assert DeviceVendor.query.count() > 2
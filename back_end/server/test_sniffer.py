@@ -0,0 +1,808 @@
+import os
+import sys
+import gzip
+import json
+import time
+import signal
+import shutil
+import socket
+import sqlite3
+import subprocess
+import threading
+import socketserver
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sniffer"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+from db import create_tables, update_logs, rollup_sightings, prune_sightings, fetch_logs_changed_since, ScanLogWriter, \
+    ingest_batch, ingest_aggregates
+from daemon import ScannerDaemon
+from vendors import VendorResolver
+from events import decode_event, DEVICE_SEEN, MATCH, SCAN_END, METRICS
+from email_sender import NotificationDispatcher
+from throttle import NotificationThrottle
+from capture import iter_json_array, readings_from_json_export, readings_from_fields, live_readings
+from interfaces import find_nrf_interface, check_for_nrf_sniffer
+from distance import PresenceEstimator, rssi_to_distance, calibrate_tx_power
+from dbpool import get_pool
+from sniffer import Sniffer
+from bluetoothctl import BluetoothctlSession, BluetoothctlParser
+from bluez import BluezSession
+from adapters import MultiAdapterSession, CaptureSession
+from agent import SightingSpool
+from ingest import send_ingest_command, shard_of
+import sniffer as sniffer_module
+from feeds import fake_bluetoothctl_command, bench_mac
+from suite import compare
+
+# Fixture to run the sniffer database helpers against a fresh outputs/devices.db
+@pytest.fixture
+def sniffer_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    create_tables()
+    conn = sqlite3.connect("outputs/devices.db")
+    conn.execute("INSERT INTO user (username, password, email) VALUES ('tester', 'pw', 'test@example.com')")
+    conn.execute("INSERT INTO device (mac_address, device_vendor, device_name, date_added, email) "
+                 "VALUES ('11:22:33:44:55:66', 'Registered Vendor', 'Tag', 0, 'test@example.com')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+# Test that update_logs inserts new rows and upserts repeated ones
+def test_update_logs_upsert(sniffer_db):
+    scan = [{"mac_address": "00:00:0a:00:00:01"}, {"mac_address": "11:22:33:44:55:66"}]
+    first_scan = update_logs(device_list=scan)
+    second_scan = update_logs(device_list=scan[:1])
+
+    rows = {row[0]: row[1:] for row in sniffer_db.execute(
+        "SELECT mac_address, device_vendor, target_device, count, scan_number FROM logs")}
+    assert second_scan == first_scan + 1
+    assert rows["00:00:0a:00:00:01"] == ("OMRON TATEISI ELECTRONICS CO.", 0, 2, second_scan)
+    assert rows["11:22:33:44:55:66"] == ("Registered Vendor", 1, 1, first_scan)
+
+# Test that the scan counter continues from logs written before it existed
+def test_scan_counter_seeds_from_logs(sniffer_db):
+    sniffer_db.execute("INSERT INTO logs (mac_address, device_vendor, target_device, first_seen, last_seen, count, scan_number) "
+                       "VALUES ('aa:aa:aa:aa:aa:aa', 'Unknown', 0, 0, 0, 1, 41)")
+    sniffer_db.commit()
+    assert update_logs(device_list=[{"mac_address": "aa:aa:aa:aa:aa:aa"}]) == 42
+
+FAKE_BLUETOOTHCTL = """import sys
+for line in sys.stdin:
+    if line.strip() == "scan on":
+        for i in range(3):
+            print(f"[NEW] Device AA:BB:CC:00:00:0{i} Tag{i}", flush=True)
+    elif line.strip() == "exit":
+        break
+"""
+
+# Test that delta reads return only rows changed after the given change sequence, whichever scan wrote them
+def test_fetch_logs_changed_since(sniffer_db):
+    update_logs(device_list=[{"mac_address": "00:00:0a:00:00:01"}, {"mac_address": "00:00:0a:00:00:02"}])
+    first_mark, rows = fetch_logs_changed_since(0)
+    assert len(rows) == 2
+    second_scan = update_logs(device_list=[{"mac_address": "00:00:0a:00:00:02"}])
+
+    high_water_mark, rows = fetch_logs_changed_since(first_mark["change_seq"])
+    assert high_water_mark["scan_number"] == second_scan
+    assert high_water_mark["change_seq"] == first_mark["change_seq"] + 1
+    assert [row["mac_address"] for row in rows] == ["00:00:0a:00:00:02"]
+    assert fetch_logs_changed_since(None)[1] == rows
+    assert fetch_logs_changed_since(high_water_mark["change_seq"])[1] == []
+
+    # A scan that started before the latest one keeps writing under its older scan number
+    earlier_scan = ScanLogWriter(output=lambda line: None)
+    earlier_scan.add({"mac_address": "00:00:0a:00:00:03"})
+    earlier_scan.flush()
+    later_scan = update_logs(device_list=[{"mac_address": "00:00:0a:00:00:04"}])
+    assert earlier_scan.scan_number < later_scan
+    mark = fetch_logs_changed_since(0)[0]
+    earlier_scan.add({"mac_address": "00:00:0a:00:00:01"})
+    earlier_scan.close()
+    high_water_mark, rows = fetch_logs_changed_since(mark["change_seq"])
+    assert [(row["mac_address"], row["scan_number"]) for row in rows] == [("00:00:0a:00:00:01", earlier_scan.scan_number)]
+
+# Test that sightings are rolled up exactly once and only rolled up raw rows are pruned
+def test_sighting_rollups_and_retention(sniffer_db):
+    old = int(time.time()) - 10 * 86400
+    update_logs(device_list=[{"mac_address": "00:00:0a:00:00:01", "timestamp": old, "rssi": -70}])
+    update_logs(device_list=[{"mac_address": "00:00:0a:00:00:01", "timestamp": old + 1, "rssi": -50}])
+
+    assert rollup_sightings() == 2
+    assert rollup_sightings() == 0
+    row = sniffer_db.execute("SELECT sightings, rssi_count, rssi_sum, rssi_min, rssi_max FROM sighting_rollup "
+                             "WHERE bucket = 'hour' AND mac_address = '00:00:0a:00:00:01'").fetchone()
+    assert row == (2, 2, -120, -70, -50)
+
+    update_logs(device_list=[{"mac_address": "00:00:0a:00:00:02", "timestamp": old}])
+    sniffer_db.executemany("INSERT INTO ingest_batch (agent_id, sequence, scan_number, sightings, received_at) VALUES ('node', ?, 1, 1, ?)",
+                           [(1, old), (2, int(time.time()))])
+    sniffer_db.commit()
+    assert prune_sightings(raw_retention_days=1, batch_retention_days=7) == 2
+    assert sniffer_db.execute("SELECT COUNT(*) FROM sighting").fetchone()[0] == 1
+    assert sniffer_db.execute("SELECT sequence FROM ingest_batch").fetchall() == [(2,)]
+
+# Test that the resident daemon reuses one bluetoothctl session across scans
+def test_scanner_daemon_streams_scans(sniffer_db, tmp_path):
+    fake = tmp_path / "fake_bluetoothctl.py"
+    fake.write_text(FAKE_BLUETOOTHCTL)
+    socket_path = str(tmp_path / "scanner.sock")
+    daemon = ScannerDaemon(socket_path=socket_path, bluetoothctl_command=[sys.executable, "-u", str(fake)])
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+
+    def scan():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            connection.sendall((json.dumps({"command": "start", "packets": 3, "scan_time": 5}) + "\n").encode())
+            return [decode_event(line) for line in connection.makefile("r")]
+
+    first_events = scan()
+    process = daemon.session.process
+    second_events = scan()
+    daemon.shutdown()
+
+    assert [event["mac_address"] for event in first_events if event["event"] == DEVICE_SEEN] == \
+        ["aa:bb:cc:00:00:00", "aa:bb:cc:00:00:01", "aa:bb:cc:00:00:02"]
+    assert second_events[-1] == {"event": SCAN_END, "devices": 3, "matches": 0}
+    assert daemon.session.process is None and process.poll() is not None
+    assert sniffer_db.execute("SELECT count FROM logs WHERE mac_address = 'aa:bb:cc:00:00:01'").fetchone()[0] == 2
+
+# Test that concurrent scans share one discovery, each with its own limits, and stop independently
+def test_scanner_daemon_shares_discovery(sniffer_db, tmp_path):
+    socket_path = str(tmp_path / "scanner.sock")
+    daemon = ScannerDaemon(socket_path=socket_path, bluetoothctl_command=fake_bluetoothctl_command(str(tmp_path), devices=50, rate=200))
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+
+    def command(payload):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            connection.sendall((json.dumps(payload) + "\n").encode())
+            return [json.loads(line) for line in connection.makefile("r")]
+
+    results = {}
+    def scan(scan_id, packets, scan_time):
+        results[scan_id] = command({"command": "start", "scan": scan_id, "packets": packets, "scan_time": scan_time})
+
+    process = daemon.session.process
+    threads = [threading.Thread(target=scan, args=args) for args in (("small", 5, 10), ("large", 20, 10), ("long", 1000, 30))]
+    for thread in threads:
+        thread.start()
+    while len(daemon.scans) < 3:
+        time.sleep(0.01)
+    assert command({"command": "ping"})[0]["scans"] == 3
+
+    threads[0].join()
+    threads[1].join()
+    command({"command": "stop", "scan": "long"})
+    threads[2].join(timeout=5)
+    assert daemon.session.process is process
+    daemon.shutdown()
+
+    assert results["small"][-1]["devices"] == 5 and results["large"][-1]["devices"] == 20
+    assert results["long"][-1]["event"] == SCAN_END and results["long"][-1]["devices"] < 50
+    assert any(event.get("message") == "Scan stopped on request." for event in results["long"])
+    assert daemon.scans == {} and daemon.broker.subscribers == []
+
+# Test that concurrent scans on one discovery count every device once in the logs and sightings
+def test_scanner_daemon_logs_shared_discovery_once(sniffer_db, tmp_path):
+    socket_path = str(tmp_path / "scanner.sock")
+    daemon = ScannerDaemon(socket_path=socket_path, bluetoothctl_command=fake_bluetoothctl_command(str(tmp_path), devices=5, rate=10))
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+
+    results = {}
+    def scan(scan_id):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            connection.sendall((json.dumps({"command": "start", "scan": scan_id, "packets": 5, "scan_time": 10}) + "\n").encode())
+            results[scan_id] = [json.loads(line) for line in connection.makefile("r")]
+
+    threads = [threading.Thread(target=scan, args=(scan_id,)) for scan_id in ("first", "second")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=15)
+    daemon.shutdown()
+
+    for events in results.values():
+        assert events[-1]["devices"] == 5
+        assert any(event["event"] == "logs_updated" for event in events)
+    mac = bench_mac(0)
+    assert sniffer_db.execute("SELECT count FROM logs WHERE mac_address = ?", (mac,)).fetchone()[0] == 1
+    assert sniffer_db.execute("SELECT COUNT(*) FROM sighting WHERE mac_address = ?", (mac,)).fetchone()[0] == 1
+
+FAKE_SLOW_BLUETOOTHCTL = """import sys, time
+for line in sys.stdin:
+    if line.strip() == "scan on":
+        print("[NEW] Device AA:BB:CC:00:00:01 First", flush=True)
+        time.sleep(0.7)
+        print("[NEW] Device 11:22:33:44:55:66 Second", flush=True)
+    elif line.strip() == "exit":
+        break
+"""
+
+class RecordingNotifier():
+    def __init__(self):
+        self.notifications = []
+
+    def notify(self, devices, email=None):
+        self.notifications.append((email, devices))
+
+# Test that a streaming scan writes logs and matches targets while the scan is still running
+def test_streaming_scan_writes_during_scan(sniffer_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(sniffer_module, "LOG_FLUSH_INTERVAL", 0.1)
+    fake = tmp_path / "fake_bluetoothctl.py"
+    fake.write_text(FAKE_SLOW_BLUETOOTHCTL)
+
+    seen_mid_scan = []
+    matches = []
+    def output(event):
+        if event["event"] == DEVICE_SEEN and event["mac_address"] == "11:22:33:44:55:66":
+            seen_mid_scan.extend(row[0] for row in sniffer_db.execute("SELECT mac_address FROM logs"))
+        if event["event"] == MATCH:
+            matches.append(event["device_name"])
+
+    device_data = [{"mac_address": "11:22:33:44:55:66", "device_name": "Tag", "email": "test@example.com"}]
+    scanner = Sniffer(number_of_packets=2, scan_time=5, user_data=[], device_data=device_data, sniffer_mode="bluetoothctl",
+                      session=BluetoothctlSession(command=[sys.executable, "-u", str(fake)]), output=output,
+                      notifier=RecordingNotifier())
+    result = scanner.run_bluetoothctl()
+    scanner.session.close()
+
+    assert [d["mac_address"] for d in result] == ["aa:bb:cc:00:00:01", "11:22:33:44:55:66"]
+    assert seen_mid_scan == ["aa:bb:cc:00:00:01"]
+    assert matches == ["Tag"]
+    assert [email for email, _ in scanner.notifier.notifications] == ["test@example.com"]
+    assert sniffer_db.execute("SELECT COUNT(DISTINCT scan_number) FROM logs").fetchone()[0] == 1
+
+# Test that event lines round trip and anything else is read as a message event
+def test_decode_events():
+    assert decode_event('{"event":"match","mac_address":"aa:bb:cc:dd:ee:ff","device_name":"Tag"}\n')["event"] == MATCH
+    assert decode_event("Initialising Sniffer Object") == {"event": "message", "message": "Initialising Sniffer Object"}
+    assert decode_event('{"event": "unknown"}')["event"] == "message"
+    assert decode_event("{not json")["message"] == "{not json"
+
+class LocalSMTPHandler(socketserver.StreamRequestHandler):
+    """
+        Just enough SMTP for smtplib, stands in for the real mail server.
+        Refuses the first message when the server has fail_first set.
+    """
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost")
+        for raw in self.rfile:
+            command = raw.decode().strip().upper()
+            if command.startswith("EHLO") or command.startswith("HELO"):
+                self.reply("250 localhost")
+            elif command.startswith("MAIL"):
+                if self.server.fail_first:
+                    self.server.fail_first = False
+                    self.reply("451 Try again later")
+                else:
+                    self.reply("250 OK")
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for data in self.rfile:
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data.decode())
+                self.server.messages.append("".join(lines))
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+# Test that queued matches are merged into one digest per address and sent over one connection with retries
+def test_notification_dispatcher_batches_and_retries():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), LocalSMTPHandler)
+    server.daemon_threads = True
+    server.connections, server.messages, server.fail_first = 0, [], True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    config = {"username": "sniffer@example.com", "receiver": "owner@example.com",
+              "smtp_host": "127.0.0.1", "smtp_port": server.server_address[1], "use_tls": False}
+    dispatcher = NotificationDispatcher(config=config, batch_window=0.2, retry_backoff=0.01)
+    dispatcher.notify([{"device_name": "Tag", "mac_address": "aa:aa:aa:aa:aa:01", "timestamp": 0}], email="a@example.com")
+    dispatcher.notify([{"device_name": "Keys", "mac_address": "aa:aa:aa:aa:aa:02", "timestamp": 0}], email="a@example.com")
+    dispatcher.notify([{"device_name": "Bag", "mac_address": "aa:aa:aa:aa:aa:03", "timestamp": 0}])
+    dispatcher.close(timeout=5)
+    server.shutdown()
+    server.server_close()
+
+    assert len(server.messages) == 2
+    assert "Tag" in server.messages[0] and "Keys" in server.messages[0]
+    assert "To: owner@example.com" in server.messages[1]
+    assert server.connections == 1
+
+# Test that the throttle allows one notification per owner and device per cooldown, also across instances
+def test_notification_throttle(sniffer_db):
+    matches = {"a@example.com": [{"mac_address": "aa:aa:aa:aa:aa:01"}, {"mac_address": "aa:aa:aa:aa:aa:02"}]}
+    assert NotificationThrottle(cooldown=60).filter(matches, now=1000) == matches
+    assert NotificationThrottle(cooldown=60).filter(matches, now=1030) == {}
+
+    later = {"a@example.com": [{"mac_address": "aa:aa:aa:aa:aa:01"}], "b@example.com": [{"mac_address": "aa:aa:aa:aa:aa:01"}]}
+    assert NotificationThrottle(cooldown=60).filter(later, now=1060) == later
+    assert len(NotificationThrottle(cooldown=60, burst=2).filter(later, now=1061)) == 0
+
+# Test that JSON exports are read incrementally and RSSI statistics are kept per address
+def test_capture_streaming_ingest(sniffer_db, tmp_path):
+    packets = [{"_source": {"layers": {"btle": {"btle.advertising_address": "aa:bb:cc:00:00:01"},
+                                       "nordic_ble": {"nordic_ble.rssi": str(rssi)}}}} for rssi in (-60, -70, -80)]
+    packets[0]["_source"]["layers"]["frame"] = {"frame.time_epoch": "1700000000.250000000"}
+    packets.append({"_source": {"layers": {"btle": {}}}})
+    capture = tmp_path / "capture.json"
+    capture.write_text(json.dumps(packets, indent=2))
+
+    with open(capture) as file:
+        assert len(list(iter_json_array(file, read_size=7))) == 4
+    assert list(readings_from_json_export(str(capture))) == \
+        [("aa:bb:cc:00:00:01", -60, 1700000000.25), ("aa:bb:cc:00:00:01", -70, None), ("aa:bb:cc:00:00:01", -80, None)]
+    assert list(readings_from_fields(["11:22:33:44:55:66\t-50\t1700000000.5\n", "\t-40\n", "11:22:33:44:55:66\t-45,-46\n"])) == \
+        [("11:22:33:44:55:66", -50, 1700000000.5), ("11:22:33:44:55:66", -45, None)]
+
+    events = []
+    scanner = Sniffer(number_of_packets=10, scan_time=5, user_data=[], device_data=[], output=events.append,
+                      notifier=RecordingNotifier())
+    assert scanner.extract_addresses_and_rssi(str(capture)) == [("aa:bb:cc:00:00:01", 3, -70.0)]
+    stats = scanner.run_tshark(readings=readings_from_json_export(str(capture)))
+    address_stats = stats["aa:bb:cc:00:00:01"]
+    assert (address_stats.count, address_stats.min, address_stats.max, address_stats.variance) == (3, -80, -60, 200 / 3)
+    # Adverts carry the time they were captured, not the time they were processed
+    assert [event["timestamp"] for event in events if event["event"] == "device_seen"] == [1700000000.25]
+    assert sniffer_db.execute("SELECT count FROM logs WHERE mac_address = 'aa:bb:cc:00:00:01'").fetchone()[0] == 1
+
+# Test that the nRF Sniffer interface is picked from the tshark interfaces and that a quiet live capture can be stopped
+def test_live_capture_interface_and_stop():
+    interfaces = [{"index": "1", "name": "eth0", "description": "Ethernet"},
+                  {"index": "2", "name": "/dev/ttyACM0-4.4", "description": "nRF Sniffer for Bluetooth LE"}]
+    assert find_nrf_interface(interfaces) == "/dev/ttyACM0-4.4"
+    assert find_nrf_interface(interfaces, "eth0") == "eth0"
+    assert find_nrf_interface(interfaces, "COM9-4.4") is None
+    assert find_nrf_interface(interfaces[:1]) is None
+    assert check_for_nrf_sniffer(None, "tshark") is False
+    assert check_for_nrf_sniffer(None, "bluetoothctl") is True
+
+    stop_event = threading.Event()
+    command = [sys.executable, "-c", "import time; print('aa:bb:cc:00:00:01\\t-50', flush=True); time.sleep(30)"]
+    readings = live_readings(command=command, stop_event=stop_event)
+    assert next(readings) == ("aa:bb:cc:00:00:01", -50, None)
+    threading.Timer(0.2, stop_event.set).start()
+    started = time.monotonic()
+    assert list(readings) == []
+    assert time.monotonic() - started < 2
+
+# Test that batched presence estimates match advert by advert updates and reach match events and log rows
+def test_presence_estimation(sniffer_db):
+    macs = ["aa:00:00:00:00:01", "aa:00:00:00:00:02", "aa:00:00:00:00:01", "aa:00:00:00:00:01", "aa:00:00:00:00:02"]
+    rssi = [-60, -70, -64, -62, -72]
+    timestamps = [0.0, 0.5, 1.0, 2.0, 1.5]
+    batched, sequential = PresenceEstimator(), PresenceEstimator()
+    batched.update(macs, rssi, timestamps)
+    for advert in sorted(zip(macs, rssi, timestamps), key=lambda advert: advert[2]):
+        sequential.update([advert[0]], [advert[1]], [advert[2]])
+    assert batched.estimate()["rssi"].tolist() == pytest.approx(sequential.estimate()["rssi"].tolist())
+
+    assert float(rssi_to_distance(-59)) == pytest.approx(1.0)
+    assert calibrate_tx_power([-65, -66, -90], 2) == pytest.approx(-66 + 20 * 0.30103, abs=0.01)
+    calibrated = PresenceEstimator(tx_power={"aa:00:00:00:00:01": -50})
+    calibrated.update(["aa:00:00:00:00:01"], [-50], [0.0])
+    assert calibrated.get("aa:00:00:00:00:01")["distance"] == 1.0
+    assert calibrated.get("aa:00:00:00:00:01", now=60)["presence"] < calibrated.get("aa:00:00:00:00:01")["presence"]
+    assert calibrated.get("aa:00:00:00:00:02") is None
+
+    matches = []
+    device_data = [{"mac_address": "11:22:33:44:55:66", "device_name": "Tag", "email": "test@example.com"}]
+    scanner = Sniffer(number_of_packets=10, scan_time=5, user_data=[], device_data=device_data,
+                      output=lambda event: matches.append(event) if event["event"] == MATCH else None,
+                      notifier=RecordingNotifier(), throttle=NotificationThrottle(), estimator=PresenceEstimator())
+    scanner.run_tshark(readings=[("11:22:33:44:55:66", -59), ("11:22:33:44:55:66", -61)])
+    assert matches[0]["distance"] == 1.0 and 0 < matches[0]["presence"] <= 1
+    distance, presence = sniffer_db.execute("SELECT distance, presence FROM presence_estimate WHERE mac_address = '11:22:33:44:55:66'").fetchone()
+    assert 1.0 < distance < rssi_to_distance(-61) and presence > 0
+    assert fetch_logs_changed_since()[1][0]["distance"] == distance
+
+# Test that the synthetic bluetoothctl feed drives a scan and the benchmark suite flags regressions
+def test_benchmark_feed_and_baseline(sniffer_db, tmp_path):
+    events = []
+    scanner = Sniffer(number_of_packets=5, scan_time=5, user_data=[], device_data=[], sniffer_mode="bluetoothctl",
+                      session=BluetoothctlSession(command=fake_bluetoothctl_command(str(tmp_path), devices=5, rate=500)),
+                      output=events.append, notifier=RecordingNotifier())
+    result = scanner.run_bluetoothctl()
+    scanner.session.close()
+    assert sorted(d["mac_address"] for d in result) == [bench_mac(i) for i in range(5)]
+    assert events[-1]["event"] == SCAN_END
+
+    baseline = {"scan": {"throughput": 1000, "p50_ms": 10, "p99_ms": 20, "peak_rss_mb": 50}}
+    assert compare({"scan": {"throughput": 900, "unit": "adverts/s", "p50_ms": 11, "p99_ms": 25, "peak_rss_mb": 55}}, baseline) == []
+    regressions = compare({"scan": {"throughput": 500, "unit": "adverts/s", "p50_ms": 30, "p99_ms": 20, "peak_rss_mb": 50}}, baseline)
+    assert [regression.split()[1] for regression in regressions] == ["throughput", "p50_ms"]
+    assert compare({"scan": {"error": "boom"}}, baseline) == ["scan: failed, boom"]
+
+# Test that bluetoothctl lines are parsed into device updates, including multi line manufacturer data
+def test_bluetoothctl_parser():
+    parser = BluetoothctlParser()
+    assert parser.feed("\x1b[0;94m[bluetooth]\x1b[0m# [\x1b[0;92mNEW\x1b[0m] Device AA:BB:CC:DD:EE:01 Phone\n") == \
+        [{"action": "new", "mac_address": "AA:BB:CC:DD:EE:01", "device_name": "Phone"}]
+    assert parser.feed("[CHG] Device AA:BB:CC:DD:EE:01 RSSI: 0xffffffc4 (-60)") == \
+        [{"action": "chg", "mac_address": "AA:BB:CC:DD:EE:01", "rssi": -60}]
+    assert parser.feed("[CHG] Device AA:BB:CC:DD:EE:01 TxPower: -8")[0]["tx_power"] == -8
+    assert parser.feed("[CHG] Device AA:BB:CC:DD:EE:01 ManufacturerData Key: 0x004c (76)")[0]["manufacturer_id"] == 0x4c
+    assert parser.feed("[CHG] Device AA:BB:CC:DD:EE:01 ManufacturerData Value:") == []
+    assert parser.feed("  02 15 e2 c5 6d b5 df fb 48 d2 b0 60 d0 f5 a7 10  ....m...H..`....") == []
+    assert parser.feed("  96 e0                                            ..") == []
+    updates = parser.feed("[DEL] Device AA:BB:CC:DD:EE:01 Phone")
+    assert updates[0]["manufacturer_data"] == "0215e2c56db5dffb48d2b060d0f5a71096e0"
+    assert updates[1] == {"action": "del", "mac_address": "AA:BB:CC:DD:EE:01"}
+    assert parser.feed("[bluetooth]# Discovery started") == [] and parser.flush() == []
+
+# Test that a quiet bluetoothctl scan ends on its deadline and that stop() ends it straight away
+def test_bluetoothctl_scan_deadline(sniffer_db):
+    quiet = [sys.executable, "-c", "import sys\nfor line in sys.stdin:\n    if line.strip() == 'exit': break"]
+    scanner = Sniffer(number_of_packets=5, scan_time=0.3, user_data=[], device_data=[], sniffer_mode="bluetoothctl",
+                      session=BluetoothctlSession(command=quiet), output=lambda event: None, notifier=RecordingNotifier())
+    start = time.monotonic()
+    assert [event for event in scanner.scan_events() if event is not None] == []
+    assert 0.3 <= time.monotonic() - start < 0.35
+
+    scanner.scan_time = 30
+    threading.Timer(0.1, scanner.stop).start()
+    start = time.monotonic()
+    list(scanner.scan_events())
+    assert time.monotonic() - start < 0.2
+    scanner.session.close()
+
+# Fixture to run a mock bluetoothd with one adapter, hci0, on a private system bus
+@pytest.fixture
+def bluez_mock():
+    dbusmock = pytest.importorskip("dbusmock")
+    pytest.importorskip("dbus_next")
+    import dbus
+    if shutil.which("dbus-daemon") is None:
+        pytest.skip("dbus-daemon is not installed")
+
+    dbusmock.DBusTestCase.start_system_bus()
+    server, manager = dbusmock.DBusTestCase.spawn_server_template("bluez5", {}, stdout=subprocess.DEVNULL)
+    mock = dbus.Interface(manager, "org.bluez.Mock")
+    mock.AddAdapter("hci0", "scanner")
+    try:
+        yield mock, dbusmock.DBusTestCase.get_dbus(system_bus=True)
+    finally:
+        server.terminate()
+        server.wait()
+        dbusmock.DBusTestCase.tearDownClass()
+
+# Test that the bluez mode scans over D-Bus and turns device signals into device events
+def test_bluez_scan(sniffer_db, bluez_mock):
+    import dbus
+    import dbusmock
+    mock, bus = bluez_mock
+    events = []
+    scanner = Sniffer(number_of_packets=5, scan_time=1, user_data=[], device_data=[], sniffer_mode="bluez",
+                      session=BluezSession(adapter="hci0"), output=events.append, notifier=RecordingNotifier())
+
+    def advertise():
+        mock.AddDevice("hci0", "AA:BB:CC:DD:EE:01", "Beacon")
+        device = dbus.Interface(bus.get_object("org.bluez", "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_01"), dbusmock.MOCK_IFACE)
+        device.UpdateProperties("org.bluez.Device1", {"RSSI": dbus.Int16(-60), "TxPower": dbus.Int16(-8)})
+
+    threading.Timer(0.2, advertise).start()
+    result = scanner.run_bluetoothctl()
+    scanner.session.close()
+
+    assert [device["mac_address"] for device in result] == ["aa:bb:cc:dd:ee:01"]
+    seen = [event for event in events if event["event"] == DEVICE_SEEN]
+    assert seen[0]["device_name"] == "Beacon"
+    assert any(event["rssi"] == -60 and event["tx_power"] == -8 for event in seen)
+    assert events[-1]["event"] == SCAN_END
+
+FAKE_REPLAY_BLUETOOTHCTL = """import sys
+lines = open(sys.argv[1]).read().splitlines()
+for line in sys.stdin:
+    if line.strip() == "scan on":
+        for output in lines:
+            print(output, flush=True)
+    elif line.strip() == "exit":
+        break
+"""
+
+# Test that multi adapter scans merge the adapters into one feed with the best RSSI per adapter
+def test_multi_adapter_scan(sniffer_db, tmp_path):
+    script = tmp_path / "replay_bluetoothctl.py"
+    script.write_text(FAKE_REPLAY_BLUETOOTHCTL)
+    canned = {
+        "hci0": ["[NEW] Device AA:BB:CC:00:00:01 Tag", "[CHG] Device AA:BB:CC:00:00:01 RSSI: -70",
+                 "[NEW] Device AA:BB:CC:00:00:02 Other", "[CHG] Device AA:BB:CC:00:00:02 RSSI: -80"],
+        "hci1": ["[NEW] Device AA:BB:CC:00:00:01 Tag", "[CHG] Device AA:BB:CC:00:00:01 RSSI: -50",
+                 "[CHG] Device AA:BB:CC:00:00:01 RSSI: -65"],
+    }
+    sessions = {}
+    for name, lines in canned.items():
+        (tmp_path / f"{name}.txt").write_text("\n".join(lines) + "\n")
+        sessions[name] = BluetoothctlSession(command=[sys.executable, "-u", str(script), str(tmp_path / f"{name}.txt")])
+    sessions["nrf"] = CaptureSession(command=[sys.executable, "-u", "-c",
+                                              "import time\nprint('aa:bb:cc:00:00:03\\t-40\\t1700000000.5\\naa:bb:cc:00:00:01\\t-90')\ntime.sleep(30)"])
+
+    events = []
+    scanner = Sniffer(number_of_packets=10, scan_time=1, user_data=[], device_data=[], sniffer_mode="multi",
+                      session=MultiAdapterSession(sessions, dedup_window=60), output=events.append, notifier=RecordingNotifier())
+    result = {device["mac_address"]: device for device in scanner.run_bluetoothctl()}
+    scanner.session.close()
+
+    assert sorted(result) == ["aa:bb:cc:00:00:01", "aa:bb:cc:00:00:02", "aa:bb:cc:00:00:03"]
+    assert result["aa:bb:cc:00:00:01"]["adapter_rssi"] == {"hci0": -70, "hci1": -50, "nrf": -90}
+    assert result["aa:bb:cc:00:00:03"]["adapter_rssi"] == {"nrf": -40}
+    # The repeated, weaker hci1 report is dropped, everything else of the device passes once
+    seen = [event for event in events if event["event"] == DEVICE_SEEN and event["mac_address"] == "aa:bb:cc:00:00:01"]
+    assert len(seen) == 5 and -65 not in [event["rssi"] for event in seen]
+    # nRF Sniffer adverts keep the capture time tshark reported
+    assert [event["timestamp"] for event in events if event["event"] == DEVICE_SEEN and event["mac_address"] == "aa:bb:cc:00:00:03"] == [1700000000.5]
+
+# Test that the agent spool seals sightings into numbered batches that survive a restart
+def test_agent_spool(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = SightingSpool("node-1", path=path, max_batches=2)
+    spool.add([{"mac_address": bench_mac(i), "device_name": None, "timestamp": 100.0 + i, "rssi": -60} for i in range(5)])
+    assert spool.seal(batch_size=2) == 3
+    # Only the newest max_batches are kept
+    assert spool.backlog() == 3
+
+    sequence, payload = spool.next_batch()
+    batch = json.loads(gzip.decompress(payload))
+    assert batch["agent_id"] == "node-1" and batch["sequence"] == sequence
+    assert [sighting["mac_address"] for sighting in batch["sightings"]] == [bench_mac(2), bench_mac(3)]
+
+    restarted = SightingSpool("node-1", path=path)
+    restarted.ack(sequence)
+    restarted.add([{"mac_address": bench_mac(9), "device_name": "Tag", "timestamp": 200.0, "rssi": None}])
+    restarted.seal()
+    assert restarted.next_batch()[0] == sequence + 1
+    restarted.ack(sequence + 1)
+    assert restarted.next_batch()[0] == sequence + 2
+
+class LocalIngestHandler(socketserver.StreamRequestHandler):
+    """
+        Just enough HTTP for one POST /ingest per connection, stands in for the dashboard.
+        Drops the connection instead of answering the first batch.
+    """
+    def handle(self):
+        self.rfile.readline()
+        headers = {}
+        for raw in iter(self.rfile.readline, b"\r\n"):
+            name, _, value = raw.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = self.rfile.read(int(headers["content-length"]))
+        self.server.batches.append((headers["authorization"], json.loads(gzip.decompress(body))))
+        if len(self.server.batches) > 1:
+            self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{}")
+
+# Test that an agent process spools while the dashboard is down and resends a batch whose answer was lost
+def test_agent_ships_through_outage(tmp_path):
+    fake = tmp_path / "fake_bluetoothctl"
+    fake.write_text(f"#!{sys.executable} -u\n" + FAKE_BLUETOOTHCTL)
+    fake.chmod(0o755)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    spool_path = str(tmp_path / "spool.db")
+    agent_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sniffer", "agent.py")
+    with open(tmp_path / "agent.log", "w") as log:
+        agent = subprocess.Popen([sys.executable, "-u", agent_py, "--url", f"http://127.0.0.1:{port}", "--agent-id", "node-1",
+                                  "--token", "secret", "--spool", spool_path, "--window", "0.5", "--mode", "bluetoothctl",
+                                  "--bluetoothctl", str(fake)], cwd=tmp_path, stdout=log, stderr=subprocess.STDOUT)
+    server = None
+    try:
+        spool = SightingSpool("node-1", path=spool_path)
+        deadline = time.monotonic() + 20
+        while spool.backlog() < 6 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        offline = spool.backlog()
+        assert offline >= 6
+
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", port), LocalIngestHandler)
+        server.daemon_threads = True
+        server.batches = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        delivered = {}
+        while sum(delivered.values()) < offline and time.monotonic() < deadline + 10:
+            time.sleep(0.1)
+            delivered = {batch["sequence"]: len(batch["sightings"]) for _, batch in list(server.batches)[1:]}
+    finally:
+        agent.send_signal(signal.SIGTERM)
+        agent.wait(timeout=15)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    assert sum(delivered.values()) >= offline
+    batches = [batch for _, batch in server.batches]
+    # The batch whose answer was lost comes again as it was, later ones follow in order
+    assert batches[0] == batches[1]
+    sequences = [batch["sequence"] for batch in batches[1:]]
+    assert sequences == sorted(set(sequences))
+    assert all(authorization == "Bearer secret" for authorization, _ in server.batches)
+    assert {sighting["mac_address"] for batch in batches for sighting in batch["sightings"]} == \
+        {"aa:bb:cc:00:00:00", "aa:bb:cc:00:00:01", "aa:bb:cc:00:00:02"}
+    assert agent.returncode == 0
+
+# Test that the sharded ingest service aggregates devices and sighting rollups across shards, answers resends once
+# and refuses to start next to a running service
+def test_ingest_service(sniffer_db, tmp_path):
+    socket_path = str(tmp_path / "ingest.sock")
+    ingest_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sniffer", "ingest.py")
+    service = subprocess.Popen([sys.executable, "-u", ingest_py, "--socket", socket_path, "--workers", "3"], cwd=tmp_path)
+    try:
+        deadline = time.monotonic() + 10
+        while send_ingest_command(socket_path, {"command": "ping"}, timeout=0.5) is None and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        macs = ["aa:bb:cc:00:00:%02x" % i for i in range(12)] + ["11:22:33:44:55:66"]
+        assert len({shard_of(mac, 3) for mac in macs}) == 3
+
+        def batch(agent_id, sequence, rssi):
+            return {"command": "ingest", "agent_id": agent_id, "sequence": sequence,
+                    "sightings": [[mac, 1000 + sequence, rssi] for mac in macs]}
+
+        replies = []
+        senders = [threading.Thread(target=lambda command: replies.append(send_ingest_command(socket_path, command)),
+                                    args=(batch(agent_id, sequence, -40 - sequence),))
+                   for agent_id in ("node-1", "node-2") for sequence in (1, 2)]
+        senders.append(threading.Thread(target=lambda: replies.append(send_ingest_command(socket_path, batch("node-1", 1, -41)))))
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        later = send_ingest_command(socket_path, batch("node-1", 3, -43))
+        resent = send_ingest_command(socket_path, batch("node-2", 2, -42))
+
+        second = subprocess.run([sys.executable, "-u", ingest_py, "--socket", socket_path, "--workers", "1"], cwd=tmp_path,
+                                capture_output=True, text=True, timeout=30)
+        assert second.returncode == 1 and "Another process is serving" in second.stdout
+        assert send_ingest_command(socket_path, {"command": "ping"})["workers"] == 3
+    finally:
+        service.send_signal(signal.SIGTERM)
+        service.wait(timeout=15)
+
+    assert sorted(reply["duplicate"] for reply in replies) == [False, False, False, False, True]
+    assert later["scan_number"] > max(reply["scan_number"] or 0 for reply in replies)
+    assert resent == {"scan_number": None, "duplicate": True}
+
+    logs = {row[0]: row[1:] for row in sniffer_db.execute(
+        "SELECT mac_address, device_vendor, target_device, first_seen, last_seen, count, scan_number FROM logs")}
+    assert logs["11:22:33:44:55:66"] == ("Registered Vendor", 1, 1001, 1003, 5, later["scan_number"])
+    assert all(row[2:5] == (1001, 1003, 5) for row in logs.values())
+    assert sniffer_db.execute("SELECT COUNT(*), SUM(sightings) FROM ingest_batch").fetchone() == (5, 5 * len(macs))
+    # Shards roll the sightings up themselves, none of them is a raw sighting row
+    assert sniffer_db.execute("SELECT COUNT(*) FROM sighting").fetchone()[0] == 0
+    for bucket in ("minute", "hour", "day"):
+        rollups = sniffer_db.execute("SELECT sightings, rssi_count, rssi_sum, rssi_min, rssi_max, first_seen, last_seen "
+                                     "FROM sighting_rollup WHERE bucket = ? AND mac_address = ?", (bucket, macs[0])).fetchall()
+        assert rollups == [(5, 5, -41 * 2 - 42 * 2 - 43, -43, -41, 1001, 1003)]
+    assert not os.path.exists(socket_path)
+
+# Test that an ingest epoch holding a batch another writer took first leaves only that batch out
+def test_ingest_aggregates_duplicate_batch(sniffer_db):
+    ingest_batch("node-1", 1, [{"mac_address": "aa:bb:cc:00:00:01", "timestamp": 1000, "rssi": -50}])
+    parts = [(("node-1", 1), [("aa:bb:cc:00:00:01", "Unknown", 1, 1000, 1000)],
+              [("aa:bb:cc:00:00:01", 960, 1, 1, -50, -50, -50, 1000, 1000)]),
+             (("node-2", 1), [("aa:bb:cc:00:00:01", "Unknown", 1, 1001, 1001), ("aa:bb:cc:00:00:02", "Unknown", 1, 1001, 1001)],
+              [("aa:bb:cc:00:00:01", 960, 1, 1, -60, -60, -60, 1001, 1001), ("aa:bb:cc:00:00:02", 960, 1, 0, 0, None, None, 1001, 1001)])]
+
+    scan_number, duplicates = ingest_aggregates([("node-1", 1, 1), ("node-2", 1, 2)], parts)
+    assert scan_number is not None and duplicates == [("node-1", 1)]
+    logs = dict(sniffer_db.execute("SELECT mac_address, count FROM logs").fetchall())
+    assert logs == {"aa:bb:cc:00:00:01": 2, "aa:bb:cc:00:00:02": 1}
+    assert sniffer_db.execute("SELECT COUNT(*) FROM ingest_batch").fetchone()[0] == 2
+    assert sniffer_db.execute("SELECT sightings, rssi_sum, rssi_min FROM sighting_rollup WHERE bucket = 'day' "
+                              "ORDER BY mac_address").fetchall() == [(2, -110, -60), (1, 0, None)]
+
+    # An epoch of duplicates only writes nothing and takes its scan number back
+    assert ingest_aggregates([("node-2", 1, 2)], parts[1:]) == (None, [("node-2", 1)])
+
+# Test that agent batches end up as the same logs rows and sighting rollups with and without the ingest service
+def test_ingest_paths_write_the_same_rows(sniffer_db, tmp_path):
+    service_dir = tmp_path / "service"
+    os.makedirs(service_dir / "outputs")
+    service_db = sqlite3.connect(service_dir / "outputs" / "devices.db")
+    sniffer_db.backup(service_db)
+
+    batches = [("node-1", 1, [["aa:bb:cc:00:00:01", 1000, -50], ["aa:bb:cc:00:00:01", 1070, -70], ["11:22:33:44:55:66", 1000, None]]),
+               ("node-2", 1, [["aa:bb:cc:00:00:01", 990, -40], ["aa:bb:cc:00:00:02", 1010, None]]),
+               ("node-1", 2, [["aa:bb:cc:00:00:02", 1200, -65]]),
+               ("node-1", 1, [["aa:bb:cc:00:00:01", 1000, -50]])]
+
+    socket_path = str(tmp_path / "ingest.sock")
+    ingest_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sniffer", "ingest.py")
+    service = subprocess.Popen([sys.executable, "-u", ingest_py, "--socket", socket_path, "--workers", "2"], cwd=service_dir)
+    try:
+        deadline = time.monotonic() + 10
+        while send_ingest_command(socket_path, {"command": "ping"}, timeout=0.5) is None and time.monotonic() < deadline:
+            time.sleep(0.1)
+        service_replies = [send_ingest_command(socket_path, {"command": "ingest", "agent_id": agent_id, "sequence": sequence,
+                                                             "sightings": sightings})["duplicate"]
+                           for agent_id, sequence, sightings in batches]
+    finally:
+        service.send_signal(signal.SIGTERM)
+        service.wait(timeout=15)
+    request_replies = [ingest_batch(agent_id, sequence, [{"mac_address": mac, "timestamp": timestamp, "rssi": rssi}
+                                                         for mac, timestamp, rssi in sightings]) is None
+                       for agent_id, sequence, sightings in batches]
+
+    def rows(conn):
+        return (conn.execute("SELECT mac_address, device_vendor, target_device, first_seen, last_seen, count "
+                             "FROM logs ORDER BY mac_address").fetchall(),
+                conn.execute("SELECT * FROM sighting_rollup ORDER BY bucket, bucket_start, mac_address").fetchall(),
+                conn.execute("SELECT COUNT(*) FROM sighting").fetchone()[0])
+
+    assert service_replies == request_replies == [False, False, False, True]
+    logs, rollups, raw_sightings = rows(sniffer_db)
+    assert (logs, rollups, raw_sightings) == rows(service_db)
+    assert ("aa:bb:cc:00:00:01", "Unknown", 0, 990, 1070, 3) in logs
+    # Five device minutes, three devices per hour and per day
+    assert len(rollups) == 5 + 3 + 3 and raw_sightings == 0
+    service_db.close()
+
+# Test that a scan reports adverts, duration, update_logs time and DB queries once, as a metrics event
+def test_scan_metrics_event(sniffer_db):
+    events = []
+    scanner = Sniffer(number_of_packets=10, scan_time=5, user_data=[], device_data=[], output=events.append,
+                      notifier=RecordingNotifier(), throttle=NotificationThrottle())
+    scanner.report_metrics()
+    scanner.run_tshark(readings=[("aa:00:00:00:00:01", -60), ("aa:00:00:00:00:02", -70), ("aa:00:00:00:00:01", -65)])
+
+    assert [event["event"] for event in events[-2:]] == [METRICS, SCAN_END]
+    metrics = events[-2]["metrics"]
+    assert metrics["sniffer_adverts_parsed_total"]["value"] == 3
+    assert metrics["sniffer_scans_total"]["value"] == 1
+    assert metrics["sniffer_update_logs_seconds"]["count"] == 1
+    assert metrics["sniffer_scan_db_queries"]["count"] == 1 and metrics["sniffer_db_queries_total"]["value"] > 0
+
+    scanner.report_metrics()
+    assert events[-1]["metrics"]["sniffer_adverts_parsed_total"]["value"] == 0
+
+# Test that pooled connections are reused, run in WAL mode and come back without open transactions
+def test_connection_pool(tmp_path):
+    pool = get_pool(str(tmp_path / "pool.db"))
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE item (value INTEGER)")
+    conn.execute("INSERT INTO item VALUES (1)")
+    conn.close()
+
+    reused = pool.acquire()
+    assert reused is conn
+    assert reused.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert reused.execute("SELECT COUNT(*) FROM item").fetchone()[0] == 0
+    pool.close_all()
+
+# Test vendor resolution for OUIs and longer MA-M/MA-S prefixes in any MAC notation
+def test_vendor_resolver():
+    resolver = VendorResolver([("00:00:0a", "OUI"), ("70:B3:D5", "MA-L"), ("70:B3:D5:2", "MA-M"), ("70:B3:D5:2A:0", "MA-S")])
+    assert resolver.lookup("00-00-0A-12-34-56") == "OUI"
+    assert resolver.lookup("70:b3:d5:2a:01:02") == "MA-S"
+    assert resolver.lookup("70:b3:d5:2b:01:02") == "MA-M"
+    assert resolver.lookup("70b3d5ff0102") == "MA-L"
+    assert resolver.lookup_many(["00:00:0a:00:00:00", "zz:zz:zz:00:00:00"]) == ["OUI", "Unknown"]
+
+# Test that the device index matches regardless of MAC formatting and follows refreshes
+def test_device_index_matching():
+    device = {"mac_address": "AA-BB-CC-DD-EE-FF", "device_name": "Tag", "email": "test@example.com"}
+    scanner = Sniffer(number_of_packets=1, scan_time=1, user_data=[], device_data=[device], output=lambda message: None)
+    assert scanner.match_device("aa:bb:cc:dd:ee:ff") == [device]
+
+    scanner.refresh(user_data=[], device_data=[])
+    assert scanner.match_device("aa:bb:cc:dd:ee:ff") == []
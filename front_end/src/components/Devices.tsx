@@ -14,6 +14,11 @@ interface Device {
   email: string;
 }
 
+interface DevicesPage {
+  items: Device[];
+  next_cursor: string | null;
+}
+
 const DevicesWrapper = styled.div`
   width: 100%;
   height: 100%;
@@ -133,10 +138,18 @@ const Devices: React.FC = () => {
       return;
     }
     try {
-      const response = await axios.get<Device[]>("http://127.0.0.1:5000/devices", {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      setDevices(response.data);
+      // Registered devices are few, so walk every page
+      const allDevices: Device[] = [];
+      let cursor: string | null = null;
+      do {
+        const response: { data: DevicesPage } = await axios.get<DevicesPage>("http://127.0.0.1:5000/devices", {
+          headers: { Authorization: `Bearer ${token}` },
+          params: cursor ? { cursor } : {},
+        });
+        allDevices.push(...response.data.items);
+        cursor = response.data.next_cursor;
+      } while (cursor);
+      setDevices(allDevices);
     } catch (err) {
       console.error("Failed to fetch device data", err);
       handleLogout();
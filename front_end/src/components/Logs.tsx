@@ -4,6 +4,7 @@ import styled from "styled-components";
 import axios from "axios";
 import { FaSearch } from "react-icons/fa";
 import { handleLogout } from "../functions/AuthFunctions";
+import { useWebSocket } from "../functions/WebSocketContext";
 
 interface Log {
   mac_address: string;
@@ -13,8 +14,48 @@ interface Log {
   last_seen: string;
   count: number;
   scan_number: number;
+  // Latest estimate from the sniffer, null for devices without an RSSI reading
+  distance: number | null;
+  presence: number | null;
 }
 
+interface HighWaterMark {
+  change_seq: number;
+  scan_number: number;
+  last_seen: number;
+}
+
+interface LogsPage {
+  items: Log[];
+  next_cursor: string | null;
+  high_water_mark: HighWaterMark;
+}
+
+interface LogsDelta {
+  items: Log[];
+  high_water_mark: HighWaterMark;
+  // change_seq the push starts after
+  since: number;
+}
+
+// Replaces the rows that changed in place and puts new MAC Addresses first
+const mergeLogs = (current: Log[], changed: Log[]): Log[] => {
+  const changedByMac = new Map(changed.map((log) => [log.mac_address, log]));
+  const updated = current.map((log) => changedByMac.get(log.mac_address) ?? log);
+  const known = new Set(current.map((log) => log.mac_address));
+  return [...changed.filter((log) => !known.has(log.mac_address)), ...updated];
+};
+
+// The server matches the start of MAC Addresses and vendors, the same match is applied to pushed rows
+const matchesSearch = (log: Log, search: string): boolean => {
+  const term = search.toLowerCase();
+  return log.mac_address.toLowerCase().startsWith(term) || log.device_vendor.toLowerCase().startsWith(term);
+};
+
+const LOGS_PAGE_SIZE = 500;
+// Milliseconds the search input has to rest before the logs are fetched again
+const SEARCH_DELAY = 300;
+
 const PageSpan = styled.span`
   padding: 20px;
   flex: 1;
@@ -77,6 +118,12 @@ const Button = styled.button`
   }
 `;
 
+const SortNote = styled.p`
+  margin-top: 15px;
+  color: var(--text-dark);
+  font-size: 14px;
+`;
+
 const Table = styled.table`
   width: 80%;
   border-collapse: collapse;
@@ -106,8 +153,11 @@ const Td = styled.td`
 const Logs: React.FC = () => {
   const [logs, setLogs] = useState<Log[]>([]);
   const [searchTerm, setSearchTerm] = useState("");
+  const [search, setSearch] = useState("");
   const [error, setError] = useState<string | null>(null);
   const [isRefreshing, setIsRefreshing] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [highWaterMark, setHighWaterMark] = useState<HighWaterMark | null>(null);
   const [sortConfig, setSortConfig] = useState<{
     key: keyof Log;
     direction: "asc" | "desc";
@@ -116,9 +166,10 @@ const Logs: React.FC = () => {
   const [currentPage, setCurrentPage] = useState(1);
   const itemsPerPage = 15;
   const navigate = useNavigate();
+  const { socket } = useWebSocket();
 
-  // ✅ Fetching logs
-  const fetchLogs = useCallback(async () => {
+  // ✅ Fetching logs, one page at a time (most recently seen first)
+  const fetchLogs = useCallback(async (cursor: string | null = null) => {
     const token = localStorage.getItem("token");
     if (!token) {
       setError("No token found, please login");
@@ -129,10 +180,15 @@ const Logs: React.FC = () => {
 
     setIsRefreshing(true);
     try {
-      const response = await axios.get<Log[]>("http://127.0.0.1:5000/logs", {
+      const response = await axios.get<LogsPage>("http://127.0.0.1:5000/logs", {
         headers: { Authorization: `Bearer ${token}` },
+        params: { limit: LOGS_PAGE_SIZE, ...(search ? { search } : {}), ...(cursor ? { cursor } : {}) },
       });
-      setLogs(response.data);
+      setLogs((prev) => (cursor ? [...prev, ...response.data.items] : response.data.items));
+      setNextCursor(response.data.next_cursor);
+      if (!cursor) {
+        setHighWaterMark(response.data.high_water_mark);
+      }
     } catch (err) {
       console.error("Failed to fetch logs", err);
       setError("Failed to fetch logs");
@@ -141,30 +197,76 @@ const Logs: React.FC = () => {
     } finally {
       setIsRefreshing(false);
     }
-  }, [navigate]);
+  }, [navigate, search]);
+
+  // 🔁 Refreshing only fetches the rows written since the last sync
+  const refreshLogs = useCallback(async () => {
+    if (!highWaterMark) {
+      return fetchLogs();
+    }
+
+    const token = localStorage.getItem("token");
+    setIsRefreshing(true);
+    try {
+      let changed: Log[] = [];
+      let cursor: string | null = null;
+      let latest: HighWaterMark | null = null;
+      do {
+        const response: { data: LogsPage } = await axios.get<LogsPage>("http://127.0.0.1:5000/logs", {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { limit: LOGS_PAGE_SIZE, since_change: highWaterMark.change_seq, ...(search ? { search } : {}), ...(cursor ? { cursor } : {}) },
+        });
+        changed = [...changed, ...response.data.items];
+        latest = latest ?? response.data.high_water_mark;
+        cursor = response.data.next_cursor;
+      } while (cursor);
+
+      setLogs((prev) => mergeLogs(prev, changed));
+      setHighWaterMark(latest);
+    } catch (err) {
+      console.error("Failed to refresh logs", err);
+      setError("Failed to refresh logs");
+    } finally {
+      setIsRefreshing(false);
+    }
+  }, [fetchLogs, highWaterMark, search]);
+
+  // ⌨️ Searching runs on the server once typing pauses
+  useEffect(() => {
+    const timer = setTimeout(() => setSearch(searchTerm.trim()), SEARCH_DELAY);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
 
   useEffect(() => {
     fetchLogs();
   }, [fetchLogs]);
 
-  // 🔍 Filter logic (case-insensitive, multi-field search)
-  const filteredLogs = useMemo(() => {
-    const search = searchTerm.trim().toLowerCase();
-    return logs.filter((log) => {
-      const firstSeenFormatted = new Date(parseInt(log.first_seen) * 1000).toLocaleString().toLowerCase();
-      const lastSeenFormatted = new Date(parseInt(log.last_seen) * 1000).toLocaleString().toLowerCase();
-  
-      return (
-        log.mac_address.toLowerCase().includes(search) ||
-        log.device_vendor.toLowerCase().includes(search) ||
-        String(log.target_device).toLowerCase().includes(search) ||
-        firstSeenFormatted.includes(search) ||
-        lastSeenFormatted.includes(search) ||
-        String(log.count).toLowerCase().includes(search) ||
-        String(log.scan_number).toLowerCase().includes(search)
-      );
-    });
-  }, [logs, searchTerm]);
+  // 📡 Rows pushed by the server while a scan is writing logs
+  useEffect(() => {
+    if (!socket) return;
+
+    const handleDelta = (delta: LogsDelta) => {
+      if (!highWaterMark) {
+        // The first page is still loading and will include these rows
+        return;
+      }
+      if (delta.since > highWaterMark.change_seq) {
+        // Changes between our high water mark and the push are missing, fetch them instead
+        refreshLogs();
+        return;
+      }
+      if (delta.high_water_mark.change_seq <= highWaterMark.change_seq) {
+        return;
+      }
+      setLogs((prev) => mergeLogs(prev, delta.items.filter((log) => matchesSearch(log, search))));
+      setHighWaterMark(delta.high_water_mark);
+    };
+
+    socket.on("logs_delta", handleDelta);
+    return () => {
+      socket.off("logs_delta", handleDelta);
+    };
+  }, [socket, search, highWaterMark, refreshLogs]);
 
   // 🧠 Handle sorting config
   const handleSort = (column: keyof Log) => {
@@ -182,9 +284,9 @@ const Logs: React.FC = () => {
     setSortConfig({ key: column, direction, mode });
   };
 
-  // 🔃 Sorting logic
+  // 🔃 Sorting logic, orders the pages loaded so far
   const sortedLogs = useMemo(() => {
-    const sortableLogs = [...filteredLogs];
+    const sortableLogs = [...logs];
 
     if (!sortConfig) return sortableLogs;
 
@@ -225,7 +327,7 @@ const Logs: React.FC = () => {
     });
 
     return sortableLogs;
-  }, [filteredLogs, sortConfig]);
+  }, [logs, sortConfig]);
 
   // 📄 Pagination logic
   const currentLogs = useMemo(() => {
@@ -236,7 +338,7 @@ const Logs: React.FC = () => {
 
   useEffect(() => {
     setCurrentPage(1);
-  }, [searchTerm]);
+  }, [search]);
 
   return (
     <LogsWrapper>
@@ -245,22 +347,30 @@ const Logs: React.FC = () => {
         <SearchIcon />
         <SearchInput
           type="text"
-          placeholder="Search Logs"
+          placeholder="Search MAC Address or Vendor"
           value={searchTerm}
           onChange={(e) => setSearchTerm(e.target.value)}
         />
       </SearchContainer>
 
       <ButtonContainer>
-        <Button onClick={fetchLogs}>
+        <Button onClick={() => refreshLogs()}>
           {isRefreshing ? "Refreshing..." : "Refresh Logs"}
         </Button>
+        {nextCursor && (
+          <Button onClick={() => fetchLogs(nextCursor)} disabled={isRefreshing}>
+            Load More Logs
+          </Button>
+        )}
       </ButtonContainer>
 
       {error ? (
         <p>{error}</p>
       ) : (
         <>
+          {sortConfig && nextCursor && (
+            <SortNote>Sorting covers the {logs.length} logs loaded so far, load more to include older ones.</SortNote>
+          )}
           <Table>
             <thead>
               <tr>
@@ -285,6 +395,12 @@ const Logs: React.FC = () => {
                 <Th onClick={() => handleSort("scan_number")}>
                   Scan Number {sortConfig?.key === "scan_number" && (sortConfig.direction === "asc" ? "▲" : "▼")}
                 </Th>
+                <Th onClick={() => handleSort("distance")}>
+                  Distance {sortConfig?.key === "distance" && (sortConfig.direction === "asc" ? "▲" : "▼")}
+                </Th>
+                <Th onClick={() => handleSort("presence")}>
+                  Presence {sortConfig?.key === "presence" && (sortConfig.direction === "asc" ? "▲" : "▼")}
+                </Th>
               </tr>
             </thead>
             <tbody>
@@ -297,6 +413,8 @@ const Logs: React.FC = () => {
                   <Td>{new Date(parseInt(log.last_seen) * 1000).toLocaleString()}</Td>
                   <Td>{log.count}</Td>
                   <Td>{log.scan_number}</Td>
+                  <Td>{log.distance != null ? `${log.distance.toFixed(1)} m` : "-"}</Td>
+                  <Td>{log.presence != null ? `${Math.round(log.presence * 100)}%` : "-"}</Td>
                 </tr>
               ))}
             </tbody>
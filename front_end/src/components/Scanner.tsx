@@ -76,7 +76,7 @@ const TerminalBox = styled.div`
 `;
 
 const Scanner: React.FC = () => {
-  const { socket, connected, logMessages, scanning, setScanning, setLogMessages } = useWebSocket();
+  const { socket, connected, logMessages, matchedDevices, scanning, setScanning, setLogMessages } = useWebSocket();
   const navigate = useNavigate();
   const terminalRef = useRef<HTMLDivElement>(null);
 
@@ -154,6 +154,17 @@ const Scanner: React.FC = () => {
         </button>
       </div>
       <Status connected={connected}>{connected ? "Connected" : "Disconnected"}</Status>
+      {matchedDevices.length > 0 && (
+        <p>
+          Target devices found: {matchedDevices
+            .map((match) =>
+              match.distance != null
+                ? `${match.device_name} (${match.mac_address}, ~${match.distance.toFixed(1)} m)`
+                : `${match.device_name} (${match.mac_address})`
+            )
+            .join(", ")}
+        </p>
+      )}
       <TerminalBox ref={terminalRef}>
         {logMessages.map((msg, index) => (
           <p key={index}>{msg}</p>
@@ -2,10 +2,23 @@ import React, { createContext, useContext, useState, useEffect } from "react";
 import { io, Socket } from "socket.io-client";
 import { handleLogout } from "./AuthFunctions";
 
+// Typed sniffer events, see back_end/server/sniffer/events.py
+export interface ScanEvent {
+  event: "scan_start" | "device_seen" | "match" | "logs_updated" | "scan_end" | "error" | "message";
+  mac_address?: string;
+  device_name?: string;
+  timestamp?: number;
+  message?: string;
+  // Set on match events of devices with an RSSI reading
+  distance?: number;
+  presence?: number;
+}
+
 interface WebSocketContextType {
   socket: Socket | null;
   connected: boolean;
   logMessages: string[];
+  matchedDevices: ScanEvent[];
   scanning: boolean;
   setLogMessages: React.Dispatch<React.SetStateAction<string[]>>;
   setScanning: React.Dispatch<React.SetStateAction<boolean>>;
@@ -15,6 +28,7 @@ const WebSocketContext = createContext<WebSocketContextType>({
   socket: null,
   connected: false,
   logMessages: [],
+  matchedDevices: [],
   scanning: false,
   setLogMessages: () => {},
   setScanning: () => {},
@@ -24,6 +38,7 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
   const [socket, setSocket] = useState<Socket | null>(null);
   const [connected, setConnected] = useState(false);
   const [logMessages, setLogMessages] = useState<string[]>([]);
+  const [matchedDevices, setMatchedDevices] = useState<ScanEvent[]>([]);
   const [scanning, setScanning] = useState(false);
 
   useEffect(() => {
@@ -66,10 +81,21 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
       window.location.href = "/";
     });
   
+    // Scan output arrives in batches ({ messages }), status updates as single lines ({ message })
     newSocket.on("scan_update", (data) => {
       const timestamp = new Date().toLocaleString();
-      setLogMessages(prev => [...prev, `${timestamp} - ${data.message}`]);
+      const messages: string[] = data.messages ?? [data.message];
+      setLogMessages(prev => [...prev, ...messages.map((message) => `${timestamp} - ${message}`)]);
       setScanning(true);
+
+      const events: ScanEvent[] = data.events ?? [];
+      if (events.some((event) => event.event === "scan_start")) {
+        setMatchedDevices([]);
+      }
+      const matches = events.filter((event) => event.event === "match");
+      if (matches.length > 0) {
+        setMatchedDevices(prev => [...prev, ...matches]);
+      }
     });
   
     newSocket.on("scan_stop", () => {
@@ -90,7 +116,7 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
   
 
   return (
-    <WebSocketContext.Provider value={{ socket, connected, logMessages, scanning, setLogMessages, setScanning }}>
+    <WebSocketContext.Provider value={{ socket, connected, logMessages, matchedDevices, scanning, setLogMessages, setScanning }}>
       {children}
     </WebSocketContext.Provider>
   );